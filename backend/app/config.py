@@ -1,5 +1,22 @@
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
+
+class WorkerNode(BaseModel):
+    """
+    训练/推理节点配置，未填写的 SSH 账号和GPU容量使用全局配置
+    例如: {"name": "gpu1", "host": "10.0.0.11", "gpu_slots": 8, "gpu_memory_mb": 81920}
+    """
+    name: str
+    host: str
+    port: int = 22
+    username: Optional[str] = None
+    password: Optional[str] = None
+    key_path: Optional[str] = None
+    gpu_slots: Optional[int] = None
+    gpu_memory_mb: Optional[int] = None
+    # 停用的节点不再接收新任务，已有任务/模型仍可访问
+    enabled: bool = True
 
 class Settings(BaseSettings):
     # SSH 配置
@@ -9,25 +26,123 @@ class Settings(BaseSettings):
     ssh_password: Optional[str] = None
     ssh_key_path: Optional[str] = None
     remote_work_dir: str
+    # SSH 连接池配置
+    ssh_pool_max_size: int = 8  # 每台服务器最多保持的连接数
+    ssh_pool_idle_timeout: int = 300  # 空闲连接回收时间（秒）
+    ssh_pool_acquire_timeout: int = 30  # 连接池已满时等待可用连接的超时（秒）
+    ssh_max_channels_per_connection: int = 8  # 异步连接池中每条连接最多同时打开的 channel 数（需小于服务端 MaxSessions）
+    ssh_keepalive_interval: int = 30  # keepalive 发送间隔（秒），0 表示关闭
+    ssh_pool_health_check_idle: int = 60  # 连接空闲超过该时间（秒）后，复用前先探活，0 表示不探活
+    # 多节点配置（JSON 列表，见 WorkerNode），为空时只使用上面的 ssh_host 一台服务器
+    worker_nodes: List[WorkerNode] = []
+    # 各节点是否共享存储（如 NFS）；不共享时，任务被调度到数据集所在节点以外的节点会先传输数据集
+    worker_shared_storage: bool = False
     
     # 应用配置
     secret_key: str
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 1440
+    # 管理员用户名列表，只有管理员可以访问全局运行状态接口（如推理结果缓存统计）
+    admin_usernames: List[str] = []
+    
+    # 训练任务配置
+    # 启动训练后观察进程是否立即失败的时间窗口（秒），进程提前退出时立即返回；0 表示收到PID即返回
+    task_launch_watch_seconds: int = 0
+    # 后台任务监控：检查运行中任务状态的间隔（秒）
+    task_monitor_enabled: bool = True
+    task_monitor_interval: int = 30
+    # 没有记录PID也没有退出码的运行中任务（状态无法确定），超过该时间（秒）后标记为失败并释放GPU
+    task_unknown_grace_seconds: int = 600
+    # 单次增量读取训练日志返回的最大字节数
+    task_log_max_read_bytes: int = 1048576  # 1MB
+    # 实时日志流：未指定 offset/tail 时先补发的日志行数
+    log_stream_default_tail: int = 200
+    # 实时日志流：每个订阅者最多积压的数据块数，超出后断开该订阅者（客户端可按偏移重连）
+    log_stream_max_pending_chunks: int = 256
+    # 实时日志流：无新内容时发送心跳的间隔（秒），防止代理断开空闲连接
+    log_stream_heartbeat_interval: int = 15
+    # 训练调度：GPU卡数、单卡显存（MB）；新任务排队，容量空出后按优先级和用户公平性启动
+    # 多节点时作为未单独配置 gpu_slots/gpu_memory_mb 的节点的默认值
+    scheduler_gpu_slots: int = 1
+    # 单卡显存预算（MB），0 表示不按显存限制，只按卡数调度
+    scheduler_gpu_memory_mb: int = 0
+    # 任务未指定显存需求时按整卡显存计算
+    scheduler_default_task_memory_mb: int = 0
+    # 每个用户同时运行的任务数上限，0 表示不限制
+    scheduler_max_running_per_user: int = 0
     
     # 文件存储配置
     remote_user_data_dir: str
     max_upload_size: int = 104857600  # 100MB
+    # 流式上传：接收请求和写入远程文件之间最多缓冲的数据块数
+    upload_buffer_chunks: int = 16
+    # 分块上传：默认分块大小、最大分块大小（字节）、未完成的上传会话保留时间（小时）
+    upload_chunk_size: int = 8388608  # 8MB
+    upload_max_chunk_size: int = 67108864  # 64MB
+    upload_session_ttl_hours: int = 24
+    # 传输压缩（默认关闭）：发送端边读边压缩、接收端流式解压，用于数据集上传和节点间传输文件
+    # 可选 "gzip" 或 "zstd"（zstd 需要安装 zstandard，远程需要 zstd 命令）；小于 transfer_compression_min_size 的文件不压缩
+    transfer_compression: str = ""
+    transfer_compression_min_size: int = 1048576  # 1MB
+    transfer_compression_level: int = 0  # 0 表示使用默认级别（gzip 6，zstd 3）
+    # 数据集校验：上传和生成数据集时流式解析 JSON / JSONL 并校验 alpaca / sharegpt 格式，
+    # 无效记录比例超过 dataset_max_invalid_ratio 时拒绝；单条记录超过 dataset_max_record_bytes 视为格式错误
+    dataset_validation: bool = True
+    dataset_max_invalid_ratio: float = 0.0
+    dataset_max_record_bytes: int = 16777216  # 16MB
     
     # 对话推理配置
     chat_script_path: str
     chat_timeout: int = 300
-    # 使用交互式CLI还是Python脚本（"cli" 或 "script"）
+    # 使用交互式CLI、Python脚本还是常驻推理进程（"cli"、"script" 或 "worker"）
     chat_mode: str = "cli"
+    # cli模式下与包装脚本的交互方式："pexpect"（驱动交互式 llamafactory-cli chat 并解析输出）
+    # 或 "jsonl"（包装脚本在进程内调用 ChatModel，通过 stdin/stdout 收发 JSON lines）
+    chat_cli_protocol: str = "pexpect"
     # LlamaFactory CLI路径（如果使用cli模式）
     llamafactory_cli_path: str = "llamafactory-cli"
     # Conda环境名称（如果需要激活conda环境，留空则不激活）
     conda_env: Optional[str] = None
+    # 常驻推理进程（chat_mode=worker）：脚本路径（绝对路径或相对于remote_work_dir）
+    inference_worker_script_path: str = "inference_worker.py"
+    # 每个节点最多常驻的模型数、常驻模型显存预算（MB，0表示不限制）
+    inference_worker_max_models: int = 2
+    inference_worker_memory_budget_mb: int = 0
+    # 常驻模型空闲多久后卸载（秒），0表示不卸载
+    inference_worker_idle_timeout: int = 1800
+    # 推理引擎：multi_lora（同一基础模型常驻一份，多个LoRA adapter按请求切换）或 llamafactory（每个adapter一个完整模型）
+    inference_worker_engine: str = "multi_lora"
+    # multi_lora 引擎每个基础模型最多常驻的adapter数
+    inference_worker_max_adapters: int = 8
+    # 动态批处理（multi_lora 引擎）：同一模型的并发请求每批最多合并的数量（1表示不合并）和组批等待时间（毫秒）
+    inference_worker_max_batch_size: int = 8
+    inference_worker_batch_wait_ms: int = 20
+    # 推理进程为对话会话保留 KV cache 的最大会话数，以及对话上下文的token上限（0表示使用模型的 max_position_embeddings）
+    inference_worker_max_sessions: int = 16
+    inference_worker_max_context_tokens: int = 0
+    # 服务端对话会话（ChatRequest.session_id）：空闲过期时间（秒）、最大会话数、每个会话保留的最大消息数
+    chat_session_ttl: int = 3600
+    chat_session_max_count: int = 1000
+    chat_session_max_messages: int = 200
+    # 推理结果缓存：temperature<=0 的相同请求直接返回缓存的回复（TTL秒、最大条目数、模型文件版本的检查间隔秒）
+    chat_cache_enabled: bool = False
+    chat_cache_ttl: int = 3600
+    chat_cache_max_entries: int = 1000
+    chat_cache_artifact_check_interval: int = 60
+    # 异步对话任务：同时执行的任务数、webhook 回调超时（秒）和重试次数、已结束任务的保留时间（小时，0表示不清理）
+    chat_job_max_concurrency: int = 4
+    chat_job_webhook_timeout: int = 10
+    chat_job_webhook_retries: int = 3
+    # webhook 允许的主机名列表；为空时允许任意公网地址（拒绝内网、回环、链路本地和保留地址）
+    chat_job_webhook_allowed_hosts: List[str] = []
+    chat_job_retention_hours: int = 72
+    # 多模型对比：一次请求最多对比的模型数
+    chat_compare_max_models: int = 8
+    # 离线批量推理：远程脚本路径（绝对路径或相对于remote_work_dir，需与 inference_worker.py 位于同一目录）、默认每批条数
+    batch_inference_script_path: str = "batch_inference.py"
+    batch_inference_batch_size: int = 16
+    # 等待推理进程启动完成的超时（秒）
+    inference_worker_start_timeout: int = 60
     
     # DeepSeek API配置
     deepseek_api_key: Optional[str] = None
@@ -29,6 +29,14 @@ class TaskDB(Base):
     batch_size = Column(Integer, default=4)
     output_dir = Column(String, nullable=False)
     status = Column(String, default="pending")
+    # 调度参数：优先级越大越先启动；占用的GPU数量和单卡显存需求（MB，为空时使用默认值）
+    priority = Column(Integer, default=0)
+    gpu_count = Column(Integer, default=1)
+    gpu_memory_mb = Column(Integer, nullable=True)
+    # 调度器分配的GPU编号（逗号分隔），启动时作为 CUDA_VISIBLE_DEVICES
+    gpu_ids = Column(String, nullable=True)
+    # 运行任务的节点名称（为空表示主节点）
+    node = Column(String, nullable=True)
     ssh_command = Column(Text, nullable=True)
     process_id = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -41,6 +49,42 @@ class DatasetFileDB(Base):
     filename = Column(String, nullable=False)
     file_path = Column(String, nullable=False)
     size = Column(Integer, nullable=False)
+    # 文件内容的 SHA-256（上传时计算）
+    checksum = Column(String, nullable=True)
+    # 上传时校验得到的统计信息（JSON / JSONL 数据集）：记录数、无效记录数，
+    # stats 为 JSON 字符串（格式、各字段长度分位数、无效记录示例）
+    record_count = Column(Integer, nullable=True)
+    invalid_count = Column(Integer, nullable=True)
+    stats = Column(Text, nullable=True)
+    # 文件所在节点（为空表示主节点）
+    node = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class DatasetReplicaDB(Base):
+    """数据集数据块在其他节点上的副本（未共享存储时，任务调度到其他节点前传输过去），删除数据块时一并删除"""
+    __tablename__ = "dataset_replicas"
+    replica_id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.user_id"), nullable=False, index=True)
+    file_path = Column(String, nullable=False, index=True)
+    node = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class UploadSessionDB(Base):
+    """分块上传会话：各分块写入远程暂存目录，全部上传后在远程合并并校验，再登记为数据集文件"""
+    __tablename__ = "upload_sessions"
+    upload_id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.user_id"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    # 客户端提供的整个文件的 SHA-256（可选，合并后校验）
+    checksum = Column(String, nullable=True)
+    # 远程暂存目录（分块文件名为分块序号）
+    staging_dir = Column(String, nullable=False)
+    # 暂存目录所在节点（为空表示主节点）
+    node = Column(String, nullable=True)
+    # uploading：接收分块中；completing：正在合并（防止重复合并，期间不接收分块）
+    status = Column(String, default="uploading")
     created_at = Column(DateTime, default=datetime.utcnow)
 
 class ModelFileDB(Base):
@@ -52,5 +96,51 @@ class ModelFileDB(Base):
     base_model_path = Column(String, nullable=True)
     task_id = Column(String, ForeignKey("tasks.task_id"), nullable=True)
     size = Column(Integer, nullable=True)
+    # 模型所在节点（即训练任务运行的节点，为空表示主节点）
+    node = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class ChatJobDB(Base):
+    """异步对话任务：提交后在后台生成，结果保存在数据库中供客户端轮询"""
+    __tablename__ = "chat_jobs"
+    job_id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.user_id"), nullable=False, index=True)
+    model_path = Column(String, nullable=False)
+    # queued / running / completed / failed
+    status = Column(String, default="queued")
+    # 提交的 ChatRequest（JSON）
+    request = Column(Text, nullable=False)
+    content = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    # 完成后回调的地址（可选）
+    webhook_url = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
+class BatchInferenceJobDB(Base):
+    """离线批量推理任务：在模型所在节点上对整个提示文件批量生成，结果写入远程 JSONL 文件"""
+    __tablename__ = "batch_inference_jobs"
+    job_id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.user_id"), nullable=False, index=True)
+    name = Column(String, nullable=False)
+    model_path = Column(String, nullable=False)
+    dataset_path = Column(String, nullable=False)
+    # 远程输出目录（results.jsonl、progress.json、inference.log）
+    output_dir = Column(String, nullable=False)
+    batch_size = Column(Integer, default=16)
+    max_tokens = Column(Integer, default=512)
+    temperature = Column(Float, default=0.0)
+    # pending / running / completed / failed
+    status = Column(String, default="pending")
+    # 运行任务的节点名称（模型所在节点，为空表示主节点）
+    node = Column(String, nullable=True)
+    process_id = Column(String, nullable=True)
+    # 最近一次读取的进度
+    total = Column(Integer, default=0)
+    completed = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    tokens_per_second = Column(Float, default=0.0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
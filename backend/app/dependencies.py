@@ -1,18 +1,48 @@
-from fastapi import Depends, HTTPException, status
+from typing import Optional
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
+from app.config import settings
 from app.database import get_db
 from app.db_models import UserDB
 from app.utils.security import verify_token
 
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ) -> UserDB:
     """获取当前登录用户"""
-    token = credentials.credentials
+    return get_user_by_token(credentials.credentials, db)
+
+def get_current_admin(current_user: UserDB = Depends(get_current_user)) -> UserDB:
+    """获取当前登录的管理员（admin_usernames 中的用户），否则返回 403"""
+    if current_user.username not in settings.admin_usernames:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="需要管理员权限",
+        )
+    return current_user
+
+def get_current_user_for_stream(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    access_token: Optional[str] = Query(None, description="浏览器 EventSource 无法设置请求头时，通过查询参数传递 token"),
+    db: Session = Depends(get_db)
+) -> UserDB:
+    """获取当前登录用户（流式接口使用，同时支持 Authorization 请求头和 access_token 查询参数）"""
+    token = credentials.credentials if credentials else access_token
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="未提供认证凭证",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return get_user_by_token(token, db)
+
+def get_user_by_token(token: str, db: Session) -> UserDB:
+    """根据 token 获取用户，无效时抛出 401"""
     payload = verify_token(token)
     if payload is None:
         raise HTTPException(
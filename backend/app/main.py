@@ -1,8 +1,16 @@
 import logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app.config import settings
 from app.database import init_db
-from app.routers import auth, tasks, files, chat
+from app.routers import auth, tasks, files, chat, batch_inference
+from app.services.async_ssh_service import close_all_async_pools
+from app.services.log_stream_service import log_stream_hub
+from app.services.inference_service import close_all_inference_workers
+from app.services.chat_job_service import chat_job_manager
+from app.services.task_monitor import task_monitor
+from app.services.task_scheduler import task_scheduler
+from app.services.upload_service import ChunkedUploadService
 
 # 配置日志
 logging.basicConfig(
@@ -29,16 +37,31 @@ app.add_middleware(
 
 # 初始化数据库
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     logger.info("应用启动，初始化数据库...")
     init_db()
     logger.info("数据库初始化完成")
+    task_scheduler.recover()
+    chat_job_manager.recover()
+    ChunkedUploadService().recover()
+    if settings.task_monitor_enabled:
+        task_monitor.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await task_monitor.stop()
+    await chat_job_manager.stop()
+    logger.info("应用关闭，释放SSH连接...")
+    await log_stream_hub.close_all()
+    await close_all_inference_workers()
+    await close_all_async_pools()
 
 # 注册路由
 app.include_router(auth.router)
 app.include_router(tasks.router)
 app.include_router(files.router)
 app.include_router(chat.router)
+app.include_router(batch_inference.router)
 
 @app.get("/")
 def root():
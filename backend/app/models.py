@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 # 用户相关模型
@@ -31,7 +31,7 @@ class TaskCreate(BaseModel):
     字段与训练命令参数的对应关系：
     - name:                任务名称（只存数据库，不参与命令）
     - model_name:          --model_name_or_path
-    - dataset_path:        远程数据集路径（会在训练前被拷贝为 current_dataset.json）
+    - dataset_path:        远程数据集路径（训练前登记到任务输出目录下的 dataset_info.json）
     - stage:               --stage（默认 sft）
     - template:            --template（默认 qwen2）
     - epochs:              --num_train_epochs
@@ -40,6 +40,9 @@ class TaskCreate(BaseModel):
     - gradient_accumulation_steps: --gradient_accumulation_steps
     - fp16:                是否添加 --fp16
     - output_dir:          --output_dir
+    - priority:            调度优先级（越大越先启动）
+    - gpu_count:           占用的GPU数量
+    - gpu_memory_mb:       单卡显存需求（MB，不填使用服务端默认值）
     """
 
     name: str
@@ -60,6 +63,11 @@ class TaskCreate(BaseModel):
     fp16: Optional[bool] = True
     output_dir: Optional[str] = None
 
+    # 调度参数
+    priority: Optional[int] = 0
+    gpu_count: Optional[int] = 1
+    gpu_memory_mb: Optional[int] = None
+
 class Task(BaseModel):
     task_id: str
     user_id: str
@@ -71,12 +79,26 @@ class Task(BaseModel):
     batch_size: int
     output_dir: str
     status: str
+    priority: int = 0
+    gpu_count: int = 1
+    node: Optional[str] = None
     created_at: datetime
     updated_at: datetime
     
     class Config:
         from_attributes = True
 
+class TaskLogs(BaseModel):
+    """
+    任务日志（增量读取）
+    logs 为本次返回的内容，对应文件中 [offset, next_offset) 字节区间；
+    客户端下次以 next_offset 作为 offset 请求即可只获取新增内容
+    """
+    logs: str
+    offset: int = 0
+    next_offset: int = 0
+    file_size: int = 0
+
 # 文件相关模型
 class DatasetFile(BaseModel):
     file_id: str
@@ -84,11 +106,43 @@ class DatasetFile(BaseModel):
     filename: str
     file_path: str
     size: int
+    checksum: Optional[str] = None
+    # 上传时的校验统计（不是 JSON / JSONL 或校验前上传的数据集为空）
+    record_count: Optional[int] = None
+    invalid_count: Optional[int] = None
+    stats: Optional[dict] = None  # format、lengths（各字段长度的 min/p50/p90/p99/max/mean）、errors
     created_at: datetime
     
     class Config:
         from_attributes = True
 
+class DatasetByChecksum(BaseModel):
+    """秒传：已上传过内容相同的文件时，按 SHA-256 直接登记新的数据集"""
+    filename: str
+    checksum: str
+
+class UploadInit(BaseModel):
+    """分块上传：创建上传会话"""
+    filename: str
+    size: int
+    chunk_size: Optional[int] = None  # 不填使用服务端默认值
+    checksum: Optional[str] = None  # 整个文件的 SHA-256（可选，合并后校验）
+
+class UploadSession(BaseModel):
+    upload_id: str
+    filename: str
+    size: int
+    chunk_size: int
+    total_chunks: int
+    received: List[int] = []  # 已上传的分块序号
+    status: str = "uploading"  # uploading / completing（正在合并）
+    created_at: datetime
+
+class UploadChunk(BaseModel):
+    index: int
+    size: int
+    checksum: str
+
 class ModelFile(BaseModel):
     model_id: str
     user_id: str
@@ -114,10 +168,94 @@ class ChatRequest(BaseModel):
     messages: List[ChatMessage]
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 2048
+    # 服务端会话ID（由客户端生成）：指定后 messages 只需包含本轮的新消息，历史由服务端保存
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     role: str
     content: str
+    session_id: Optional[str] = None
+    # token 用量（仅 worker 模式提供）
+    usage: Optional[Dict[str, int]] = None
+
+class ChatJobCreate(ChatRequest):
+    """异步对话任务：请求体同 ChatRequest，可选完成后回调的地址"""
+    webhook_url: Optional[str] = None
+
+class ChatJob(BaseModel):
+    job_id: str
+    model_path: str
+    status: str
+    content: Optional[str] = None
+    error: Optional[str] = None
+    webhook_url: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class ChatCompareRequest(BaseModel):
+    """多模型对比：同一组消息同时发送给多个模型"""
+    model_paths: List[str]
+    messages: List[ChatMessage]
+    temperature: Optional[float] = 0.7
+    max_tokens: Optional[int] = 2048
+
+class ChatCompareResult(BaseModel):
+    model_path: str
+    content: Optional[str] = None
+    error: Optional[str] = None
+    latency_ms: int
+    usage: Optional[Dict[str, int]] = None
+
+class ChatCompareResponse(BaseModel):
+    results: List[ChatCompareResult]  # 与请求中 model_paths 的顺序一致
+    total_latency_ms: int
+
+# 离线批量推理相关模型
+class BatchInferenceCreate(BaseModel):
+    name: Optional[str] = None
+    model_path: str
+    dataset_path: str  # 已上传的提示文件（JSON / JSONL）
+    batch_size: Optional[int] = None
+    max_tokens: Optional[int] = 512
+    temperature: Optional[float] = 0.0
+
+class BatchInferenceJob(BaseModel):
+    job_id: str
+    name: str
+    model_path: str
+    dataset_path: str
+    output_dir: str
+    batch_size: int
+    max_tokens: int
+    temperature: float
+    status: str
+    node: Optional[str] = None
+    total: int = 0
+    completed: int = 0
+    completion_tokens: int = 0
+    tokens_per_second: float = 0.0
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class BatchInferenceResults(BaseModel):
+    """
+    批量推理结果（增量读取 results.jsonl）
+    results 为 [offset, next_offset) 字节区间内的完整行；下次以 next_offset 作为 offset 请求
+    invalid_lines 为区间内无法解析而跳过的行的字节偏移
+    """
+    results: List[dict]
+    invalid_lines: List[int] = []
+    offset: int = 0
+    next_offset: int = 0
+    file_size: int = 0
 
 # 数据集生成相关模型
 class DatasetGenerateRequest(BaseModel):
@@ -0,0 +1,71 @@
+import logging
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.dependencies import get_current_user
+from app.db_models import UserDB
+from app.models import BatchInferenceCreate, BatchInferenceJob, BatchInferenceResults
+from app.services.batch_inference_service import BatchInferenceService
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/batch-inference", tags=["batch-inference"])
+
+@router.post("", response_model=BatchInferenceJob, status_code=status.HTTP_201_CREATED)
+async def create_batch_inference(
+    job_data: BatchInferenceCreate,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """创建离线批量推理任务（在模型所在节点上后台运行）"""
+    logger.info(f"[API] 创建批量推理任务，用户: {current_user.user_id}, 模型: {job_data.model_path}, 提示文件: {job_data.dataset_path}")
+    service = BatchInferenceService()
+    try:
+        return await service.create_job(db, current_user.user_id, job_data)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("", response_model=List[BatchInferenceJob])
+async def get_batch_inference_jobs(
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """获取用户的批量推理任务列表（进度为最近一次查询时的值）"""
+    return BatchInferenceService().get_user_jobs(db, current_user.user_id)
+
+@router.get("/{job_id}", response_model=BatchInferenceJob)
+async def get_batch_inference_job(
+    job_id: str,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """获取批量推理任务详情和最新进度"""
+    service = BatchInferenceService()
+    job = service.get_job(db, job_id, current_user.user_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在")
+    return await service.refresh(db, job)
+
+@router.get("/{job_id}/results", response_model=BatchInferenceResults)
+async def get_batch_inference_results(
+    job_id: str,
+    offset: int = Query(0, ge=0, description="从该字节偏移开始读取（上次返回的 next_offset）"),
+    limit: Optional[int] = Query(None, gt=0, description="最多读取的字节数"),
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """增量读取批量推理结果（生成过程中即可读取已完成的部分）"""
+    service = BatchInferenceService()
+    job = service.get_job(db, job_id, current_user.user_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在")
+    try:
+        return await service.read_results(job, offset, limit)
+    except FileNotFoundError:
+        if job.status in ("pending", "running"):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="任务尚未生成结果文件，请稍后重试")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="结果文件不存在")
+    except Exception as e:
+        logger.error(f"[批量推理] 读取结果失败，任务ID: {job_id}, 错误: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"读取结果文件失败: {str(e)}")
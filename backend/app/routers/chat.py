@@ -1,15 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import json
+import logging
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from app.database import get_db
-from app.dependencies import get_current_user
+from app.dependencies import get_current_user, get_current_admin
 from app.db_models import UserDB
-from app.models import ChatRequest, ChatResponse
+from app.models import ChatRequest, ChatResponse, ChatJobCreate, ChatJob, ChatCompareRequest, ChatCompareResponse
 from app.services.chat_service import ChatService
+from app.services.chat_job_service import chat_job_manager
+from app.services.response_cache_service import response_cache
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
 @router.post("/completion", response_model=ChatResponse)
-def chat_completion(
+async def chat_completion(
     request: ChatRequest,
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -17,10 +25,125 @@ def chat_completion(
     """对话推理"""
     chat_service = ChatService()
     try:
-        response = chat_service.chat_completion(db, current_user.user_id, request)
+        response = await chat_service.chat_completion(db, current_user.user_id, request)
         return response
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"推理失败: {str(e)}")
 
+@router.post("/completion/stream")
+async def stream_chat_completion(
+    request: ChatRequest,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """流式对话推理（Server-Sent Events，OpenAI chat.completion.chunk 格式，以 data: [DONE] 结束）"""
+    chat_service = ChatService()
+    try:
+        chunks = chat_service.stream_chat_completion(db, current_user.user_id, request)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    async def event_stream():
+        try:
+            async for chunk in chunks:
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            # 响应头已经发出，错误只能作为一条事件返回
+            logger.error(f"[API] 流式推理失败: {str(e)}")
+            error = {"error": {"message": f"推理失败: {str(e)}", "type": "inference_error"}}
+            yield f"data: {json.dumps(error, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/compare", response_model=ChatCompareResponse)
+async def compare_chat_completion(
+    request: ChatCompareRequest,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """多模型对比：同一组消息同时发送给多个模型，返回各模型的回复、耗时和token用量"""
+    chat_service = ChatService()
+    try:
+        return await chat_service.compare_completion(db, current_user.user_id, request)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post("/compare/stream")
+async def stream_compare_chat_completion(
+    request: ChatCompareRequest,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """流式多模型对比（Server-Sent Events）：每个模型完成后推送一条 ChatCompareResult，以 data: [DONE] 结束"""
+    chat_service = ChatService()
+    try:
+        results = chat_service.stream_compare_completion(db, current_user.user_id, request)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    async def event_stream():
+        async for result in results:
+            yield f"data: {result.model_dump_json()}\n\n"
+        yield "data: [DONE]\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.delete("/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def end_chat_session(
+    session_id: str,
+    current_user: UserDB = Depends(get_current_user)
+):
+    """结束对话会话，释放服务端保存的历史和推理进程中的 KV cache"""
+    chat_service = ChatService()
+    if not await chat_service.end_session(current_user.user_id, session_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="会话不存在")
+
+@router.get("/cache/stats")
+async def get_chat_cache_stats(current_user: UserDB = Depends(get_current_admin)):
+    """推理结果缓存的命中情况（全局统计，仅管理员）"""
+    return response_cache.stats()
+
+@router.post("/jobs", response_model=ChatJob, status_code=status.HTTP_202_ACCEPTED)
+async def submit_chat_job(
+    job_data: ChatJobCreate,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """提交异步对话任务，立即返回任务ID；通过 GET /api/chat/jobs/{job_id} 轮询结果，或在完成时回调 webhook_url"""
+    try:
+        job = chat_job_manager.submit(db, current_user.user_id, job_data)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return ChatJob.model_validate(job)
+
+@router.get("/jobs", response_model=List[ChatJob])
+async def get_chat_jobs(
+    limit: int = Query(50, gt=0, le=500, description="最多返回的任务数"),
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """获取用户最近的异步对话任务"""
+    return [ChatJob.model_validate(job) for job in chat_job_manager.get_user_jobs(db, current_user.user_id, limit)]
+
+@router.get("/jobs/{job_id}", response_model=ChatJob)
+async def get_chat_job(
+    job_id: str,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """获取异步对话任务的状态和结果"""
+    job = chat_job_manager.get_job(db, job_id, current_user.user_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在")
+    return ChatJob.model_validate(job)
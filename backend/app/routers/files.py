@@ -1,91 +1,212 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Header
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 import tempfile
 import os
 import logging
+from typing import Optional
+from app.config import settings
 from app.database import get_db
 from app.dependencies import get_current_user
 from app.db_models import UserDB
-from app.services.file_service import FileService
+from app.services.file_service import FileService, DatasetInUseError, load_dataset_stats
+from app.services.upload_service import ChunkedUploadService, UploadInProgressError, COMPLETING
 from app.services.dataset_generation_service import DatasetGenerationService
-from app.models import DatasetFile, ModelFile, DatasetGenerateRequest
+from app.utils.file_utils import MultipartFileReader, UploadTooLargeError
+from app.models import DatasetFile, ModelFile, DatasetGenerateRequest, UploadInit, UploadSession, UploadChunk, DatasetByChecksum
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/files", tags=["files"])
 
+def _dataset_file_response(db_file) -> DatasetFile:
+    return DatasetFile(
+        file_id=db_file.file_id,
+        user_id=db_file.user_id,
+        filename=db_file.filename,
+        file_path=db_file.file_path,
+        size=db_file.size,
+        checksum=db_file.checksum,
+        record_count=db_file.record_count,
+        invalid_count=db_file.invalid_count,
+        stats=load_dataset_stats(db_file),
+        created_at=db_file.created_at
+    )
+
 @router.post("/datasets", response_model=DatasetFile, status_code=status.HTTP_201_CREATED)
-def upload_dataset(
-    file: UploadFile = File(...),
+async def upload_dataset(
+    request: Request,
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """上传数据集文件"""
-    file_service = FileService()
-    
-    # 保存临时文件
-    with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-        content = file.file.read()
-        tmp_file.write(content)
-        tmp_file_path = tmp_file.name
-        file_size = len(content)
+    """
+    上传数据集文件（multipart/form-data，文件字段名为 file）
+    请求体边接收边解析并写入远程文件，内存占用与文件大小无关，超过 max_upload_size 时返回 413；
+    JSON / JSONL 数据集同时校验格式，不通过时返回 400
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.max_upload_size + 64 * 1024:
+        # 请求体（含multipart头部）明显超过限制时直接拒绝，不再接收
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="文件大小超过限制")
     
+    file_service = FileService()
     try:
-        db_file = file_service.upload_dataset_file(
+        reader = MultipartFileReader(request.headers.get("content-type"), request.stream())
+        filename = os.path.basename(await reader.read_header())
+        if not filename:
+            raise ValueError("文件名不能为空")
+        db_file = await file_service.upload_dataset_stream(
             db=db,
             user_id=current_user.user_id,
-            filename=file.filename,
-            local_file_path=tmp_file_path,
-            file_size=file_size
-        )
-        return DatasetFile(
-            file_id=db_file.file_id,
-            user_id=db_file.user_id,
-            filename=db_file.filename,
-            file_path=db_file.file_path,
-            size=db_file.size,
-            created_at=db_file.created_at
+            filename=filename,
+            chunks=reader.chunks()
         )
-    finally:
-        # 删除临时文件
-        if os.path.exists(tmp_file_path):
-            os.unlink(tmp_file_path)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return _dataset_file_response(db_file)
+
+@router.post("/datasets/by-checksum", response_model=DatasetFile, status_code=status.HTTP_201_CREATED)
+async def add_dataset_by_checksum(
+    data: DatasetByChecksum,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """秒传：已有内容相同（SHA-256 和扩展名相同）的数据集时直接登记，无需上传；没有时返回 404，客户端再正常上传"""
+    filename = os.path.basename(data.filename)
+    if not filename:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="文件名不能为空")
+    file_service = FileService()
+    db_file = file_service.add_dataset_by_checksum(db, current_user.user_id, filename, data.checksum)
+    if not db_file:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="没有内容相同的数据集")
+    return _dataset_file_response(db_file)
+
+async def _upload_session_response(upload_service: ChunkedUploadService, session) -> UploadSession:
+    return UploadSession(
+        upload_id=session.upload_id,
+        filename=session.filename,
+        size=session.size,
+        chunk_size=session.chunk_size,
+        total_chunks=upload_service.total_chunks(session),
+        received=await upload_service.received_chunks(session),
+        status=session.status or "uploading",
+        created_at=session.created_at
+    )
+
+def _get_upload_session(upload_service: ChunkedUploadService, db: Session, upload_id: str, user_id: str):
+    session = upload_service.get_session(db, upload_id, user_id)
+    if not session:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="上传会话不存在")
+    return session
+
+@router.post("/datasets/uploads", response_model=UploadSession, status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    data: UploadInit,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """创建分块上传会话（大文件可续传上传：逐个 PUT 分块后 complete）"""
+    upload_service = ChunkedUploadService()
+    try:
+        session = await upload_service.create_session(db, current_user.user_id, data)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return await _upload_session_response(upload_service, session)
+
+@router.get("/datasets/uploads/{upload_id}", response_model=UploadSession)
+async def get_upload(
+    upload_id: str,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """查询分块上传进度（received 为已上传的分块，续传时只需上传其余分块）"""
+    upload_service = ChunkedUploadService()
+    session = _get_upload_session(upload_service, db, upload_id, current_user.user_id)
+    return await _upload_session_response(upload_service, session)
+
+@router.put("/datasets/uploads/{upload_id}/chunks/{index}", response_model=UploadChunk)
+async def put_upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    x_chunk_sha256: Optional[str] = Header(None, description="分块的 SHA-256（可选，上传后校验）"),
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """上传一个分块（请求体为分块的原始字节），可与其他分块同时上传，失败时单独重传"""
+    upload_service = ChunkedUploadService()
+    session = _get_upload_session(upload_service, db, upload_id, current_user.user_id)
+    try:
+        return await upload_service.put_chunk(session, index, request.stream(), x_chunk_sha256)
+    except UploadInProgressError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except UploadTooLargeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"分块 {index} 大小超过应有的长度")
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post("/datasets/uploads/{upload_id}/complete", response_model=DatasetFile, status_code=status.HTTP_201_CREATED)
+async def complete_upload(
+    upload_id: str,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """合并全部分块并校验，成功后登记为数据集文件"""
+    upload_service = ChunkedUploadService()
+    session = _get_upload_session(upload_service, db, upload_id, current_user.user_id)
+    try:
+        db_file = await upload_service.complete(db, session)
+    except UploadInProgressError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return _dataset_file_response(db_file)
+
+@router.delete("/datasets/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def abort_upload(
+    upload_id: str,
+    current_user: UserDB = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """取消分块上传，删除已上传的分块"""
+    upload_service = ChunkedUploadService()
+    session = _get_upload_session(upload_service, db, upload_id, current_user.user_id)
+    if session.status == COMPLETING:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="上传正在合并中，不能取消")
+    await upload_service.abort(db, session)
 
 @router.get("/datasets", response_model=list[DatasetFile])
-def get_datasets(
+async def get_datasets(
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """获取用户的数据集文件列表"""
     file_service = FileService()
     files = file_service.get_user_datasets(db, current_user.user_id)
-    return [
-        DatasetFile(
-            file_id=f.file_id,
-            user_id=f.user_id,
-            filename=f.filename,
-            file_path=f.file_path,
-            size=f.size,
-            created_at=f.created_at
-        )
-        for f in files
-    ]
+    return [_dataset_file_response(f) for f in files]
 
 @router.delete("/datasets/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_dataset(
+async def delete_dataset(
     file_id: str,
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """删除数据集文件"""
     file_service = FileService()
-    success = file_service.delete_dataset_file(db, file_id, current_user.user_id)
+    try:
+        success = await file_service.delete_dataset_file(db, file_id, current_user.user_id)
+    except DatasetInUseError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
     if not success:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="文件不存在")
     return None
 
 @router.get("/models", response_model=list[ModelFile])
-def get_models(
+async def get_models(
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -107,7 +228,7 @@ def get_models(
     ]
 
 @router.get("/models/available", response_model=list[ModelFile])
-def get_available_models(
+async def get_available_models(
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -131,7 +252,7 @@ def get_available_models(
     ]
 
 @router.post("/datasets/generate", response_model=DatasetFile, status_code=status.HTTP_201_CREATED)
-def generate_dataset(
+async def generate_dataset(
     request: DatasetGenerateRequest,
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -156,8 +277,8 @@ def generate_dataset(
             request.filename
         )
         
-        # 调用DeepSeek API生成数据集
-        dataset = generation_service.generate_dataset(request.topic.strip())
+        # 调用DeepSeek API生成数据集（同步HTTP请求，放到线程池中执行，避免阻塞事件循环）
+        dataset = await run_in_threadpool(generation_service.generate_dataset, request.topic.strip())
         
         # 保存到临时文件
         import json
@@ -170,7 +291,7 @@ def generate_dataset(
         
         try:
             # 上传到远程服务器并保存到数据库
-            db_file = file_service.upload_dataset_file(
+            db_file = await file_service.upload_dataset_file(
                 db=db,
                 user_id=current_user.user_id,
                 filename=filename,
@@ -180,14 +301,7 @@ def generate_dataset(
             
             logger.info(f"[API] 数据集生成成功，文件ID: {db_file.file_id}")
             
-            return DatasetFile(
-                file_id=db_file.file_id,
-                user_id=db_file.user_id,
-                filename=db_file.filename,
-                file_path=db_file.file_path,
-                size=db_file.size,
-                created_at=db_file.created_at
-            )
+            return _dataset_file_response(db_file)
         finally:
             # 删除临时文件
             if os.path.exists(tmp_file_path):
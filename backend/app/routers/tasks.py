@@ -1,28 +1,23 @@
+import json
 import logging
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Dict
+from typing import List, Dict, Optional
 from app.database import get_db
-from app.dependencies import get_current_user
+from app.dependencies import get_current_user, get_current_user_for_stream
 from app.db_models import UserDB, TaskDB
-from app.models import TaskCreate, Task
-from app.services.task_service import TaskService
+from app.models import TaskCreate, Task, TaskLogs
+from app.services.task_service import TaskService, AVAILABLE_MODELS
+from app.services.task_scheduler import task_scheduler
 from app.services.file_service import FileService
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/tasks", tags=["tasks"])
 
-# 硬编码的模型列表
-AVAILABLE_MODELS = {
-    "Qwen2-0.5B": {
-        "model_path": "/root/autodl-tmp/Qwen2-0.5B-Instruct",
-        "template": "qwen2"
-    }
-}
-
 @router.get("/models", response_model=List[Dict[str, str]])
-def get_available_models():
+async def get_available_models():
     """获取可用的模型列表"""
     return [
         {
@@ -34,7 +29,7 @@ def get_available_models():
     ]
 
 @router.post("", response_model=Task, status_code=status.HTTP_201_CREATED)
-def create_task(
+async def create_task(
     task_data: TaskCreate,
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -69,6 +64,12 @@ def create_task(
         logger.warning(f"[API] 数据集文件不存在: {task_data.dataset_path}")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="数据集文件不存在")
     
+    # 验证GPU需求是否能被服务器满足（否则会一直排队）
+    gpu_error = task_scheduler.validate(task_data.gpu_count or 1, task_data.gpu_memory_mb)
+    if gpu_error:
+        logger.warning(f"[API] {gpu_error}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=gpu_error)
+    
     task_service = TaskService()
     try:
         # 创建修改后的task_data，使用模型路径和模板
@@ -83,12 +84,18 @@ def create_task(
             batch_size=task_data.batch_size,
             gradient_accumulation_steps=task_data.gradient_accumulation_steps,
             fp16=task_data.fp16,
-            output_dir=None  # 不使用用户提供的输出目录
+            output_dir=None,  # 不使用用户提供的输出目录
+            priority=task_data.priority,
+            gpu_count=task_data.gpu_count,
+            gpu_memory_mb=task_data.gpu_memory_mb
         )
         
-        # 传递模型路径给service（用于实际训练命令）
+        # 传递模型路径给service（用于实际训练命令），任务先进入队列
         db_task = task_service.create_task(db, current_user.user_id, task_data_with_path, model_path=model_path)
-        logger.info(f"[API] 训练任务创建成功，任务ID: {db_task.task_id}")
+        # 只入队并在后台触发调度：有空闲GPU时随即启动，否则保持排队，由任务结束时的调度启动
+        # 启动结果（running / failed）通过任务列表或详情查询
+        task_scheduler.wake()
+        logger.info(f"[API] 训练任务创建成功，任务ID: {db_task.task_id}, 状态: {db_task.status}")
         return Task(
             task_id=db_task.task_id,
             user_id=db_task.user_id,
@@ -100,6 +107,9 @@ def create_task(
             batch_size=db_task.batch_size,
             output_dir=db_task.output_dir,
             status=db_task.status,
+            priority=db_task.priority or 0,
+            gpu_count=db_task.gpu_count or 1,
+            node=db_task.node,
             created_at=db_task.created_at,
             updated_at=db_task.updated_at
         )
@@ -108,7 +118,7 @@ def create_task(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 @router.get("", response_model=List[Task])
-def get_tasks(
+async def get_tasks(
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -127,6 +137,9 @@ def get_tasks(
             batch_size=t.batch_size,
             output_dir=t.output_dir,
             status=t.status,
+            priority=t.priority or 0,
+            gpu_count=t.gpu_count or 1,
+            node=t.node,
             created_at=t.created_at,
             updated_at=t.updated_at
         )
@@ -134,7 +147,7 @@ def get_tasks(
     ]
 
 @router.get("/{task_id}", response_model=Task)
-def get_task(
+async def get_task(
     task_id: str,
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -145,36 +158,7 @@ def get_task(
     if not task:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在")
     
-    # 检查任务状态，如果完成则自动添加模型
-    if task.status == "running":
-        # 简单检查：尝试读取日志文件判断是否完成（最小实现）
-        try:
-            logs = task_service.get_task_logs(db, task_id, current_user.user_id)
-            if "Training completed" in logs or "训练完成" in logs:
-                task.status = "completed"
-                db.commit()
-        except:
-            pass
-    
-    # 如果任务完成，自动添加模型到模型列表
-    if task.status == "completed":
-        file_service = FileService()
-        existing_model = file_service.get_model_by_path(db, task.output_dir, current_user.user_id)
-        if not existing_model:
-            # 将模型名称映射回路径（用于base_model_path）
-            base_model_path = task.model_name  # 默认使用模型名称
-            if task.model_name in AVAILABLE_MODELS:
-                base_model_path = AVAILABLE_MODELS[task.model_name]["model_path"]
-            
-            file_service.add_model_file(
-                db=db,
-                user_id=current_user.user_id,
-                name=f"{task.name}_model",
-                model_path=task.output_dir,
-                base_model_path=base_model_path,  # 使用模型路径作为基础模型路径
-                task_id=task.task_id
-            )
-    
+    # 任务状态由后台监控（TaskMonitor）更新，这里只读取数据库
     return Task(
         task_id=task.task_id,
         user_id=task.user_id,
@@ -186,21 +170,58 @@ def get_task(
         batch_size=task.batch_size,
         output_dir=task.output_dir,
         status=task.status,
+        priority=task.priority or 0,
+        gpu_count=task.gpu_count or 1,
+        node=task.node,
         created_at=task.created_at,
         updated_at=task.updated_at
     )
 
-@router.get("/{task_id}/logs")
-def get_task_logs(
+@router.get("/{task_id}/logs", response_model=TaskLogs)
+async def get_task_logs(
     task_id: str,
+    offset: Optional[int] = Query(None, ge=0, description="从该字节偏移开始读取（上次返回的 next_offset）"),
+    limit: Optional[int] = Query(None, gt=0, description="最多返回的字节数"),
+    tail: Optional[int] = Query(None, gt=0, description="只返回最后 N 行"),
     current_user: UserDB = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """获取任务日志"""
+    """获取任务日志（支持按偏移增量读取和只读取最后 N 行）"""
+    task_service = TaskService()
+    chunk = await task_service.get_task_log_chunk(
+        db, task_id, current_user.user_id,
+        offset=offset,
+        limit=limit,
+        tail=tail
+    )
+    if chunk is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在")
+    return TaskLogs(**chunk)
+
+@router.get("/{task_id}/logs/stream")
+async def stream_task_logs(
+    task_id: str,
+    offset: Optional[int] = Query(None, ge=0, description="从该字节偏移开始补发（断线重连时传入最后收到的 next_offset）"),
+    tail: Optional[int] = Query(None, gt=0, description="先补发最后 N 行"),
+    current_user: UserDB = Depends(get_current_user_for_stream),
+    db: Session = Depends(get_db)
+):
+    """实时推送任务日志（Server-Sent Events）"""
     task_service = TaskService()
     task = task_service.get_task(db, task_id, current_user.user_id)
     if not task:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在")
     
-    logs = task_service.get_task_logs(db, task_id, current_user.user_id)
-    return {"logs": logs}
+    async def event_stream():
+        async for event, data in task_service.stream_task_logs(task, offset=offset, tail=tail):
+            if event == "heartbeat":
+                yield ": heartbeat\n\n"
+            else:
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
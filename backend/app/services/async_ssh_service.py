@@ -0,0 +1,674 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shlex
+import time
+import uuid
+import asyncssh
+from contextlib import asynccontextmanager
+from typing import Tuple, Dict, Optional, List, AsyncIterator
+from app.config import settings
+from app.services.node_registry import get_node
+from app.utils.compression import TransferCodec, get_transfer_codec
+from app.utils.file_utils import UploadTooLargeError
+from app.services.ssh_service import (
+    build_chat_cli_command,
+    build_chat_jsonl_request,
+    build_chat_script_command,
+    build_pipeline_script,
+    parse_chat_cli_output,
+    parse_chat_jsonl_output,
+    parse_chat_script_output,
+    parse_pipeline_output,
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+class _PooledConnection:
+    """连接池中的一条 asyncssh 连接及其使用情况"""
+
+    def __init__(self, conn: asyncssh.SSHClientConnection):
+        self.conn = conn
+        self.channels = 0  # 当前在该连接上打开的 channel 数
+        self.last_used = time.monotonic()
+        self.broken = False
+
+    @property
+    def closed(self) -> bool:
+        return self.broken or self.conn.is_closed()
+
+
+class AsyncSSHConnectionPool:
+    """
+    asyncio 版 SSH 连接池（按 host/port/username 区分）
+
+    一条 SSH 连接可以同时承载多个 channel，但 OpenSSH 默认限制每个连接最多 10 个会话（MaxSessions），
+    因此每条连接最多同时打开 max_channels 个 channel，超出后新建连接，连接总数不超过 max_size；
+    全部占满时协程挂起等待，不占用任何线程。
+    空闲超过 health_check_idle 秒的连接在交给调用方之前先执行一次空命令探活，失败则丢弃并换一条连接。
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: Optional[str] = None,
+        key_path: Optional[str] = None,
+        max_size: int = 8,
+        max_channels: int = 8,
+        idle_timeout: int = 300,
+        keepalive_interval: int = 30,
+        acquire_timeout: int = 30,
+        health_check_idle: int = 60,
+        health_check_timeout: int = 5
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.key_path = key_path
+        self.max_size = max_size
+        self.max_channels = max_channels
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.acquire_timeout = acquire_timeout
+        self.health_check_idle = health_check_idle
+        self.health_check_timeout = health_check_timeout
+        self._conns: List[_PooledConnection] = []
+        self._connecting = 0  # 正在建立中的连接数
+        self._cond = asyncio.Condition()
+
+    async def _connect(self) -> asyncssh.SSHClientConnection:
+        """建立新的 SSH 连接"""
+        logger.info(f"[AsyncSSH连接池] 建立新连接: {self.host}:{self.port}, 用户: {self.username}")
+        return await asyncssh.connect(
+            self.host,
+            port=self.port,
+            username=self.username,
+            password=None if self.key_path else self.password,
+            client_keys=[self.key_path] if self.key_path else None,
+            known_hosts=None,  # 不校验主机密钥（自动接受）
+            keepalive_interval=self.keepalive_interval,
+            keepalive_count_max=3
+        )
+
+    def _evict_locked(self) -> List[_PooledConnection]:
+        """移出已断开或空闲超时的连接（调用方需持有锁），返回需要关闭的连接"""
+        now = time.monotonic()
+        removed = [
+            pc for pc in self._conns
+            if pc.closed or (pc.channels == 0 and now - pc.last_used > self.idle_timeout)
+        ]
+        if removed:
+            self._conns = [pc for pc in self._conns if pc not in removed]
+            logger.info(f"[AsyncSSH连接池] 回收 {len(removed)} 个连接: {self.host}:{self.port}")
+        return removed
+
+    async def _is_alive(self, pc: _PooledConnection) -> bool:
+        """在连接上执行一次空命令，确认连接仍然可用"""
+        try:
+            await asyncio.wait_for(pc.conn.run("true", check=False), timeout=self.health_check_timeout)
+            return True
+        except (asyncio.TimeoutError, asyncssh.Error, OSError) as e:
+            logger.warning(f"[AsyncSSH连接池] 空闲连接探活失败，丢弃该连接: {self.host}:{self.port}, {e}")
+            return False
+
+    async def acquire(self) -> _PooledConnection:
+        """占用一个 channel 名额，返回承载该 channel 的连接"""
+        async def _wait_slot() -> Tuple[Optional[_PooledConnection], bool]:
+            async with self._cond:
+                while True:
+                    for pc in self._evict_locked():
+                        pc.conn.close()
+                    candidates = [pc for pc in self._conns if pc.channels < self.max_channels]
+                    if candidates:
+                        pc = min(candidates, key=lambda c: c.channels)
+                        # 没有其他 channel 在用且空闲较久的连接可能已被对端或中间网络静默断开，需要探活
+                        need_check = (
+                            self.health_check_idle > 0
+                            and pc.channels == 0
+                            and time.monotonic() - pc.last_used > self.health_check_idle
+                        )
+                        pc.channels += 1
+                        return pc, need_check
+                    if len(self._conns) + self._connecting < self.max_size:
+                        self._connecting += 1
+                        return None, False
+                    await self._cond.wait()
+
+        while True:
+            pc, need_check = await asyncio.wait_for(_wait_slot(), timeout=self.acquire_timeout)
+            if pc is None:
+                break
+            if not need_check or await self._is_alive(pc):
+                return pc
+            await self.release(pc, broken=True)
+
+        try:
+            conn = await self._connect()
+        except BaseException:
+            async with self._cond:
+                self._connecting -= 1
+                self._cond.notify_all()
+            raise
+        pc = _PooledConnection(conn)
+        pc.channels = 1
+        async with self._cond:
+            self._connecting -= 1
+            self._conns.append(pc)
+            self._cond.notify_all()
+        return pc
+
+    async def release(self, pc: _PooledConnection, broken: bool = False):
+        """释放 channel 名额；broken=True 表示连接层出错，关闭该连接"""
+        async with self._cond:
+            pc.channels -= 1
+            pc.last_used = time.monotonic()
+            if broken:
+                pc.broken = True
+            for removed in self._evict_locked():
+                removed.conn.close()
+            self._cond.notify_all()
+
+    async def connect_dedicated(self) -> asyncssh.SSHClientConnection:
+        """
+        建立一条不计入连接池的独立连接，供长期占用 channel 的常驻进程使用，
+        避免其永久占用连接池的 channel 名额；调用方负责关闭
+        """
+        return await self._connect()
+
+    @asynccontextmanager
+    async def connection(self):
+        """以上下文管理器方式使用连接，连接层异常时丢弃该连接"""
+        pc = await self.acquire()
+        try:
+            yield pc.conn
+        except (asyncssh.DisconnectError, asyncssh.ConnectionLost, ConnectionError):
+            await self.release(pc, broken=True)
+            raise
+        except BaseException:
+            await self.release(pc)
+            raise
+        else:
+            await self.release(pc)
+
+    async def close_all(self):
+        """关闭所有连接"""
+        async with self._cond:
+            conns = self._conns
+            self._conns = []
+            self._cond.notify_all()
+        for pc in conns:
+            pc.conn.close()
+        for pc in conns:
+            await pc.conn.wait_closed()
+
+
+# 进程级连接池注册表，所有 AsyncSSHService 实例共享
+_pools: Dict[Tuple[str, int, str], AsyncSSHConnectionPool] = {}
+
+def get_async_connection_pool(
+    host: str,
+    port: int,
+    username: str,
+    password: Optional[str] = None,
+    key_path: Optional[str] = None
+) -> AsyncSSHConnectionPool:
+    """获取（或创建）指定服务器的共享异步连接池"""
+    key = (host, port, username)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = AsyncSSHConnectionPool(
+            host=host,
+            port=port,
+            username=username,
+            password=password,
+            key_path=key_path,
+            max_size=settings.ssh_pool_max_size,
+            max_channels=settings.ssh_max_channels_per_connection,
+            idle_timeout=settings.ssh_pool_idle_timeout,
+            keepalive_interval=settings.ssh_keepalive_interval,
+            acquire_timeout=settings.ssh_pool_acquire_timeout,
+            health_check_idle=settings.ssh_pool_health_check_idle
+        )
+        _pools[key] = pool
+    return pool
+
+async def close_all_async_pools():
+    """关闭所有异步连接池（应用退出时调用）"""
+    pools = list(_pools.values())
+    _pools.clear()
+    for pool in pools:
+        await pool.close_all()
+
+async def _read_local_file(local_path: str, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    """分块读取本地文件（在线程中读取，不阻塞事件循环）"""
+    with open(local_path, 'rb') as f:
+        while chunk := await asyncio.to_thread(f.read, chunk_size):
+            yield chunk
+
+async def _remove_quietly(sftp: asyncssh.SFTPClient, remote_path: str):
+    """删除远程临时文件，文件不存在等错误忽略"""
+    try:
+        await sftp.remove(remote_path)
+    except (asyncssh.SFTPError, OSError):
+        pass
+
+
+class AsyncSSHService:
+    """
+    基于 asyncssh 的远程操作服务：远程操作期间只挂起协程，不占用线程池，
+    一个 uvicorn worker 即可同时承载大量进行中的远程命令/文件传输/对话推理。
+    """
+
+    def __init__(self, node: Optional[str] = None):
+        """node: 节点名称（见 node_registry），为空时使用主节点"""
+        worker = get_node(node)
+        self.node = worker.name
+        self.host = worker.host
+        self.port = worker.port
+        self.username = worker.username
+        self.password = worker.password
+        self.key_path = worker.key_path
+        self.pool = get_async_connection_pool(
+            host=self.host,
+            port=self.port,
+            username=self.username,
+            password=self.password,
+            key_path=self.key_path
+        )
+
+    async def execute_command(self, command: str, timeout: int = 30, input: Optional[str] = None) -> Tuple[str, str, int]:
+        """
+        执行命令，input 不为空时写入命令的 stdin
+        返回: (stdout, stderr, return_code)
+        """
+        logger.info(f"[AsyncSSH] 执行命令 ({self.host}:{self.port}): {command[:200]}..." if len(command) > 200 else f"[AsyncSSH] 执行命令 ({self.host}:{self.port}): {command}")
+        logger.info(f"[AsyncSSH] 超时: {timeout}秒")
+        try:
+            async with self.pool.connection() as conn:
+                result = await conn.run(command, input=input, check=False, timeout=timeout, encoding='utf-8', errors='ignore')
+        except asyncssh.TimeoutError as e:
+            logger.error(f"[AsyncSSH] 命令执行超时 ({timeout}秒): {command[:200]}")
+            raise TimeoutError(f"命令执行超时（{timeout}秒）") from e
+        except Exception as e:
+            logger.error(f"[AsyncSSH] 执行命令时发生异常: {str(e)}", exc_info=True)
+            raise
+
+        stdout_text = result.stdout or ""
+        stderr_text = result.stderr or ""
+        exit_status = result.exit_status if result.exit_status is not None else -1
+        logger.info(f"[AsyncSSH] 命令执行完成，退出码: {exit_status}")
+        logger.info(f"[AsyncSSH] 标准输出 (stdout): {stdout_text[:1000]}")
+        logger.info(f"[AsyncSSH] 标准错误 (stderr): {stderr_text[:1000]}")
+        if exit_status != 0:
+            logger.warning(f"[AsyncSSH] 命令执行失败，退出码: {exit_status}, 错误: {stderr_text}")
+        return stdout_text, stderr_text, exit_status
+
+    async def run_pipeline(self, steps: List[str], timeout: int = 60, stop_on_error: bool = True) -> List[Tuple[str, str, int]]:
+        """
+        在一个 channel 上一次性执行多条命令（一次往返）
+        参数:
+            steps: 按顺序执行的命令列表
+            timeout: 整个流水线的超时时间（秒）
+            stop_on_error: 某一步失败（退出码非0）后是否停止执行后续步骤
+        返回: 已执行步骤的 [(stdout, stderr, return_code), ...]
+        """
+        script, marker = build_pipeline_script(steps, stop_on_error)
+        logger.info(f"[AsyncSSH] 执行命令流水线，共 {len(steps)} 步")
+        for index, step in enumerate(steps):
+            logger.info(f"[AsyncSSH] 步骤 {index}: {step[:200]}")
+        try:
+            async with self.pool.connection() as conn:
+                result = await conn.run("bash -s", input=script, check=False, timeout=timeout, encoding='utf-8', errors='ignore')
+        except asyncssh.TimeoutError as e:
+            logger.error(f"[AsyncSSH] 命令流水线执行超时 ({timeout}秒)")
+            raise TimeoutError(f"命令流水线执行超时（{timeout}秒）") from e
+        except Exception as e:
+            logger.error(f"[AsyncSSH] 执行命令流水线时发生异常: {str(e)}", exc_info=True)
+            raise
+
+        results = parse_pipeline_output(result.stdout or "", result.stderr or "", marker, len(steps))
+        for index, (_, step_stderr, code) in enumerate(results):
+            logger.info(f"[AsyncSSH] 步骤 {index} 退出码: {code}")
+            if code != 0:
+                logger.warning(f"[AsyncSSH] 步骤 {index} 执行失败，错误: {step_stderr}")
+        return results
+
+    async def execute_chat_script(self, config: Dict, script_path: str, timeout: int = 300) -> Dict:
+        """执行对话推理脚本（Python脚本方式），返回 {"role": "assistant", "content": "..."}"""
+        command = build_chat_script_command(config, script_path)
+        stdout, stderr, return_code = await self.execute_command(command, timeout=timeout)
+        if return_code != 0:
+            raise Exception(f"推理脚本执行失败: {stderr}")
+        return parse_chat_script_output(stdout)
+
+    async def execute_chat_cli(self, config: Dict, template: str = "qwen2", timeout: int = 300) -> Dict:
+        """通过远程 CLI 包装脚本执行对话推理（pexpect 或 JSON lines 协议），返回 {"role": "assistant", "content": "..."}"""
+        logger.info("[AsyncSSH] 使用CLI模式执行对话推理")
+        if settings.chat_cli_protocol == "jsonl":
+            command, request_line, request_id = build_chat_jsonl_request(config, template)
+            stdout, stderr, return_code = await self.execute_command(command, timeout=timeout, input=request_line)
+            if return_code != 0:
+                logger.error(f"[AsyncSSH] CLI执行失败，返回码: {return_code}, stderr: {stderr[-1000:]}")
+                raise Exception(f"CLI执行失败: {stderr[-1000:]}")
+            return parse_chat_jsonl_output(stdout, request_id)
+        command = build_chat_cli_command(config, template)
+        stdout, stderr, return_code = await self.execute_command(command, timeout=timeout)
+        if return_code != 0:
+            logger.error(f"[AsyncSSH] CLI执行失败，返回码: {return_code}, stderr: {stderr}")
+            raise Exception(f"CLI执行失败: {stderr}")
+        return parse_chat_cli_output(stdout)
+
+    async def check_process(self, process_id: str) -> bool:
+        """检查进程是否运行"""
+        command = f"ps -p {process_id} > /dev/null 2>&1 && echo 'running' || echo 'stopped'"
+        stdout, stderr, return_code = await self.execute_command(command)
+        return "running" in stdout
+
+    async def read_file(self, file_path: str) -> str:
+        """读取远程文件内容（SFTP）"""
+        logger.info(f"[AsyncSSH] 读取远程文件: {file_path}")
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.start_sftp_client() as sftp:
+                    async with sftp.open(file_path, 'rb') as f:
+                        data = await f.read()
+        except (asyncssh.SFTPError, OSError) as e:
+            logger.error(f"[AsyncSSH] 读取文件失败，路径: {file_path}, 错误: {str(e)}")
+            raise Exception(f"读取文件失败: {str(e)}")
+        content = data.decode('utf-8', errors='ignore')
+        logger.info(f"[AsyncSSH] 文件读取成功，大小: {len(content)} 字符")
+        return content
+
+    async def read_file_range(self, file_path: str, offset: int, limit: int) -> Tuple[bytes, int, int]:
+        """
+        按字节区间读取远程文件（SFTP seek），只传输 [offset, offset+limit) 范围内的数据
+        offset 超过当前文件大小时（文件被重写）从头开始读取，文件不存在时抛出 FileNotFoundError
+        返回: (data, 实际起始偏移, 读取时的文件大小)
+        """
+        logger.info(f"[AsyncSSH] 读取远程文件区间: {file_path}, offset: {offset}, limit: {limit}")
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.start_sftp_client() as sftp:
+                    async with sftp.open(file_path, 'rb') as f:
+                        attrs = await f.stat()
+                        size = attrs.size or 0
+                        if offset > size:
+                            logger.info(f"[AsyncSSH] 偏移 {offset} 超过文件大小 {size}，从头读取")
+                            offset = 0
+                        length = min(limit, size - offset)
+                        data = b""
+                        if length > 0:
+                            await f.seek(offset)
+                            data = await f.read(length)
+        except asyncssh.SFTPNoSuchFile as e:
+            logger.error(f"[AsyncSSH] 文件不存在，路径: {file_path}")
+            raise FileNotFoundError(f"文件不存在: {file_path}") from e
+        except (asyncssh.SFTPError, OSError) as e:
+            logger.error(f"[AsyncSSH] 读取文件失败，路径: {file_path}, 错误: {str(e)}")
+            raise Exception(f"读取文件失败: {str(e)}")
+        return data, offset, size
+
+    async def tail_file(self, file_path: str, lines: int) -> Tuple[bytes, int]:
+        """
+        读取远程文件最后 lines 行（一次往返）
+        返回: (data, 读取时的文件大小)，文件大小可作为后续增量读取的起始偏移
+        """
+        logger.info(f"[AsyncSSH] 读取远程文件末尾 {lines} 行: {file_path}")
+        # 先固定文件大小，只在该大小范围内取末尾若干行，保证返回的偏移与内容一致
+        quoted_path = shlex.quote(file_path)
+        command = f"__size=$(stat -c %s {quoted_path}) && echo $__size && head -c $__size {quoted_path} | tail -n {int(lines)}"
+        try:
+            async with self.pool.connection() as conn:
+                result = await conn.run(command, check=False, timeout=30, encoding=None)
+        except Exception as e:
+            logger.error(f"[AsyncSSH] 读取文件末尾失败: {str(e)}", exc_info=True)
+            raise
+        if result.exit_status != 0:
+            stderr_text = (result.stderr or b"").decode('utf-8', errors='ignore')
+            logger.error(f"[AsyncSSH] 读取文件失败，路径: {file_path}, 错误: {stderr_text}")
+            raise Exception(f"读取文件失败: {stderr_text}")
+        size_line, _, data = (result.stdout or b"").partition(b"\n")
+        return data, int(size_line.strip() or 0)
+
+    @asynccontextmanager
+    async def follow_file(self, file_path: str) -> AsyncIterator[Tuple[int, asyncssh.SSHReader]]:
+        """
+        跟踪远程文件新增内容（tail -F），在一条独立连接上持续读取，不占用连接池的 channel 名额，
+        避免多个长时间的日志跟踪占满连接池、阻塞普通的短命令
+        返回: (起始偏移, stdout 读取器)，起始偏移为开始跟踪时的文件大小，读取器中的内容从该偏移开始
+        退出上下文时关闭连接，远程的 tail 进程随之退出
+        """
+        logger.info(f"[AsyncSSH] 开始跟踪远程文件: {file_path}")
+        # tail 放到后台，前台阻塞在读取 stdin 上：channel 关闭时 stdin 收到 EOF，随即结束 tail，
+        # 避免远程 tail 进程在文件没有新内容时一直残留
+        quoted_path = shlex.quote(file_path)
+        command = (
+            f"__size=$(stat -c %s {quoted_path} 2>/dev/null || echo 0); echo $__size; "
+            f"tail -c +$((__size + 1)) -F {quoted_path} 2>/dev/null & __pid=$!; "
+            f"read __line; kill $__pid 2>/dev/null"
+        )
+        conn = await self.pool.connect_dedicated()
+        try:
+            process = await conn.create_process(command, encoding=None)
+            try:
+                size_line = await process.stdout.readline()
+                yield int(size_line.strip() or 0), process.stdout
+            finally:
+                process.stdin.write_eof()
+                process.close()
+                logger.info(f"[AsyncSSH] 停止跟踪远程文件: {file_path}")
+        finally:
+            conn.close()
+
+    async def upload_file(self, local_path: str, remote_path: str):
+        """上传文件到远程服务器（SFTP），自动创建远程目录；启用传输压缩且文件足够大时压缩传输"""
+        logger.info(f"[AsyncSSH] 上传文件: {local_path} -> {remote_path}")
+        codec = get_transfer_codec()
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.start_sftp_client() as sftp:
+                    remote_dir = '/'.join(remote_path.split('/')[:-1])
+                    if remote_dir:
+                        await sftp.makedirs(remote_dir, exist_ok=True)
+                    if codec and os.path.getsize(local_path) >= settings.transfer_compression_min_size:
+                        part_path = f"{remote_path}.{uuid.uuid4().hex[:8]}.part"
+                        try:
+                            await self._send_compressed(conn, codec, _read_local_file(local_path), part_path)
+                            await sftp.posix_rename(part_path, remote_path)
+                        except BaseException:
+                            await _remove_quietly(sftp, part_path)
+                            raise
+                    else:
+                        await sftp.put(local_path, remote_path)
+            logger.info(f"[AsyncSSH] 文件上传成功")
+        except Exception as e:
+            logger.error(f"[AsyncSSH] 文件上传失败: {str(e)}", exc_info=True)
+            raise
+
+    async def _send_compressed(
+        self,
+        conn: asyncssh.SSHClientConnection,
+        codec: TransferCodec,
+        chunks: AsyncIterator[bytes],
+        remote_path: str
+    ):
+        """边压缩边写入远程解压进程的标准输入，由远程流式解压到 remote_path"""
+        compressor = codec.compressor()
+        raw_size = sent_size = 0
+        command = f"{codec.remote_decompress} > {shlex.quote(remote_path)}"
+        async with conn.create_process(command, encoding=None) as process:
+            async for chunk in chunks:
+                raw_size += len(chunk)
+                data = compressor.compress(chunk)
+                if data:
+                    sent_size += len(data)
+                    process.stdin.write(data)
+                    await process.stdin.drain()
+            data = compressor.flush()
+            sent_size += len(data)
+            process.stdin.write(data)
+            process.stdin.write_eof()
+            result = await process.wait()
+        if result.exit_status != 0:
+            raise Exception(f"远程解压失败: {(result.stderr or b'').decode('utf-8', errors='replace').strip()}")
+        logger.info(f"[AsyncSSH] 压缩传输（{codec.name}）: {raw_size} -> {sent_size} 字节")
+
+    async def upload_stream(self, chunks: AsyncIterator[bytes], remote_path: str, max_size: int) -> Tuple[int, str]:
+        """
+        流式上传：边接收边写入远程文件，接收和写入通过有界队列（upload_buffer_chunks 块）并行进行，
+        内存占用与文件大小无关；同时统计大小并计算 SHA-256，超过 max_size 时中止（UploadTooLargeError）。
+        先写入临时文件（remote_path.<随机后缀>.part），完成后改名，失败时删除，不会留下不完整的文件。
+        启用传输压缩且文件不小于 transfer_compression_min_size 时压缩传输，远程流式解压
+        返回: (文件大小, SHA-256)
+        """
+        logger.info(f"[AsyncSSH] 流式上传文件: {remote_path}")
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(settings.upload_buffer_chunks, 1))
+        digest = hashlib.sha256()
+        size = 0
+
+        async def receive():
+            nonlocal size
+            try:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_size:
+                        raise UploadTooLargeError(f"文件大小超过限制（{max_size} 字节）")
+                    digest.update(chunk)
+                    await queue.put(chunk)
+            except Exception:
+                # 通知写入端结束，错误由 await receiver 抛出
+                await queue.put(None)
+                raise
+            await queue.put(None)
+
+        async def queued():
+            while (chunk := await queue.get()) is not None:
+                yield chunk
+
+        codec = get_transfer_codec()
+        # 同一路径同时有多个上传时（例如客户端重试）各自写入不同的临时文件
+        part_path = f"{remote_path}.{uuid.uuid4().hex[:8]}.part"
+        async with self.pool.connection() as conn:
+            async with conn.start_sftp_client() as sftp:
+                remote_dir = '/'.join(remote_path.split('/')[:-1])
+                if remote_dir:
+                    await sftp.makedirs(remote_dir, exist_ok=True)
+                receiver = asyncio.create_task(receive())
+                try:
+                    received = queued()
+                    head: List[bytes] = []
+                    compress = False
+                    if codec:
+                        # 先缓冲 transfer_compression_min_size 字节，文件不小于该值时才压缩传输
+                        head_size = 0
+                        async for chunk in received:
+                            head.append(chunk)
+                            head_size += len(chunk)
+                            if head_size >= settings.transfer_compression_min_size:
+                                compress = True
+                                break
+
+                    async def all_chunks():
+                        for chunk in head:
+                            yield chunk
+                        async for chunk in received:
+                            yield chunk
+
+                    if compress:
+                        await self._send_compressed(conn, codec, all_chunks(), part_path)
+                    else:
+                        async with sftp.open(part_path, 'wb') as f:
+                            async for chunk in all_chunks():
+                                await f.write(chunk)
+                    await receiver
+                    await sftp.posix_rename(part_path, remote_path)
+                except BaseException as e:
+                    receiver.cancel()
+                    logger.error(f"[AsyncSSH] 流式上传失败: {remote_path}, 错误: {str(e)}")
+                    await _remove_quietly(sftp, part_path)
+                    raise
+        logger.info(f"[AsyncSSH] 流式上传成功: {remote_path}, 大小: {size} 字节")
+        return size, digest.hexdigest()
+
+    async def list_dir(self, dir_path: str) -> Dict[str, int]:
+        """列出远程目录中的文件及其大小（目录不存在时返回空字典）"""
+        async with self.pool.connection() as conn:
+            async with conn.start_sftp_client() as sftp:
+                try:
+                    entries = await sftp.readdir(dir_path)
+                except asyncssh.SFTPNoSuchFile:
+                    return {}
+        return {
+            entry.filename: entry.attrs.size or 0
+            for entry in entries
+            if entry.filename not in (".", "..")
+        }
+
+    async def read_stream(self, remote_path: str, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        """逐块读取远程文件（SFTP），不在内存中缓存整个文件"""
+        async with self.pool.connection() as conn:
+            async with conn.start_sftp_client() as sftp:
+                async with sftp.open(remote_path, 'rb') as f:
+                    while chunk := await f.read(chunk_size):
+                        yield chunk
+
+    async def download_file(self, remote_path: str, local_path: str):
+        """从远程服务器下载文件（SFTP）；启用传输压缩且文件足够大时由远程压缩输出、本地流式解压"""
+        logger.info(f"[AsyncSSH] 下载文件: {remote_path} -> {local_path}")
+        codec = get_transfer_codec()
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.start_sftp_client() as sftp:
+                    if codec and (await sftp.stat(remote_path)).size >= settings.transfer_compression_min_size:
+                        await self._receive_compressed(conn, codec, remote_path, local_path)
+                    else:
+                        await sftp.get(remote_path, local_path)
+            logger.info(f"[AsyncSSH] 文件下载成功")
+        except Exception as e:
+            logger.error(f"[AsyncSSH] 文件下载失败: {str(e)}", exc_info=True)
+            raise
+
+    async def _receive_compressed(
+        self,
+        conn: asyncssh.SSHClientConnection,
+        codec: TransferCodec,
+        remote_path: str,
+        local_path: str
+    ):
+        """
+        远程压缩输出文件内容，本地边接收边解压写入 local_path（先写临时文件，完成后改名）
+        解压和文件读写在线程中执行，不阻塞事件循环
+        """
+        decompressor = codec.decompressor()
+        part_path = f"{local_path}.{uuid.uuid4().hex[:8]}.part"
+        raw_size = received_size = 0
+        command = f"{codec.remote_compress} < {shlex.quote(remote_path)}"
+
+        def write_decompressed(f, data: bytes) -> int:
+            data = decompressor.decompress(data)
+            f.write(data)
+            return len(data)
+
+        try:
+            async with conn.create_process(command, encoding=None) as process:
+                f = await asyncio.to_thread(open, part_path, 'wb')
+                try:
+                    while data := await process.stdout.read(1024 * 1024):
+                        received_size += len(data)
+                        raw_size += await asyncio.to_thread(write_decompressed, f, data)
+                finally:
+                    await asyncio.to_thread(f.close)
+                result = await process.wait()
+            if result.exit_status != 0:
+                raise Exception(f"远程压缩失败: {(result.stderr or b'').decode('utf-8', errors='replace').strip()}")
+            await asyncio.to_thread(os.replace, part_path, local_path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        logger.info(f"[AsyncSSH] 压缩传输（{codec.name}）: {received_size} -> {raw_size} 字节")
@@ -0,0 +1,217 @@
+import json
+import logging
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.db_models import BatchInferenceJobDB
+from app.models import BatchInferenceCreate
+from app.services.async_ssh_service import AsyncSSHService
+from app.services.file_service import FileService
+from app.services.ssh_service import build_remote_python_command, get_remote_script_path
+from app.services.task_service import PID_MARKER, parse_launch_output
+
+logger = logging.getLogger(__name__)
+
+# 输出目录下的文件
+RESULTS_FILE = "results.jsonl"
+PROGRESS_FILE = "progress.json"
+LOG_FILE = "inference.log"
+# 进度查询命令输出中表示推理进程仍在运行的标记行
+ALIVE_MARKER = "__BATCH_ALIVE__"
+
+class BatchInferenceService:
+    """
+    离线批量推理：对已上传的提示文件（JSON / JSONL）在模型所在节点上后台运行 batch_inference.py，
+    模型只加载一次并按批生成，结果逐条写入输出目录下的 results.jsonl。
+    进度（已完成数、tokens/秒）由脚本写入 progress.json，查询任务时读取并更新到数据库
+    """
+
+    def __init__(self):
+        self.file_service = FileService()
+
+    def build_command(self, job: BatchInferenceJobDB, base_model_path: str, template: str) -> str:
+        """后台启动批量推理脚本并输出进程PID（同训练任务，子shell忽略 SIGHUP，SSH 断开后继续运行）"""
+        script = get_remote_script_path(settings.batch_inference_script_path)
+        python_command = build_remote_python_command(
+            f"{script} "
+            f"--base-model {base_model_path} "
+            f"--adapter {job.model_path} "
+            f"--template {template} "
+            f"--input {job.dataset_path} "
+            f"--output {job.output_dir}/{RESULTS_FILE} "
+            f"--progress {job.output_dir}/{PROGRESS_FILE} "
+            f"--batch-size {job.batch_size} "
+            f"--max-tokens {job.max_tokens} "
+            f"--temperature {job.temperature}"
+        )
+        return (
+            f"( trap '' HUP; {python_command} ) "
+            f"> {job.output_dir}/{LOG_FILE} 2>&1 < /dev/null & "
+            f"echo {PID_MARKER}$!"
+        )
+
+    async def create_job(self, db: Session, user_id: str, job_data: BatchInferenceCreate) -> BatchInferenceJobDB:
+        """校验模型和提示文件，在模型所在节点上启动批量推理；校验失败时抛出 ValueError"""
+        model_info = self.file_service.get_model_by_path(db, job_data.model_path, user_id)
+        if not model_info:
+            raise ValueError("模型不存在或无权访问")
+        if not model_info.base_model_path:
+            raise ValueError("模型缺少基础模型路径信息")
+        dataset = next(
+            (d for d in self.file_service.get_user_datasets(db, user_id) if d.file_path == job_data.dataset_path), None
+        )
+        if dataset is None:
+            raise ValueError("提示文件不存在")
+        batch_size = job_data.batch_size or settings.batch_inference_batch_size
+        if batch_size < 1:
+            raise ValueError("batch_size 必须大于 0")
+
+        db_job = BatchInferenceJobDB(
+            user_id=user_id,
+            name=job_data.name or dataset.filename,
+            model_path=job_data.model_path,
+            dataset_path=job_data.dataset_path,
+            output_dir="",
+            batch_size=batch_size,
+            max_tokens=job_data.max_tokens or 512,
+            temperature=job_data.temperature if job_data.temperature is not None else 0.0,
+            status="pending",
+            node=model_info.node
+        )
+        db.add(db_job)
+        db.flush()
+        db_job.output_dir = f"{settings.remote_user_data_dir}/{user_id}/batch_inference/{db_job.job_id}"
+        db.commit()
+        db.refresh(db_job)
+        logger.info(f"[批量推理] 创建任务，任务ID: {db_job.job_id}, 模型: {db_job.model_path}, 提示文件: {db_job.dataset_path}")
+
+        # 模板（同对话推理，使用默认值）
+        template = "qwen2"
+        ssh_service = AsyncSSHService(db_job.node)
+        try:
+            # 提示文件不在模型所在节点上时先传输过去
+            await self.file_service.stage_dataset(db, user_id, db_job.dataset_path, db_job.node)
+            command = self.build_command(db_job, model_info.base_model_path, template)
+            logger.info(f"[批量推理] 启动命令: {command}")
+            results = await ssh_service.run_pipeline([f"mkdir -p {db_job.output_dir}", command], timeout=60)
+            if len(results) != 2:
+                raise Exception(f"创建输出目录失败: {results[-1][1] if results else ''}")
+            stdout, stderr, return_code = results[1]
+            pid, _ = parse_launch_output(stdout)
+            if return_code != 0 or not pid:
+                raise Exception(f"未获取到推理进程PID: {stdout[:500]} {stderr[:500]}")
+            db_job.process_id = pid
+            db_job.status = "running"
+            logger.info(f"[批量推理] 已启动，任务ID: {db_job.job_id}, 节点: {ssh_service.node}, PID: {pid}")
+        except Exception as e:
+            logger.error(f"[批量推理] 启动失败，任务ID: {db_job.job_id}, 错误: {str(e)}", exc_info=True)
+            db_job.status = "failed"
+            db_job.error = f"启动失败: {str(e)}"
+        db.commit()
+        db.refresh(db_job)
+        return db_job
+
+    async def refresh(self, db: Session, job: BatchInferenceJobDB) -> BatchInferenceJobDB:
+        """读取运行中任务的进度文件并检查进程是否存活（一次往返），更新数据库中的进度和状态"""
+        if job.status != "running":
+            return job
+        ssh_service = AsyncSSHService(job.node)
+        command = (
+            f"cat {job.output_dir}/{PROGRESS_FILE} 2>/dev/null; echo; "
+            f"kill -0 {job.process_id} 2>/dev/null && echo {ALIVE_MARKER}"
+        )
+        try:
+            stdout, _, _ = await ssh_service.execute_command(command, timeout=30)
+        except Exception as e:
+            logger.warning(f"[批量推理] 读取进度失败，任务ID: {job.job_id}, 错误: {str(e)}")
+            return job
+
+        lines = [line.strip() for line in stdout.splitlines() if line.strip()]
+        alive = ALIVE_MARKER in lines
+        progress: Dict = {}
+        for line in lines:
+            if line.startswith("{"):
+                try:
+                    progress = json.loads(line)
+                except json.JSONDecodeError:
+                    pass
+
+        job.total = progress.get("total", job.total)
+        job.completed = progress.get("completed", job.completed)
+        job.completion_tokens = progress.get("completion_tokens", job.completion_tokens)
+        job.tokens_per_second = progress.get("tokens_per_second", job.tokens_per_second)
+        if progress.get("status") == "completed":
+            job.status = "completed"
+        elif progress.get("status") == "failed":
+            job.status = "failed"
+            job.error = progress.get("error")
+        elif not alive:
+            # 进程已退出但未写入结束状态（例如被 OOM killer 终止）
+            log_tail, _, _ = await ssh_service.execute_command(f"tail -n 20 {job.output_dir}/{LOG_FILE} 2>/dev/null")
+            job.status = "failed"
+            job.error = f"推理进程已退出\n{log_tail}"
+        db.commit()
+        db.refresh(job)
+        if job.status != "running":
+            logger.info(f"[批量推理] 任务结束，任务ID: {job.job_id}, 状态: {job.status}, 完成: {job.completed}/{job.total}")
+        return job
+
+    def get_job(self, db: Session, job_id: str, user_id: str) -> Optional[BatchInferenceJobDB]:
+        return db.query(BatchInferenceJobDB).filter(
+            BatchInferenceJobDB.job_id == job_id,
+            BatchInferenceJobDB.user_id == user_id
+        ).first()
+
+    def get_user_jobs(self, db: Session, user_id: str) -> List[BatchInferenceJobDB]:
+        return db.query(BatchInferenceJobDB).filter(
+            BatchInferenceJobDB.user_id == user_id
+        ).order_by(BatchInferenceJobDB.created_at.desc()).all()
+
+    async def read_results(self, job: BatchInferenceJobDB, offset: int = 0, limit: Optional[int] = None) -> Dict:
+        """
+        增量读取结果文件：返回 [offset, next_offset) 区间内的完整行（末尾不完整的行留到下次读取）
+        第一行就超过 limit 时继续读到该行结束，保证每次至少前进一行；
+        无法解析的行（例如推理进程异常退出时写了一半）跳过，其字节偏移记录在 invalid_lines 中
+        结果文件不存在时抛出 FileNotFoundError
+        返回: {"results", "invalid_lines", "offset", "next_offset", "file_size"}
+        """
+        max_bytes = settings.task_log_max_read_bytes
+        limit = min(limit or max_bytes, max_bytes)
+        ssh_service = AsyncSSHService(job.node)
+        path = f"{job.output_dir}/{RESULTS_FILE}"
+        data, start, file_size = await ssh_service.read_file_range(path, offset, limit)
+        end = data.rfind(b"\n")
+        while end < 0 and start + len(data) < file_size:
+            more, _, file_size = await ssh_service.read_file_range(path, start + len(data), max_bytes)
+            if not more:
+                break
+            index = more.find(b"\n")
+            if index < 0:
+                data += more
+            else:
+                data += more[:index + 1]
+                end = len(data) - 1
+        data = data[:end + 1]
+
+        results: List[Dict] = []
+        invalid_lines: List[int] = []
+        position = start
+        for line in data.split(b"\n")[:-1]:
+            if line.strip():
+                try:
+                    result = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    result = None
+                if isinstance(result, dict):
+                    results.append(result)
+                else:
+                    logger.warning(f"[批量推理] 跳过无法解析的结果行: {path}, 偏移: {position}")
+                    invalid_lines.append(position)
+            position += len(line) + 1
+        return {
+            "results": results,
+            "invalid_lines": invalid_lines,
+            "offset": start,
+            "next_offset": start + len(data),
+            "file_size": file_size
+        }
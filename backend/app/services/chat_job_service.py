@@ -0,0 +1,208 @@
+import asyncio
+import ipaddress
+import logging
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+import requests
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal
+from app.db_models import ChatJobDB
+from app.models import ChatJobCreate, ChatRequest
+from app.services.chat_service import ChatService
+from app.services.file_service import FileService
+
+logger = logging.getLogger(__name__)
+
+# 未结束的任务状态（服务重启后重新执行）
+UNFINISHED_STATUSES = ["queued", "running"]
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+def validate_webhook_url(url: str, resolve: bool = True):
+    """
+    检查 webhook 地址，不允许时抛出 ValueError：只允许 http/https；
+    配置了 chat_job_webhook_allowed_hosts 时只允许列表中的主机，否则解析主机名，
+    拒绝内网、回环、链路本地和保留地址，防止通过回调访问内部服务
+    resolve=False 时只检查直接写成IP的地址（提交时不阻塞事件循环，回调前再完整检查）
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("webhook_url 必须是 http 或 https 地址")
+    host = parsed.hostname.lower()
+    allowed_hosts = [h.lower() for h in settings.chat_job_webhook_allowed_hosts]
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise ValueError(f"webhook_url 的主机不在允许列表中: {host}")
+        return
+
+    try:
+        addresses = [str(ipaddress.ip_address(host))]
+    except ValueError:
+        if not resolve:
+            return
+        try:
+            infos = socket.getaddrinfo(host, parsed.port or (443 if parsed.scheme == "https" else 80), proto=socket.IPPROTO_TCP)
+        except (socket.gaierror, UnicodeError) as e:
+            raise ValueError(f"无法解析 webhook_url 的主机: {host}") from e
+        addresses = [info[4][0] for info in infos]
+    for address in addresses:
+        if not _is_public_address(address):
+            raise ValueError(f"webhook_url 不能指向内网或保留地址: {host} ({address})")
+
+
+class ChatJobManager:
+    """
+    异步对话任务：提交后立即返回任务ID，生成在后台进行，结果保存在 ChatJobDB 中，
+    客户端轮询获取或在完成时回调 webhook_url。HTTP 连接不再随生成时间占用，也不受代理超时影响。
+    同时执行的任务数由 chat_job_max_concurrency 限制，服务重启后未完成的任务重新执行。
+    """
+
+    def __init__(self):
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._running: Dict[str, asyncio.Task] = {}
+        self.chat_service = ChatService()
+        self.file_service = FileService()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # 在事件循环中创建
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(settings.chat_job_max_concurrency, 1))
+        return self._semaphore
+
+    def submit(self, db: Session, user_id: str, job_data: ChatJobCreate) -> ChatJobDB:
+        """保存任务并在后台开始执行；模型不存在时抛出 ValueError"""
+        if not self.file_service.get_model_by_path(db, job_data.model_path, user_id):
+            raise ValueError("模型不存在或无权访问")
+        if job_data.webhook_url:
+            validate_webhook_url(job_data.webhook_url, resolve=False)
+
+        request = ChatRequest(**job_data.model_dump(exclude={"webhook_url"}))
+        db_job = ChatJobDB(
+            user_id=user_id,
+            model_path=job_data.model_path,
+            status="queued",
+            request=request.model_dump_json(),
+            webhook_url=job_data.webhook_url
+        )
+        db.add(db_job)
+        db.commit()
+        db.refresh(db_job)
+        logger.info(f"[对话任务] 已提交，任务ID: {db_job.job_id}, 用户: {user_id}, 模型: {job_data.model_path}")
+        self._start(db_job.job_id)
+        return db_job
+
+    def _start(self, job_id: str):
+        task = asyncio.create_task(self._run(job_id))
+        self._running[job_id] = task
+        task.add_done_callback(lambda _: self._running.pop(job_id, None))
+
+    async def _run(self, job_id: str):
+        async with self._get_semaphore():
+            db = SessionLocal()
+            try:
+                job = db.query(ChatJobDB).filter(ChatJobDB.job_id == job_id).first()
+                if job is None:
+                    return
+                job.status = "running"
+                job.started_at = datetime.utcnow()
+                db.commit()
+                logger.info(f"[对话任务] 开始执行，任务ID: {job_id}")
+
+                try:
+                    request = ChatRequest.model_validate_json(job.request)
+                    response = await self.chat_service.chat_completion(db, job.user_id, request)
+                    job.status = "completed"
+                    job.content = response.content
+                except asyncio.CancelledError:
+                    # 服务关闭：保持 running，重启后重新执行
+                    raise
+                except Exception as e:
+                    logger.error(f"[对话任务] 执行失败，任务ID: {job_id}, 错误: {str(e)}")
+                    job.status = "failed"
+                    job.error = str(e)
+                job.completed_at = datetime.utcnow()
+                db.commit()
+                logger.info(f"[对话任务] 执行结束，任务ID: {job_id}, 状态: {job.status}")
+
+                if job.webhook_url:
+                    await self._notify(job)
+            finally:
+                db.close()
+
+    async def _notify(self, job: ChatJobDB):
+        """回调 webhook_url，失败时重试；每次回调前重新解析并检查地址，不跟随重定向"""
+        payload = {
+            "job_id": job.job_id,
+            "status": job.status,
+            "model_path": job.model_path,
+            "content": job.content,
+            "error": job.error,
+        }
+        for attempt in range(1, settings.chat_job_webhook_retries + 1):
+            try:
+                await asyncio.to_thread(validate_webhook_url, job.webhook_url)
+            except ValueError as e:
+                logger.warning(f"[对话任务] 拒绝 webhook 回调，任务ID: {job.job_id}, 原因: {str(e)}")
+                return
+            try:
+                response = await asyncio.to_thread(
+                    requests.post, job.webhook_url, json=payload,
+                    timeout=settings.chat_job_webhook_timeout, allow_redirects=False
+                )
+                response.raise_for_status()
+                if response.is_redirect:
+                    raise requests.exceptions.HTTPError(f"webhook 返回重定向（不跟随）: {response.status_code}", response=response)
+                logger.info(f"[对话任务] webhook 回调成功，任务ID: {job.job_id}")
+                return
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"[对话任务] webhook 回调失败（第{attempt}次），任务ID: {job.job_id}, 错误: {str(e)}")
+                if attempt < settings.chat_job_webhook_retries:
+                    await asyncio.sleep(2 ** attempt)
+
+    def get_job(self, db: Session, job_id: str, user_id: str) -> Optional[ChatJobDB]:
+        return db.query(ChatJobDB).filter(ChatJobDB.job_id == job_id, ChatJobDB.user_id == user_id).first()
+
+    def get_user_jobs(self, db: Session, user_id: str, limit: int = 50) -> List[ChatJobDB]:
+        return db.query(ChatJobDB).filter(
+            ChatJobDB.user_id == user_id
+        ).order_by(ChatJobDB.created_at.desc()).limit(limit).all()
+
+    def recover(self):
+        """服务启动时清理过期的任务，并重新执行上次未完成的任务"""
+        db = SessionLocal()
+        try:
+            if settings.chat_job_retention_hours > 0:
+                cutoff = datetime.utcnow() - timedelta(hours=settings.chat_job_retention_hours)
+                removed = db.query(ChatJobDB).filter(
+                    ChatJobDB.status.notin_(UNFINISHED_STATUSES),
+                    ChatJobDB.completed_at < cutoff
+                ).delete(synchronize_session=False)
+                if removed:
+                    logger.info(f"[对话任务] 清理过期任务 {removed} 个")
+            jobs = db.query(ChatJobDB).filter(ChatJobDB.status.in_(UNFINISHED_STATUSES)).all()
+            for job in jobs:
+                job.status = "queued"
+            db.commit()
+            for job in jobs:
+                self._start(job.job_id)
+            if jobs:
+                logger.info(f"[对话任务] 恢复未完成的任务: {[j.job_id for j in jobs]}")
+        finally:
+            db.close()
+
+    async def stop(self):
+        """服务关闭时取消正在执行的任务（保持未完成状态，重启后重新执行）"""
+        tasks = list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+chat_job_manager = ChatJobManager()
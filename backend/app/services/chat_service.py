@@ -1,22 +1,53 @@
-from app.models import ChatRequest, ChatResponse
-from app.services.ssh_service import SSHService
+from app.models import ChatRequest, ChatResponse, ChatCompareRequest, ChatCompareResult, ChatCompareResponse
+from app.services.async_ssh_service import AsyncSSHService
+from app.services.chat_session_service import ChatSession, chat_session_store
 from app.services.file_service import FileService
+from app.services.inference_service import get_inference_worker
+from app.services.response_cache_service import is_deterministic, response_cache
 from sqlalchemy.orm import Session
 from app.config import settings
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
 import logging
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
+def build_chat_chunk(
+    completion_id: str,
+    created: int,
+    model: str,
+    delta: Dict,
+    finish_reason: Optional[str] = None,
+    usage: Optional[Dict] = None
+) -> Dict:
+    """构建 OpenAI 风格的流式响应块（chat.completion.chunk）"""
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }
+    if usage is not None:
+        chunk["usage"] = usage
+    return chunk
+
 class ChatService:
     def __init__(self):
-        self.ssh_service = SSHService()
         self.file_service = FileService()
         self.chat_script_path = settings.chat_script_path
         self.chat_mode = getattr(settings, 'chat_mode', 'cli')  # 默认为cli模式
         self.llamafactory_cli_path = getattr(settings, 'llamafactory_cli_path', 'llamafactory-cli')
     
-    def chat_completion(self, db: Session, user_id: str, request: ChatRequest) -> ChatResponse:
-        """执行对话推理"""
+    def _prepare(
+        self, db: Session, user_id: str, request: ChatRequest
+    ) -> Tuple[AsyncSSHService, Dict, str, Optional[ChatSession]]:
+        """
+        校验模型并构建推理配置，返回 (模型所在节点的SSH服务, 推理配置, 模板, 会话)
+        指定 session_id 时 request.messages 只包含本轮的新消息，与服务端保存的历史拼接后推理
+        """
         # 验证模型路径属于当前用户
         model_info = self.file_service.get_model_by_path(db, request.model_path, user_id)
         if not model_info:
@@ -30,30 +61,215 @@ class ChatService:
         # 获取模板（从任务信息中获取，或使用默认值）
         template = "qwen2"  # 默认模板，可以从模型信息中获取
         
+        # 在模型所在节点上执行推理
+        ssh_service = AsyncSSHService(model_info.node)
+        
+        messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        session = None
+        if request.session_id:
+            session = chat_session_store.get(user_id, request.session_id, request.model_path, ssh_service.node)
+            logger.info(f"[ChatService] 会话: {request.session_id}, 历史消息数: {len(session.messages)}")
+            messages = session.messages + messages
+        
         # 构建推理配置
         config = {
             "base_model_path": base_model_path,
             "adapter_path": request.model_path,
-            "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
+            "messages": messages,
             "temperature": request.temperature,
             "max_tokens": request.max_tokens
         }
+        if session is not None and self.chat_mode == "worker":
+            # 常驻推理进程为会话保留对话前缀的 KV cache
+            config["session_id"] = chat_session_store.worker_session_id(user_id, request.session_id)
         
+        return ssh_service, config, template, session
+    
+    @staticmethod
+    def _remember(session: Optional[ChatSession], request: ChatRequest, content: str):
+        """把本轮的新消息和回复追加到会话历史"""
+        if session is None:
+            return
+        new_messages: List[Dict] = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+        chat_session_store.append(session, new_messages + [{"role": "assistant", "content": content}])
+    
+    async def _execute(self, ssh_service: AsyncSSHService, config: Dict, template: str) -> Dict:
         # 根据配置选择执行方式
-        if self.chat_mode == "cli":
-            logger.info("[ChatService] 使用CLI模式执行对话")
-            result = self.ssh_service.execute_chat_cli(
+        if self.chat_mode == "worker":
+            # 常驻推理进程：模型常驻显存，每条消息只需生成时间
+            logger.info(f"[ChatService] 使用常驻推理进程执行对话，节点: {ssh_service.node}")
+            return await get_inference_worker(ssh_service.node).chat(
+                config=config,
+                template=template,
+                timeout=settings.chat_timeout
+            )
+        elif self.chat_mode == "cli":
+            logger.info(f"[ChatService] 使用CLI模式执行对话，节点: {ssh_service.node}")
+            return await ssh_service.execute_chat_cli(
                 config=config,
                 template=template,
                 timeout=settings.chat_timeout
             )
         else:
-            logger.info("[ChatService] 使用Python脚本模式执行对话")
-            result = self.ssh_service.execute_chat_script(
+            logger.info(f"[ChatService] 使用Python脚本模式执行对话，节点: {ssh_service.node}")
+            return await ssh_service.execute_chat_script(
                 config=config,
                 script_path=self.chat_script_path,
                 timeout=settings.chat_timeout
             )
+    
+    async def _cache_key(self, ssh_service: AsyncSSHService, config: Dict, template: str,
+                         request: ChatRequest) -> Optional[str]:
+        """可以缓存的请求（启用缓存且 temperature<=0）返回缓存键，否则返回 None"""
+        if not response_cache.enabled or not is_deterministic(request.temperature):
+            return None
+        version = await response_cache.artifact_version(ssh_service, request.model_path)
+        return response_cache.build_key(config, template, version)
+    
+    async def chat_completion(self, db: Session, user_id: str, request: ChatRequest) -> ChatResponse:
+        """执行对话推理"""
+        ssh_service, config, template, session = self._prepare(db, user_id, request)
+        cache_key = await self._cache_key(ssh_service, config, template, request)
+        content = response_cache.get(cache_key) if cache_key else None
+        if content is not None:
+            logger.info(f"[ChatService] 命中推理结果缓存，模型: {request.model_path}")
+            result = {"role": "assistant", "content": content}
+        else:
+            result = await self._execute(ssh_service, config, template)
+            if cache_key:
+                response_cache.put(cache_key, request.model_path, result.get("content", ""))
+        self._remember(session, request, result.get("content", ""))
+        return ChatResponse(**result, session_id=request.session_id)
+    
+    def stream_chat_completion(self, db: Session, user_id: str, request: ChatRequest) -> AsyncIterator[Dict]:
+        """
+        流式对话推理，返回 OpenAI 风格 chat.completion.chunk 的异步迭代器
+        模型校验在调用时同步完成（失败抛出 ValueError），推理在迭代时进行：
+        worker 模式逐个转发生成的 token；cli/script 模式只能在生成结束后一次性返回全部内容
+        """
+        ssh_service, config, template, session = self._prepare(db, user_id, request)
+        return self._stream(ssh_service, config, template, request, session)
+    
+    async def _stream(
+        self,
+        ssh_service: AsyncSSHService,
+        config: Dict,
+        template: str,
+        request: ChatRequest,
+        session: Optional[ChatSession]
+    ) -> AsyncIterator[Dict]:
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = request.model_path
+        yield build_chat_chunk(completion_id, created, model, {"role": "assistant", "content": ""})
         
-        return ChatResponse(**result)
-
+        cache_key = await self._cache_key(ssh_service, config, template, request)
+        content = response_cache.get(cache_key) if cache_key else None
+        if content is not None:
+            logger.info(f"[ChatService] 命中推理结果缓存，模型: {model}")
+            self._remember(session, request, content)
+            yield build_chat_chunk(completion_id, created, model, {"content": content})
+            yield build_chat_chunk(completion_id, created, model, {}, finish_reason="stop")
+            return
+        
+        if self.chat_mode != "worker":
+            result = await self._execute(ssh_service, config, template)
+            if cache_key:
+                response_cache.put(cache_key, model, result.get("content", ""))
+            self._remember(session, request, result.get("content", ""))
+            yield build_chat_chunk(completion_id, created, model, {"content": result.get("content", "")})
+            yield build_chat_chunk(completion_id, created, model, {}, finish_reason="stop")
+            return
+        
+        logger.info(f"[ChatService] 使用常驻推理进程流式执行对话，节点: {ssh_service.node}")
+        worker = get_inference_worker(ssh_service.node)
+        async for message in worker.chat_stream(config=config, template=template, timeout=settings.chat_timeout):
+            if message.get("type") == "delta":
+                yield build_chat_chunk(completion_id, created, model, {"content": message.get("content", "")})
+            elif message.get("type") == "result":
+                if cache_key:
+                    response_cache.put(cache_key, model, message.get("content", ""))
+                self._remember(session, request, message.get("content", ""))
+                yield build_chat_chunk(
+                    completion_id, created, model, {},
+                    finish_reason=message.get("finish_reason") or "stop",
+                    usage=message.get("usage")
+                )
+    
+    def _compare_models(self, db: Session, user_id: str, request: ChatCompareRequest) -> List[str]:
+        """校验对比的模型列表（去重，全部属于当前用户），失败时抛出 ValueError"""
+        model_paths = list(dict.fromkeys(request.model_paths))
+        if not model_paths:
+            raise ValueError("至少需要一个模型")
+        if len(model_paths) > settings.chat_compare_max_models:
+            raise ValueError(f"一次最多对比 {settings.chat_compare_max_models} 个模型")
+        for model_path in model_paths:
+            if not self.file_service.get_model_by_path(db, model_path, user_id):
+                raise ValueError(f"模型不存在或无权访问: {model_path}")
+        return model_paths
+    
+    async def _compare_one(self, db: Session, user_id: str, model_path: str,
+                           request: ChatCompareRequest) -> ChatCompareResult:
+        """对比中的一个模型：单个模型失败只记录在该模型的结果中，不影响其他模型"""
+        start = time.monotonic()
+        chat_request = ChatRequest(
+            model_path=model_path,
+            messages=request.messages,
+            temperature=request.temperature,
+            max_tokens=request.max_tokens
+        )
+        try:
+            response = await self.chat_completion(db, user_id, chat_request)
+            content, error, usage = response.content, None, response.usage
+        except Exception as e:
+            logger.error(f"[ChatService] 对比推理失败，模型: {model_path}, 错误: {str(e)}")
+            content, error, usage = None, str(e), None
+        return ChatCompareResult(
+            model_path=model_path,
+            content=content,
+            error=error,
+            latency_ms=int((time.monotonic() - start) * 1000),
+            usage=usage
+        )
+    
+    async def compare_completion(self, db: Session, user_id: str, request: ChatCompareRequest) -> ChatCompareResponse:
+        """
+        多模型对比：同一组消息同时发送给所有模型，总耗时约为最慢的模型的耗时而不是各模型耗时之和
+        （不同节点上的模型并行生成；同一节点上的模型由该节点的推理进程依次或分批处理）
+        """
+        model_paths = self._compare_models(db, user_id, request)
+        logger.info(f"[ChatService] 多模型对比，模型数: {len(model_paths)}")
+        start = time.monotonic()
+        results = await asyncio.gather(*(self._compare_one(db, user_id, path, request) for path in model_paths))
+        return ChatCompareResponse(results=list(results), total_latency_ms=int((time.monotonic() - start) * 1000))
+    
+    def stream_compare_completion(self, db: Session, user_id: str, request: ChatCompareRequest) -> AsyncIterator[ChatCompareResult]:
+        """流式多模型对比：模型校验在调用时同步完成（失败抛出 ValueError），每个模型完成后立即产出其结果"""
+        model_paths = self._compare_models(db, user_id, request)
+        return self._stream_compare(db, user_id, model_paths, request)
+    
+    async def _stream_compare(self, db: Session, user_id: str, model_paths: List[str],
+                              request: ChatCompareRequest) -> AsyncIterator[ChatCompareResult]:
+        logger.info(f"[ChatService] 流式多模型对比，模型数: {len(model_paths)}")
+        tasks = [asyncio.create_task(self._compare_one(db, user_id, path, request)) for path in model_paths]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 客户端提前断开时取消尚未完成的推理
+            for task in tasks:
+                task.cancel()
+    
+    async def end_session(self, user_id: str, session_id: str) -> bool:
+        """结束会话，释放服务端历史和推理进程中的 KV cache；会话不存在时返回 False"""
+        session = chat_session_store.delete(user_id, session_id)
+        if session is None:
+            return False
+        if self.chat_mode == "worker":
+            worker = get_inference_worker(session.node)
+            if worker.running:
+                try:
+                    await worker.end_session(chat_session_store.worker_session_id(user_id, session_id))
+                except Exception as e:
+                    logger.warning(f"[ChatService] 释放推理进程会话失败: {str(e)}")
+        return True
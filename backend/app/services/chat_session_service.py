@@ -0,0 +1,71 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class ChatSession:
+    """一个服务端对话会话：保存历史消息，以及会话所在的模型和节点"""
+
+    def __init__(self, model_path: str, node: Optional[str]):
+        self.model_path = model_path
+        self.node = node
+        self.messages: List[Dict] = []
+        self.last_used = time.monotonic()
+
+
+class ChatSessionStore:
+    """
+    服务端对话会话（ChatRequest.session_id）：客户端每轮只发送新消息，历史由服务端保存并拼接。
+    worker 模式下会话固定在模型所在节点的常驻推理进程上，推理进程为会话保留对话前缀的 KV cache，
+    每轮只需要对新增的 token 做 prefill；超过模型上下文长度时由推理进程从最早的轮次开始裁剪。
+    会话保存在内存中，空闲超过 chat_session_ttl 或超出 chat_session_max_count 时淘汰。
+    """
+
+    def __init__(self):
+        self._sessions: "OrderedDict[Tuple[str, str], ChatSession]" = OrderedDict()
+
+    @staticmethod
+    def worker_session_id(user_id: str, session_id: str) -> str:
+        """推理进程中的会话标识（加上用户前缀，不同用户的会话互不干扰）"""
+        return f"{user_id}:{session_id}"
+
+    def _evict(self):
+        now = time.monotonic()
+        ttl = settings.chat_session_ttl
+        for key in [k for k, s in self._sessions.items() if ttl > 0 and now - s.last_used > ttl]:
+            self._sessions.pop(key)
+            logger.info(f"[ChatService] 会话过期: {key[1]}, 用户: {key[0]}")
+        while len(self._sessions) > settings.chat_session_max_count:
+            key, _ = self._sessions.popitem(last=False)
+            logger.info(f"[ChatService] 会话数量超过上限，淘汰: {key[1]}, 用户: {key[0]}")
+
+    def get(self, user_id: str, session_id: str, model_path: str, node: Optional[str]) -> ChatSession:
+        """获取会话，不存在时创建；切换模型时清空历史"""
+        self._evict()
+        key = (user_id, session_id)
+        session = self._sessions.get(key)
+        if session is None or session.model_path != model_path:
+            session = ChatSession(model_path, node)
+            self._sessions[key] = session
+        self._sessions.move_to_end(key)
+        session.last_used = time.monotonic()
+        return session
+
+    def append(self, session: ChatSession, messages: List[Dict]):
+        """追加本轮的消息，只保留最近 chat_session_max_messages 条（system 消息始终保留）"""
+        session.messages.extend(messages)
+        limit = settings.chat_session_max_messages
+        if limit > 0 and len(session.messages) > limit:
+            system = [m for m in session.messages if m["role"] == "system"]
+            others = [m for m in session.messages if m["role"] != "system"]
+            session.messages = system + others[-max(limit - len(system), 1):]
+        session.last_used = time.monotonic()
+
+    def delete(self, user_id: str, session_id: str) -> Optional[ChatSession]:
+        return self._sessions.pop((user_id, session_id), None)
+
+
+chat_session_store = ChatSessionStore()
@@ -1,17 +1,108 @@
+import json
 import logging
+import os
+import shlex
+import tempfile
+import uuid
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from app.db_models import DatasetFileDB, ModelFileDB
-from app.services.ssh_service import SSHService
+from typing import AsyncIterator, Dict, List, Optional
+from app.db_models import DatasetFileDB, DatasetReplicaDB, ModelFileDB, TaskDB, BatchInferenceJobDB
+from app.services.async_ssh_service import AsyncSSHService
+from app.services.node_registry import get_node, primary_node_name
 from app.config import settings
+from app.utils.dataset_validator import DatasetValidator, validate_local_file, validate_stream
+from app.utils.file_utils import file_sha256
 
 logger = logging.getLogger(__name__)
 
+# 仍会读取数据集的训练任务和批量推理任务状态
+ACTIVE_TASK_STATUSES = ["queued", "pending", "running"]
+ACTIVE_BATCH_JOB_STATUSES = ["pending", "running"]
+
+class DatasetInUseError(ValueError):
+    """数据集正被排队或运行中的任务使用，不能删除"""
+
+
+def load_dataset_stats(db_file: DatasetFileDB) -> Optional[Dict]:
+    """数据集记录中保存的校验统计信息"""
+    return json.loads(db_file.stats) if db_file.stats else None
+
 class FileService:
-    def __init__(self):
-        self.ssh_service = SSHService()
+    """
+    数据集文件按内容寻址存储：文件保存为 {remote_user_data_dir}/{user_id}/datasets/blobs/<SHA-256><扩展名>，
+    DatasetFileDB 记录只是指向数据块的文件名，同一用户内容相同的文件共享一个数据块
+    （扩展名保留在数据块路径中，LlamaFactory 按扩展名识别数据格式）；
+    删除记录时只有没有其他记录引用该数据块才删除远程文件。
+    JSON / JSONL 数据集在上传和生成时流式校验（DatasetValidator），统计信息保存在记录中
+    """
+    
+    @staticmethod
+    def _datasets_dir(user_id: str) -> str:
+        return f"{settings.remote_user_data_dir}/{user_id}/datasets"
+    
+    def dataset_blob_path(self, user_id: str, checksum: str, filename: str) -> str:
+        """内容寻址的数据块路径"""
+        ext = os.path.splitext(filename)[1].lower()
+        return f"{self._datasets_dir(user_id)}/blobs/{checksum}{ext}"
     
-    def upload_dataset_file(
+    def incoming_path(self, user_id: str, filename: str) -> str:
+        """上传过程中的临时文件路径（内容的 SHA-256 在上传完成后才知道）"""
+        ext = os.path.splitext(filename)[1].lower()
+        return f"{self._datasets_dir(user_id)}/incoming/{uuid.uuid4().hex}{ext}"
+    
+    def find_dataset_blob(self, db: Session, user_id: str, checksum: str, filename: str) -> Optional[DatasetFileDB]:
+        """查找用户已有的内容相同（SHA-256 和扩展名都相同）的数据集记录"""
+        ext = os.path.splitext(filename)[1].lower()
+        candidates = db.query(DatasetFileDB).filter(
+            DatasetFileDB.user_id == user_id,
+            DatasetFileDB.checksum == checksum
+        ).all()
+        return next((f for f in candidates if os.path.splitext(f.file_path)[1].lower() == ext), None)
+    
+    def add_dataset_by_checksum(self, db: Session, user_id: str, filename: str, checksum: str) -> Optional[DatasetFileDB]:
+        """秒传：内容相同的数据块已存在时直接登记新的数据集记录，无需传输；不存在时返回 None"""
+        existing = self.find_dataset_blob(db, user_id, checksum.lower(), filename)
+        if existing is None:
+            return None
+        logger.info(f"[文件服务] 数据块已存在，直接登记: {filename} -> {existing.file_path}")
+        return self.save_dataset_record(
+            db, user_id, filename, existing.file_path, existing.size, existing.checksum, existing.node, load_dataset_stats(existing)
+        )
+    
+    async def finalize_dataset_upload(
+        self,
+        db: Session,
+        user_id: str,
+        filename: str,
+        incoming_path: str,
+        file_size: int,
+        checksum: str,
+        node: str,
+        stats: Optional[Dict] = None
+    ) -> DatasetFileDB:
+        """上传完成后把临时文件移动为数据块并登记；内容相同的数据块已存在时丢弃临时文件，引用已有数据块"""
+        ssh_service = AsyncSSHService(node)
+        existing = self.find_dataset_blob(db, user_id, checksum, filename)
+        if existing is not None:
+            await ssh_service.execute_command(f"rm -f {shlex.quote(incoming_path)}")
+            logger.info(f"[文件服务] 内容相同的数据块已存在，丢弃重复上传: {filename} -> {existing.file_path}")
+            return self.save_dataset_record(
+                db, user_id, filename, existing.file_path, file_size, checksum, existing.node,
+                stats or load_dataset_stats(existing)
+            )
+        
+        blob_path = self.dataset_blob_path(user_id, checksum, filename)
+        blob_dir = os.path.dirname(blob_path)
+        _, stderr, return_code = await ssh_service.execute_command(
+            f"mkdir -p {shlex.quote(blob_dir)} && "
+            f"if [ -e {shlex.quote(blob_path)} ]; then rm -f {shlex.quote(incoming_path)}; "
+            f"else mv {shlex.quote(incoming_path)} {shlex.quote(blob_path)}; fi"
+        )
+        if return_code != 0:
+            raise Exception(f"保存数据块失败: {stderr}")
+        return self.save_dataset_record(db, user_id, filename, blob_path, file_size, checksum, node, stats)
+    
+    async def upload_dataset_file(
         self, 
         db: Session, 
         user_id: str, 
@@ -19,28 +110,96 @@ class FileService:
         local_file_path: str,
         file_size: int
     ) -> DatasetFileDB:
-        """上传数据集文件到远程服务器"""
+        """
+        上传数据集文件到远程服务器（主节点，训练时按需传输到任务所在节点）；内容相同的数据块已存在时不再传输
+        上传前校验数据集，不通过时抛出 DatasetValidationError
+        """
         logger.info(f"[文件服务] 上传数据集文件，用户: {user_id}, 文件名: {filename}, 大小: {file_size} 字节")
+        stats = validate_local_file(filename, local_file_path)
+        checksum = file_sha256(local_file_path)
+        existing = self.add_dataset_by_checksum(db, user_id, filename, checksum)
+        if existing is not None:
+            return existing
         
-        # 生成远程文件路径
-        remote_dir = f"{settings.remote_user_data_dir}/{user_id}/datasets"
-        remote_file_path = f"{remote_dir}/{filename}"
-        logger.info(f"[文件服务] 远程文件路径: {remote_file_path}")
+        incoming_path = self.incoming_path(user_id, filename)
+        node = primary_node_name()
+        logger.info(f"[文件服务] 远程临时路径: {incoming_path}, 节点: {node}")
         
         # 上传文件
         try:
-            self.ssh_service.upload_file(local_file_path, remote_file_path)
+            await AsyncSSHService(node).upload_file(local_file_path, incoming_path)
             logger.info(f"[文件服务] 文件上传成功")
         except Exception as e:
             logger.error(f"[文件服务] 文件上传失败: {str(e)}", exc_info=True)
             raise
         
-        # 保存文件信息到数据库
+        # 移动为数据块并保存文件信息到数据库
+        return await self.finalize_dataset_upload(db, user_id, filename, incoming_path, file_size, checksum, node, stats)
+    
+    async def upload_dataset_stream(
+        self,
+        db: Session,
+        user_id: str,
+        filename: str,
+        chunks: AsyncIterator[bytes]
+    ) -> DatasetFileDB:
+        """
+        流式上传数据集文件到远程服务器（主节点）：请求数据边接收边校验并写入远程文件，
+        不在内存或本地磁盘缓存整个文件；大小超过 max_upload_size 时中止（UploadTooLargeError），
+        数据集格式错误时中止、无效记录过多时删除已上传的文件（DatasetValidationError）
+        """
+        incoming_path = self.incoming_path(user_id, filename)
+        node = primary_node_name()
+        logger.info(f"[文件服务] 流式上传数据集文件，用户: {user_id}, 文件名: {filename}, 远程临时路径: {incoming_path}, 节点: {node}")
+        ssh_service = AsyncSSHService(node)
+        validator = DatasetValidator(filename) if DatasetValidator.applies_to(filename) else None
+        if validator:
+            chunks = validate_stream(validator, chunks)
+        file_size, checksum = await ssh_service.upload_stream(chunks, incoming_path, settings.max_upload_size)
+        logger.info(f"[文件服务] 文件上传成功，大小: {file_size} 字节, SHA-256: {checksum}")
+        stats = None
+        if validator:
+            try:
+                stats = validator.finish()
+                validator.check()
+            except ValueError:
+                await ssh_service.execute_command(f"rm -f {shlex.quote(incoming_path)}")
+                raise
+        return await self.finalize_dataset_upload(db, user_id, filename, incoming_path, file_size, checksum, node, stats)
+    
+    async def validate_remote_dataset(self, node: str, filename: str, remote_path: str) -> Optional[Dict]:
+        """流式读取远程数据集文件并校验（分块上传合并后使用），返回统计信息；不通过时抛出 DatasetValidationError"""
+        if not DatasetValidator.applies_to(filename):
+            return None
+        validator = DatasetValidator(filename)
+        async for chunk in AsyncSSHService(node).read_stream(remote_path):
+            validator.feed(chunk)
+        stats = validator.finish()
+        validator.check()
+        return stats
+    
+    def save_dataset_record(
+        self,
+        db: Session,
+        user_id: str,
+        filename: str,
+        file_path: str,
+        file_size: int,
+        checksum: str,
+        node: str,
+        stats: Optional[Dict] = None
+    ) -> DatasetFileDB:
+        """保存数据集文件记录（文件已写入远程服务器），stats 为校验得到的统计信息"""
         db_file = DatasetFileDB(
             user_id=user_id,
             filename=filename,
-            file_path=remote_file_path,
-            size=file_size
+            file_path=file_path,
+            size=file_size,
+            checksum=checksum,
+            record_count=stats["records"] if stats else None,
+            invalid_count=stats["invalid"] if stats else None,
+            stats=json.dumps(stats, ensure_ascii=False) if stats else None,
+            node=node
         )
         db.add(db_file)
         db.commit()
@@ -59,22 +218,108 @@ class FileService:
             DatasetFileDB.user_id == user_id
         ).first()
     
-    def delete_dataset_file(self, db: Session, file_id: str, user_id: str) -> bool:
-        """删除数据集文件"""
+    async def delete_dataset_file(self, db: Session, file_id: str, user_id: str) -> bool:
+        """
+        删除数据集文件；数据块没有其他记录引用时同时删除远程文件及其在其他节点上的副本
+        数据块正被排队或运行中的训练任务、批量推理任务使用时抛出 DatasetInUseError
+        """
         db_file = self.get_dataset_by_id(db, file_id, user_id)
         if not db_file:
             return False
+        file_path = db_file.file_path
         
-        # 删除远程文件（可选，最小实现可以只删除数据库记录）
-        try:
-            self.ssh_service.execute_command(f"rm -f {db_file.file_path}")
-        except:
-            pass  # 忽略删除错误
+        # 批量推理任务的状态只在查询时更新，先刷新使用该数据块的运行中任务，已结束的任务不再阻止删除
+        # （批量推理服务依赖本模块，在函数内导入避免循环导入）
+        from app.services.batch_inference_service import BatchInferenceService
+        running_jobs = db.query(BatchInferenceJobDB).filter(
+            BatchInferenceJobDB.user_id == user_id,
+            BatchInferenceJobDB.dataset_path == file_path,
+            BatchInferenceJobDB.status == "running"
+        ).all()
+        for job in running_jobs:
+            await BatchInferenceService().refresh(db, job)
         
+        # 删除记录和检查引用在同一个事务中完成（先写入删除，检查期间其他写入等待提交）
         db.delete(db_file)
+        db.flush()
+        
+        # 数据块仍被其他记录引用时保留远程文件
+        references = db.query(DatasetFileDB).filter(DatasetFileDB.file_path == file_path).count()
+        if references:
+            db.commit()
+            logger.info(f"[文件服务] 数据块仍被 {references} 个数据集引用，保留: {file_path}")
+            return True
+        
+        tasks = db.query(TaskDB).filter(
+            TaskDB.user_id == user_id,
+            TaskDB.dataset_path == file_path,
+            TaskDB.status.in_(ACTIVE_TASK_STATUSES)
+        ).count()
+        batch_jobs = db.query(BatchInferenceJobDB).filter(
+            BatchInferenceJobDB.user_id == user_id,
+            BatchInferenceJobDB.dataset_path == file_path,
+            BatchInferenceJobDB.status.in_(ACTIVE_BATCH_JOB_STATUSES)
+        ).count()
+        if tasks or batch_jobs:
+            db.rollback()
+            raise DatasetInUseError(
+                f"数据集正在被 {tasks} 个训练任务和 {batch_jobs} 个批量推理任务使用，结束后才能删除"
+            )
+        
+        replicas = db.query(DatasetReplicaDB).filter(
+            DatasetReplicaDB.user_id == user_id,
+            DatasetReplicaDB.file_path == file_path
+        ).all()
+        nodes = {get_node(db_file.node).name} | {replica.node for replica in replicas}
+        for replica in replicas:
+            db.delete(replica)
         db.commit()
+        
+        # 删除各节点上的远程文件
+        for node in nodes:
+            try:
+                await AsyncSSHService(node).execute_command(f"rm -f {shlex.quote(file_path)}")
+            except Exception as e:
+                logger.warning(f"[文件服务] 删除远程文件失败，节点: {node}, 路径: {file_path}, 错误: {str(e)}")
         return True
     
+    async def stage_dataset(self, db: Session, user_id: str, dataset_path: str, node: str):
+        """
+        确保数据集在指定节点上可用：数据集存放在其他节点且未共享存储时，
+        经由本服务传输到目标节点的相同路径，并登记副本（删除数据集时一并删除）；
+        数据集按内容寻址存放，目标节点已有副本时直接复用，不再重复传输
+        """
+        if settings.worker_shared_storage:
+            return
+        db_file = db.query(DatasetFileDB).filter(
+            DatasetFileDB.file_path == dataset_path,
+            DatasetFileDB.user_id == user_id
+        ).first()
+        source_node = get_node(db_file.node if db_file else None).name
+        target_node = get_node(node).name
+        if source_node == target_node:
+            return
+        replica = db.query(DatasetReplicaDB).filter(
+            DatasetReplicaDB.user_id == user_id,
+            DatasetReplicaDB.file_path == dataset_path,
+            DatasetReplicaDB.node == target_node
+        ).first()
+        if replica is not None:
+            logger.info(f"[文件服务] 节点 {target_node} 已有数据集副本，跳过传输: {dataset_path}")
+            return
+        
+        logger.info(f"[文件服务] 传输数据集: {dataset_path}, {source_node} -> {target_node}")
+        fd, local_path = tempfile.mkstemp(suffix=os.path.splitext(dataset_path)[1])
+        os.close(fd)
+        try:
+            await AsyncSSHService(source_node).download_file(dataset_path, local_path)
+            await AsyncSSHService(target_node).upload_file(local_path, dataset_path)
+        finally:
+            os.unlink(local_path)
+        
+        db.add(DatasetReplicaDB(user_id=user_id, file_path=dataset_path, node=target_node))
+        db.commit()
+    
     def add_model_file(
         self,
         db: Session,
@@ -0,0 +1,234 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import AsyncIterator, Dict, Optional
+from app.config import settings
+from app.services.async_ssh_service import AsyncSSHService
+from app.services.node_registry import get_node
+from app.services.ssh_service import build_remote_python_command, get_remote_script_path
+
+logger = logging.getLogger(__name__)
+
+# 终止一次请求的响应类型
+TERMINAL_TYPES = ("result", "error")
+
+class InferenceWorkerError(Exception):
+    """常驻推理进程返回的错误或进程异常退出"""
+
+
+class InferenceWorkerClient:
+    """
+    一个节点上的常驻推理进程（inference_worker.py）客户端
+    进程通过一条独立的 SSH 连接启动（不占用连接池的 channel 名额），请求和响应按 JSON lines 收发并按 id 匹配，
+    多个协程可以同时发送请求；进程退出后下一次请求自动重新启动
+    """
+
+    def __init__(self, node: Optional[str] = None):
+        self.ssh_service = AsyncSSHService(node)
+        self.node = self.ssh_service.node
+        self._conn = None
+        self._process = None
+        self._reader: Optional[asyncio.Task] = None
+        self._stderr_reader: Optional[asyncio.Task] = None
+        self._pending: Dict[str, asyncio.Queue] = {}
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._reader is not None and not self._reader.done()
+
+    def build_command(self) -> str:
+        script = get_remote_script_path(settings.inference_worker_script_path)
+        return build_remote_python_command(
+            f"{script} "
+            f"--max-models {settings.inference_worker_max_models} "
+            f"--memory-budget-mb {settings.inference_worker_memory_budget_mb} "
+            f"--idle-timeout {settings.inference_worker_idle_timeout} "
+            f"--engine {settings.inference_worker_engine} "
+            f"--max-adapters {settings.inference_worker_max_adapters} "
+            f"--max-batch-size {settings.inference_worker_max_batch_size} "
+            f"--batch-wait-ms {settings.inference_worker_batch_wait_ms} "
+            f"--max-sessions {settings.inference_worker_max_sessions} "
+            f"--max-context-tokens {settings.inference_worker_max_context_tokens}"
+        )
+
+    async def _ensure_started(self):
+        async with self._start_lock:
+            if self.running:
+                return
+            await self._cleanup()
+            command = self.build_command()
+            logger.info(f"[推理进程] 启动常驻推理进程，节点: {self.node}, 命令: {command}")
+            conn = await self.ssh_service.pool.connect_dedicated()
+            try:
+                process = await conn.create_process(command, encoding='utf-8', errors='ignore')
+                line = await asyncio.wait_for(process.stdout.readline(), timeout=settings.inference_worker_start_timeout)
+                message = json.loads(line) if line.strip() else {}
+                if message.get("type") != "ready":
+                    stderr_text = ""
+                    if not line:
+                        stderr_text = await asyncio.wait_for(process.stderr.read(), timeout=5)
+                    raise InferenceWorkerError(f"推理进程启动失败: {line.strip() or stderr_text[-1000:]}")
+            except BaseException:
+                conn.close()
+                raise
+            self._conn = conn
+            self._process = process
+            self._reader = asyncio.create_task(self._read_stdout())
+            self._stderr_reader = asyncio.create_task(self._read_stderr())
+            logger.info(f"[推理进程] 常驻推理进程已就绪，节点: {self.node}")
+
+    async def _read_stdout(self):
+        """按 id 把响应分发给等待中的请求"""
+        error = "推理进程已退出"
+        try:
+            async for line in self._process.stdout:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"[推理进程] 无法解析的输出: {line[:200]}")
+                    continue
+                queue = self._pending.get(message.get("id"))
+                if queue is not None:
+                    queue.put_nowait(message)
+                elif message.get("type") == "error":
+                    logger.warning(f"[推理进程] 错误: {message.get('error')}")
+        except Exception as e:
+            error = f"推理进程连接中断: {str(e)}"
+            logger.error(f"[推理进程] 读取输出失败，节点: {self.node}, 错误: {str(e)}")
+        logger.warning(f"[推理进程] 常驻推理进程已退出，节点: {self.node}")
+        for queue in self._pending.values():
+            queue.put_nowait({"type": "error", "error": error})
+
+    async def _read_stderr(self):
+        """持续读取推理进程日志，避免 stderr 缓冲区写满阻塞推理进程"""
+        try:
+            async for line in self._process.stderr:
+                if line.strip():
+                    logger.info(f"[推理进程] ({self.node}) {line.rstrip()[:500]}")
+        except Exception:
+            pass
+
+    async def _cleanup(self):
+        for task in (self._reader, self._stderr_reader):
+            if task is not None and not task.done():
+                task.cancel()
+        if self._process is not None:
+            try:
+                self._process.stdin.write_eof()
+            except Exception:
+                pass
+            self._process.close()
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+        self._process = None
+        self._reader = None
+        self._stderr_reader = None
+
+    def _send(self, payload: Dict):
+        if not self.running:
+            raise InferenceWorkerError("推理进程已退出")
+        try:
+            self._process.stdin.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        except Exception as e:
+            raise InferenceWorkerError(f"发送请求失败: {str(e)}") from e
+
+    async def stream(self, payload: Dict, timeout: int) -> AsyncIterator[Dict]:
+        """
+        发送一个请求并逐条产出响应（delta ...，最后一条为 result），错误时抛出 InferenceWorkerError
+        timeout 为两条响应之间的最长等待时间；调用方提前结束迭代时通知推理进程取消该请求
+        """
+        await self._ensure_started()
+        request_id = uuid.uuid4().hex
+        queue: asyncio.Queue = asyncio.Queue()
+        self._pending[request_id] = queue
+        finished = False
+        try:
+            # 启动完成到发送之间进程可能已退出或正在被重启，在锁内重新检查
+            async with self._start_lock:
+                self._send({"id": request_id, **payload})
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=timeout)
+                except asyncio.TimeoutError as e:
+                    raise TimeoutError(f"推理超时（{timeout}秒）") from e
+                if message.get("type") in TERMINAL_TYPES:
+                    finished = True
+                if message.get("type") == "error":
+                    raise InferenceWorkerError(message.get("error") or "推理失败")
+                yield message
+                if finished:
+                    return
+        finally:
+            self._pending.pop(request_id, None)
+            if not finished and self.running:
+                logger.info(f"[推理进程] 取消请求: {request_id}")
+                try:
+                    self._send({"op": "cancel", "target": request_id})
+                except InferenceWorkerError:
+                    pass
+
+    async def request(self, payload: Dict, timeout: int) -> Dict:
+        """发送一个请求并等待结果，错误时抛出 InferenceWorkerError"""
+        message: Dict = {}
+        async for message in self.stream(payload, timeout):
+            pass
+        return message
+
+    async def chat(self, config: Dict, template: str, timeout: int) -> Dict:
+        """对话推理，返回 {"role": "assistant", "content": "...", "usage": {...}}"""
+        result = await self.request({"op": "chat", "template": template, **config}, timeout=timeout)
+        logger.info(
+            f"[推理进程] 推理完成，节点: {self.node}, 生成耗时: {result.get('generation_seconds')}秒, "
+            f"用量: {result.get('usage')}"
+        )
+        return {"role": "assistant", "content": result.get("content", ""), "usage": result.get("usage")}
+
+    async def chat_stream(self, config: Dict, template: str, timeout: int) -> AsyncIterator[Dict]:
+        """流式对话推理，产出推理进程的 delta / result 消息"""
+        async for message in self.stream({"op": "chat", "template": template, "stream": True, **config}, timeout=timeout):
+            if message.get("type") == "result":
+                logger.info(
+                    f"[推理进程] 流式推理完成，节点: {self.node}, 生成耗时: {message.get('generation_seconds')}秒, "
+                    f"用量: {message.get('usage')}"
+                )
+            yield message
+
+    async def end_session(self, session_id: str):
+        """释放会话在推理进程中保留的 KV cache"""
+        await self.request({"op": "end_session", "session_id": session_id}, timeout=30)
+
+    async def stats(self) -> Dict:
+        """常驻模型及缓存命中情况（在推理线程中执行，需要等待当前推理完成）"""
+        result = await self.request({"op": "stats"}, timeout=settings.chat_timeout)
+        result.pop("id", None)
+        result.pop("type", None)
+        return result
+
+    async def close(self):
+        async with self._start_lock:
+            await self._cleanup()
+
+
+_workers: Dict[str, InferenceWorkerClient] = {}
+
+def get_inference_worker(node: Optional[str] = None) -> InferenceWorkerClient:
+    """获取节点的常驻推理进程客户端（每个节点一个）"""
+    name = get_node(node).name
+    client = _workers.get(name)
+    if client is None:
+        client = InferenceWorkerClient(name)
+        _workers[name] = client
+    return client
+
+async def close_all_inference_workers():
+    """关闭所有常驻推理进程（应用退出时调用）"""
+    workers = list(_workers.values())
+    _workers.clear()
+    for worker in workers:
+        await worker.close()
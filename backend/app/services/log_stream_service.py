@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Set, Tuple
+from app.config import settings
+from app.services.async_ssh_service import AsyncSSHService
+
+logger = logging.getLogger(__name__)
+
+class LogSubscription:
+    """一个客户端对某个任务日志流的订阅"""
+
+    def __init__(self, max_pending: int):
+        # 队列元素: (起始偏移, 数据)；None 表示日志流已结束
+        self.queue: "asyncio.Queue[Optional[Tuple[int, bytes]]]" = asyncio.Queue(maxsize=max_pending)
+        # 开始接收实时数据时的文件偏移，之前的内容需要由订阅方自行补读
+        self.start_offset: Optional[int] = None
+        self.ready = asyncio.Event()
+        # 消费过慢导致队列溢出时被移出订阅，客户端应以最后的偏移重新连接
+        self.overflowed = False
+        self.error: Optional[str] = None
+
+    async def wait_ready(self) -> int:
+        """等待日志流建立，返回开始接收实时数据时的文件偏移"""
+        await self.ready.wait()
+        return self.start_offset or 0
+
+    async def get(self) -> Optional[Tuple[int, bytes]]:
+        return await self.queue.get()
+
+    def end(self, overflowed: bool = False):
+        """放入结束标记；队列已满时丢弃一个数据块腾出位置，并标记为溢出"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            overflowed = True
+        self.overflowed = self.overflowed or overflowed
+        self.queue.put_nowait(None)
+
+
+class _TaskLogStream:
+    """
+    一个任务的共享日志流：远程只保持一个 tail -F channel，新内容分发给所有订阅者
+    """
+
+    def __init__(self, hub: "LogStreamHub", task_id: str, log_file: str, node: Optional[str] = None):
+        self.hub = hub
+        self.task_id = task_id
+        self.log_file = log_file
+        self.subscribers: Set[LogSubscription] = set()
+        self.offset: Optional[int] = None  # 已读取到的文件偏移，建立前为 None
+        self.ssh_service = AsyncSSHService(node)
+        self._task = asyncio.create_task(self._run())
+
+    def add_subscriber(self) -> LogSubscription:
+        sub = LogSubscription(settings.log_stream_max_pending_chunks)
+        if self.offset is not None:
+            # 流已建立：从当前偏移开始接收（与读取 offset 之间没有 await，不会漏掉数据）
+            sub.start_offset = self.offset
+            sub.ready.set()
+        self.subscribers.add(sub)
+        return sub
+
+    def remove_subscriber(self, sub: LogSubscription):
+        self.subscribers.discard(sub)
+        if not self.subscribers:
+            self.close()
+
+    def close(self):
+        """最后一个订阅者离开时关闭远程 channel"""
+        if not self._task.done():
+            self._task.cancel()
+        self.hub._remove(self)
+
+    def _publish(self, item: Optional[Tuple[int, bytes]]):
+        for sub in list(self.subscribers):
+            try:
+                sub.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                logger.warning(f"[日志流] 订阅者消费过慢，移出订阅，任务ID: {self.task_id}")
+                self.subscribers.discard(sub)
+                sub.end(overflowed=True)
+        if not self.subscribers:
+            self.close()
+
+    async def _run(self):
+        error = None
+        try:
+            async with self.ssh_service.follow_file(self.log_file) as (start_offset, reader):
+                logger.info(f"[日志流] 已建立，任务ID: {self.task_id}, 起始偏移: {start_offset}")
+                self.offset = start_offset
+                for sub in self.subscribers:
+                    if sub.start_offset is None:
+                        sub.start_offset = start_offset
+                    sub.ready.set()
+                while True:
+                    data = await reader.read(65536)
+                    if not data:
+                        break
+                    offset = self.offset
+                    self.offset += len(data)
+                    self._publish((offset, data))
+        except asyncio.CancelledError:
+            logger.info(f"[日志流] 已关闭，任务ID: {self.task_id}")
+            raise
+        except Exception as e:
+            logger.error(f"[日志流] 跟踪日志失败，任务ID: {self.task_id}, 错误: {str(e)}", exc_info=True)
+            error = str(e)
+        finally:
+            self.hub._remove(self)
+            for sub in list(self.subscribers):
+                sub.error = error
+                sub.ready.set()
+                sub.end()
+
+
+class LogStreamHub:
+    """
+    进程级日志流注册表：同一任务的所有订阅者共享一个远程 tail -F channel，
+    观看 N 个运行中任务只需要 N 个 channel
+    """
+
+    def __init__(self):
+        self._streams: Dict[str, _TaskLogStream] = {}
+
+    def _remove(self, stream: _TaskLogStream):
+        if self._streams.get(stream.task_id) is stream:
+            del self._streams[stream.task_id]
+
+    @asynccontextmanager
+    async def subscribe(self, task_id: str, log_file: str, node: Optional[str] = None):
+        """订阅任务日志（node 为日志所在节点），退出上下文时取消订阅"""
+        stream = self._streams.get(task_id)
+        if stream is None:
+            stream = _TaskLogStream(self, task_id, log_file, node)
+            self._streams[task_id] = stream
+        sub = stream.add_subscriber()
+        logger.info(f"[日志流] 新增订阅，任务ID: {task_id}, 当前订阅数: {len(stream.subscribers)}")
+        try:
+            yield sub
+        finally:
+            stream.remove_subscriber(sub)
+            logger.info(f"[日志流] 取消订阅，任务ID: {task_id}, 剩余订阅数: {len(stream.subscribers)}")
+
+    def close_task(self, task_id: str):
+        """关闭任务的日志流（任务结束后调用），所有订阅者会收到结束标记"""
+        stream = self._streams.get(task_id)
+        if stream is not None:
+            for sub in list(stream.subscribers):
+                sub.ready.set()
+                sub.end()
+            stream.subscribers.clear()
+            stream.close()
+
+    async def close_all(self):
+        """关闭所有日志流（应用退出时调用）"""
+        for task_id in list(self._streams):
+            self.close_task(task_id)
+
+
+log_stream_hub = LogStreamHub()
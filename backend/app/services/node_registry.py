@@ -0,0 +1,50 @@
+import logging
+from typing import List, Optional
+from app.config import settings, WorkerNode
+
+logger = logging.getLogger(__name__)
+
+# 未配置 worker_nodes 时，使用 ssh_host 作为唯一节点
+DEFAULT_NODE_NAME = "default"
+
+def _resolve(node: WorkerNode) -> WorkerNode:
+    """补全节点上未填写的配置（使用全局 SSH 账号和调度容量）"""
+    return node.model_copy(update={
+        "username": node.username or settings.ssh_username,
+        "password": node.password or settings.ssh_password,
+        "key_path": node.key_path or settings.ssh_key_path,
+        "gpu_slots": node.gpu_slots if node.gpu_slots is not None else settings.scheduler_gpu_slots,
+        "gpu_memory_mb": node.gpu_memory_mb if node.gpu_memory_mb is not None else settings.scheduler_gpu_memory_mb,
+    })
+
+def get_nodes() -> List[WorkerNode]:
+    """所有节点（按配置顺序，第一个为主节点）"""
+    if settings.worker_nodes:
+        return [_resolve(node) for node in settings.worker_nodes]
+    return [_resolve(WorkerNode(
+        name=DEFAULT_NODE_NAME,
+        host=settings.ssh_host,
+        port=settings.ssh_port
+    ))]
+
+def get_enabled_nodes() -> List[WorkerNode]:
+    """可以接收新任务的节点"""
+    return [node for node in get_nodes() if node.enabled]
+
+def get_node(name: Optional[str] = None) -> WorkerNode:
+    """
+    按名称查找节点；名称为空（旧数据）时返回主节点
+    节点已从配置中移除时同样回退到主节点，并记录警告
+    """
+    nodes = get_nodes()
+    if name:
+        for node in nodes:
+            if node.name == name:
+                return node
+        logger.warning(f"[节点] 未找到节点 {name}，使用主节点 {nodes[0].name}")
+    return nodes[0]
+
+def primary_node_name() -> str:
+    """新数据集的存放节点：第一个启用的节点"""
+    nodes = get_enabled_nodes() or get_nodes()
+    return nodes[0].name
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import shlex
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from app.config import settings
+from app.services.async_ssh_service import AsyncSSHService
+
+logger = logging.getLogger(__name__)
+
+def is_deterministic(temperature: Optional[float]) -> bool:
+    """只有贪心解码（temperature<=0）的结果可以缓存"""
+    return temperature is not None and temperature <= 0
+
+def normalize_messages(messages) -> list:
+    """规范化消息：角色统一小写，内容统一换行符并去掉首尾空白"""
+    return [
+        {
+            "role": (m.get("role") or "").strip().lower(),
+            "content": (m.get("content") or "").replace("\r\n", "\n").strip()
+        }
+        for m in messages
+    ]
+
+class ResponseCache:
+    """
+    对话推理结果缓存（chat_cache_enabled）：评测和回归脚本以 temperature=0 反复发送相同的请求时，
+    直接返回缓存的回复，不再加载模型和生成。
+    缓存键包含模型路径、基础模型、模板、规范化后的消息和生成参数，以及模型文件的版本
+    （远程 adapter 文件的大小和修改时间，按 chat_cache_artifact_check_interval 缓存）；
+    模型文件变化时该模型的所有缓存失效。按 TTL 过期，超过 chat_cache_max_entries 时淘汰最久未使用的条目。
+    """
+
+    def __init__(self):
+        # key -> (过期时间, 模型路径, 回复内容)
+        self._entries: "OrderedDict[str, Tuple[float, str, str]]" = OrderedDict()
+        # (节点, 模型路径) -> (检查时间, 版本)
+        self._versions: Dict[Tuple[str, str], Tuple[float, str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.chat_cache_enabled
+
+    async def artifact_version(self, ssh_service: AsyncSSHService, model_path: str) -> str:
+        """模型文件版本：adapter 文件的大小和修改时间；版本变化时清除该模型的缓存"""
+        key = (ssh_service.node, model_path)
+        checked = self._versions.get(key)
+        now = time.monotonic()
+        if checked is not None and now - checked[0] < settings.chat_cache_artifact_check_interval:
+            return checked[1]
+
+        command = f"cd {shlex.quote(model_path)} && stat -c '%n %s %Y' adapter_config.json adapter_model.* 2>/dev/null"
+        try:
+            stdout, _, _ = await ssh_service.execute_command(command, timeout=30)
+        except Exception as e:
+            logger.warning(f"[ChatService] 获取模型文件版本失败: {model_path}, 错误: {str(e)}")
+            stdout = ""
+        version = hashlib.sha1(stdout.strip().encode("utf-8")).hexdigest()[:16]
+        if checked is not None and checked[1] != version:
+            self.invalidate_model(model_path)
+        self._versions[key] = (now, version)
+        return version
+
+    @staticmethod
+    def build_key(config: Dict, template: str, version: str) -> str:
+        payload = {
+            "mode": settings.chat_mode,
+            "model_path": config.get("adapter_path"),
+            "base_model_path": config.get("base_model_path"),
+            "template": template,
+            "version": version,
+            "messages": normalize_messages(config.get("messages", [])),
+            "max_tokens": config.get("max_tokens"),
+        }
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [k for k, entry in self._entries.items() if entry[0] <= now]:
+            self._entries.pop(key)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[str]:
+        self._expire()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key: str, model_path: str, content: str):
+        self._entries[key] = (time.monotonic() + settings.chat_cache_ttl, model_path, content)
+        self._entries.move_to_end(key)
+        while len(self._entries) > settings.chat_cache_max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_model(self, model_path: str):
+        """清除一个模型的所有缓存"""
+        keys = [k for k, entry in self._entries.items() if entry[1] == model_path]
+        for key in keys:
+            self._entries.pop(key)
+        if keys:
+            self.invalidations += len(keys)
+            logger.info(f"[ChatService] 模型文件已变化，清除缓存 {len(keys)} 条: {model_path}")
+
+    def stats(self) -> Dict:
+        self._expire()
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from app.config import settings
+from app.database import SessionLocal
+from app.db_models import BatchInferenceJobDB, TaskDB
+from app.services.async_ssh_service import AsyncSSHService
+from app.services.batch_inference_service import BatchInferenceService
+from app.services.log_stream_service import log_stream_hub
+from app.services.node_registry import get_node
+from app.services.task_service import TaskService, EXIT_CODE_FILE
+from app.services.task_scheduler import task_scheduler
+
+logger = logging.getLogger(__name__)
+
+# 旧版本启动的任务没有退出码文件，退回到在日志末尾查找完成标记
+COMPLETION_SENTINELS = ["Training completed", "训练完成"]
+
+def build_probe_script(tasks: List[TaskDB]) -> str:
+    """
+    构建批量探测脚本：一次 ps 查询所有任务进程是否存活，再逐个检查退出码文件
+    每个任务输出一行: "<task_id> exit <code>" / "<task_id> running" / "<task_id> dead" / "<task_id> unknown"
+    """
+    pids = [t.process_id for t in tasks if t.process_id]
+    sentinel_args = " ".join(f"-e '{s}'" for s in COMPLETION_SENTINELS)
+    lines = [
+        f'__alive=" $(ps -o pid= -p {",".join(pids)} 2>/dev/null | tr -s " \\n" "  ") "' if pids else '__alive=" "',
+        "__probe() {",
+        f'  if [ -f "$3/{EXIT_CODE_FILE}" ]; then echo "$1 exit $(cat "$3/{EXIT_CODE_FILE}")"',
+        '  elif [ "$2" != "-" ] && case "$__alive" in *" $2 "*) true;; *) false;; esac; then echo "$1 running"',
+        f'  elif tail -n 100 "$3/train.log" 2>/dev/null | grep -q -F {sentinel_args}; then echo "$1 exit 0"',
+        '  elif [ "$2" = "-" ]; then echo "$1 unknown"',
+        '  else echo "$1 dead"; fi',
+        "}",
+    ]
+    for task in tasks:
+        lines.append(f'__probe {task.task_id} {task.process_id or "-"} "{task.output_dir}"')
+    return "\n".join(lines)
+
+def parse_probe_output(stdout: str) -> Dict[str, Tuple[str, Optional[int]]]:
+    """解析探测脚本输出，返回 {task_id: (状态, 退出码)}"""
+    results: Dict[str, Tuple[str, Optional[int]]] = {}
+    for line in stdout.splitlines():
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        exit_code = None
+        if parts[1] == "exit":
+            try:
+                exit_code = int(parts[2]) if len(parts) > 2 else None
+            except ValueError:
+                exit_code = None
+        results[parts[0]] = (parts[1], exit_code)
+    return results
+
+
+class TaskMonitor:
+    """
+    后台任务监控：周期性地用一条远程命令批量探测所有用户的运行中任务，
+    更新 TaskDB.status 并为完成的任务登记模型，读取接口只需查询数据库；
+    同时刷新运行中批量推理任务的进度和状态，之后触发一轮调度，启动排队中的任务
+    """
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            logger.info(f"[任务监控] 启动，检查间隔: {self.interval}秒")
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("[任务监控] 已停止")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check_running_tasks()
+                await self.check_batch_jobs()
+                # 任务结束释放容量后启动排队任务；同时兜底处理创建时未能调度的任务
+                await task_scheduler.schedule()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[任务监控] 检查任务状态失败: {str(e)}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def _probe_node(self, node: str, tasks: List[TaskDB]) -> Dict[str, Tuple[str, Optional[int]]]:
+        """探测一个节点上的任务；节点不可达时返回空结果（任务保持 running，下次再检查）"""
+        try:
+            results = await AsyncSSHService(node).run_pipeline([build_probe_script(tasks)], stop_on_error=False)
+        except Exception as e:
+            logger.error(f"[任务监控] 探测节点失败，节点: {node}, 错误: {str(e)}")
+            return {}
+        if not results:
+            logger.warning(f"[任务监控] 探测脚本未返回结果，节点: {node}")
+            return {}
+        stdout, stderr, return_code = results[0]
+        if return_code != 0:
+            logger.warning(f"[任务监控] 探测脚本执行失败，节点: {node}, 退出码: {return_code}, 错误: {stderr}")
+        return parse_probe_output(stdout)
+
+    async def check_running_tasks(self):
+        """检查所有运行中的任务并更新状态"""
+        db = SessionLocal()
+        try:
+            tasks = db.query(TaskDB).filter(TaskDB.status == "running").all()
+            if not tasks:
+                return
+
+            # 按节点分组，每个节点一条探测命令，各节点并发探测
+            by_node: Dict[str, List[TaskDB]] = {}
+            for task in tasks:
+                by_node.setdefault(get_node(task.node).name, []).append(task)
+            node_states = await asyncio.gather(
+                *(self._probe_node(node, node_tasks) for node, node_tasks in by_node.items())
+            )
+            states: Dict[str, Tuple[str, Optional[int]]] = {}
+            for node_state in node_states:
+                states.update(node_state)
+
+            task_service = TaskService()
+            unknown_deadline = datetime.utcnow() - timedelta(seconds=settings.task_unknown_grace_seconds)
+            for task in tasks:
+                # 节点不可达时没有探测结果，任务保持 running
+                state, exit_code = states.get(task.task_id, (None, None))
+                if state == "exit":
+                    task.status = "completed" if exit_code == 0 else "failed"
+                elif state == "dead":
+                    # 进程已不存在但没有写入退出码（被 kill、OOM 或机器重启）
+                    task.status = "failed"
+                elif state == "unknown" and (task.updated_at or task.created_at) < unknown_deadline:
+                    # 启动时没有记录PID且一直没有退出码，无法判断是否仍在运行；
+                    # 超过宽限时间后按失败处理，释放调度器为它保留的GPU
+                    logger.warning(f"[任务监控] 任务状态超过 {settings.task_unknown_grace_seconds} 秒无法确定，标记为失败，任务ID: {task.task_id}")
+                    task.status = "failed"
+                else:
+                    continue
+                db.commit()
+                logger.info(f"[任务监控] 任务结束，任务ID: {task.task_id}, 状态: {task.status}, 退出码: {exit_code}")
+                if task.status == "completed":
+                    task_service.register_task_model(db, task)
+                log_stream_hub.close_task(task.task_id)
+        finally:
+            db.close()
+
+    async def check_batch_jobs(self):
+        """刷新所有运行中的批量推理任务（没有人查询的任务结束后也能及时更新状态）"""
+        db = SessionLocal()
+        try:
+            jobs = db.query(BatchInferenceJobDB).filter(BatchInferenceJobDB.status == "running").all()
+            service = BatchInferenceService()
+            for job in jobs:
+                await service.refresh(db, job)
+        finally:
+            db.close()
+
+
+task_monitor = TaskMonitor(settings.task_monitor_interval)
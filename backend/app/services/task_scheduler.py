@@ -0,0 +1,235 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from app.config import settings
+from app.database import SessionLocal
+from app.db_models import TaskDB, DatasetFileDB
+from app.services.node_registry import get_node, get_nodes, get_enabled_nodes
+from app.services.task_service import TaskService
+
+logger = logging.getLogger(__name__)
+
+# 占用GPU容量的任务状态（pending 为调度器已选中、正在启动）
+ACTIVE_STATUSES = ["pending", "running"]
+
+def parse_gpu_ids(gpu_ids: Optional[str]) -> List[int]:
+    if not gpu_ids:
+        return []
+    return [int(g) for g in gpu_ids.split(",") if g.strip().isdigit()]
+
+class GPUPool:
+    """
+    一个节点的GPU容量视图：按已分配任务的 gpu_ids 和显存需求计算每张卡的剩余显存
+    未配置单卡显存（gpu_memory_mb=0）时每张卡只能被一个任务独占
+    """
+
+    def __init__(self, slots: int, memory_mb: int, default_task_memory_mb: int):
+        self.memory_mb = memory_mb
+        self.default_task_memory_mb = default_task_memory_mb
+        self.free = [memory_mb if memory_mb > 0 else 1 for _ in range(slots)]
+
+    def memory_need(self, task: TaskDB) -> int:
+        """任务在每张卡上需要的显存；未启用显存调度时按整卡计算"""
+        if self.memory_mb <= 0:
+            return 1
+        need = task.gpu_memory_mb or self.default_task_memory_mb or self.memory_mb
+        return min(need, self.memory_mb)
+
+    def free_ratio(self) -> float:
+        """剩余容量比例，用于在多个节点间均衡负载"""
+        total = (self.memory_mb if self.memory_mb > 0 else 1) * len(self.free)
+        return sum(max(free, 0) for free in self.free) / total if total else 0.0
+
+    def reserve(self, task: TaskDB, gpu_ids: List[int]):
+        need = self.memory_need(task)
+        for gpu in gpu_ids:
+            if 0 <= gpu < len(self.free):
+                self.free[gpu] -= need
+
+    def place(self, task: TaskDB) -> Optional[List[int]]:
+        """为任务选择GPU，容量不足时返回 None；优先选择剩余显存最少但足够的卡，减少碎片"""
+        need = self.memory_need(task)
+        count = task.gpu_count or 1
+        candidates = sorted(
+            (gpu for gpu, free in enumerate(self.free) if free >= need),
+            key=lambda gpu: (self.free[gpu], gpu)
+        )
+        if len(candidates) < count:
+            return None
+        return sorted(candidates[:count])
+
+class TaskScheduler:
+    """
+    训练任务调度器：新任务以 queued 状态持久化在 TaskDB 中，
+    在有GPU容量时按优先级、用户公平性（当前占用越少越先）和提交时间选出任务并启动。
+    多节点时优先放到数据集所在的节点，其次放到剩余容量最多的节点。
+    创建任务时在后台触发调度（wake），任务结束后由 TaskMonitor 触发调度，服务重启后队列不会丢失。
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self.task_service = TaskService()
+        self._runner: Optional[asyncio.Task] = None
+        self._wake_pending = False
+
+    def _new_pools(self) -> Dict[str, GPUPool]:
+        return {
+            node.name: GPUPool(node.gpu_slots, node.gpu_memory_mb, settings.scheduler_default_task_memory_mb)
+            for node in get_nodes()
+        }
+
+    def validate(self, gpu_count: int, gpu_memory_mb: Optional[int]) -> Optional[str]:
+        """检查任务需求能否被至少一个节点满足，返回错误信息；可以满足时返回 None"""
+        if gpu_count < 1:
+            return "GPU数量至少为1"
+        nodes = get_enabled_nodes()
+        if not nodes:
+            return "没有可用的训练节点"
+        max_slots = max(node.gpu_slots for node in nodes)
+        if gpu_count > max_slots:
+            return f"GPU数量超过单个节点可用数量: {max_slots}"
+        if gpu_memory_mb is not None and not any(
+            node.gpu_slots >= gpu_count and (node.gpu_memory_mb <= 0 or gpu_memory_mb <= node.gpu_memory_mb)
+            for node in nodes
+        ):
+            return "没有节点能满足该显存需求"
+        return None
+
+    def _place(
+        self,
+        pools: Dict[str, GPUPool],
+        task: TaskDB,
+        dataset_node: Optional[str]
+    ) -> Optional[Tuple[str, List[int]]]:
+        """为任务选择节点和GPU：优先数据集所在节点（免传输），其次剩余容量比例最大的节点"""
+        best = None
+        for node in get_enabled_nodes():
+            pool = pools[node.name]
+            gpu_ids = pool.place(task)
+            if gpu_ids is None:
+                continue
+            rank = (node.name != dataset_node, -pool.free_ratio())
+            if best is None or rank < best[0]:
+                best = (rank, node.name, gpu_ids)
+        return (best[1], best[2]) if best else None
+
+    def _select(self, db) -> List[TaskDB]:
+        """选出本轮可以启动的任务并标记为 pending"""
+        pools = self._new_pools()
+        user_usage: Dict[str, int] = {}
+        for task in db.query(TaskDB).filter(TaskDB.status.in_(ACTIVE_STATUSES)).all():
+            pools[get_node(task.node).name].reserve(task, parse_gpu_ids(task.gpu_ids))
+            user_usage[task.user_id] = user_usage.get(task.user_id, 0) + 1
+
+        queued = db.query(TaskDB).filter(TaskDB.status == "queued").all()
+        if not queued:
+            return []
+        dataset_nodes = {
+            (f.user_id, f.file_path): get_node(f.node).name
+            for f in db.query(DatasetFileDB).filter(
+                DatasetFileDB.file_path.in_({t.dataset_path for t in queued})
+            ).all()
+        }
+        max_per_user = settings.scheduler_max_running_per_user
+        selected: List[TaskDB] = []
+        while queued:
+            # 每选中一个任务都重新排序，使同优先级下各用户轮流获得容量
+            queued.sort(key=lambda t: (-(t.priority or 0), user_usage.get(t.user_id, 0), t.created_at))
+            chosen = None
+            for task in queued:
+                if max_per_user > 0 and user_usage.get(task.user_id, 0) >= max_per_user:
+                    continue
+                placement = self._place(pools, task, dataset_nodes.get((task.user_id, task.dataset_path)))
+                if placement is not None:
+                    chosen = (task, placement)
+                    break
+            if chosen is None:
+                break
+            task, (node, gpu_ids) = chosen
+            queued.remove(task)
+            pools[node].reserve(task, gpu_ids)
+            user_usage[task.user_id] = user_usage.get(task.user_id, 0) + 1
+            task.node = node
+            task.gpu_ids = ",".join(str(g) for g in gpu_ids)
+            task.status = "pending"
+            selected.append(task)
+
+        if selected:
+            db.commit()
+        return selected
+
+    def recover(self):
+        """服务启动时把上次退出时正在启动（pending）的任务放回队列"""
+        db = SessionLocal()
+        try:
+            tasks = db.query(TaskDB).filter(TaskDB.status == "pending").all()
+            for task in tasks:
+                task.status = "queued"
+                task.node = None
+                task.gpu_ids = None
+            if tasks:
+                db.commit()
+                logger.info(f"[任务调度] 恢复未完成启动的任务到队列: {[t.task_id for t in tasks]}")
+        finally:
+            db.close()
+
+    async def _launch(self, task_id: str):
+        """在独立的数据库会话中启动一个已选中的任务，多个任务并发启动时互不共享会话"""
+        db = SessionLocal()
+        try:
+            task = db.query(TaskDB).filter(TaskDB.task_id == task_id).first()
+            if task is None or task.status != "pending":
+                return
+            await self.task_service.launch_task(db, task)
+        finally:
+            db.close()
+
+    async def schedule(self) -> Dict[str, str]:
+        """
+        执行一轮调度，启动所有能放下的排队任务
+        返回启动失败的任务 {task_id: 错误信息}
+        """
+        db = SessionLocal()
+        try:
+            async with self._lock:
+                selected = [(t.task_id, t.node, t.gpu_ids) for t in self._select(db)]
+        finally:
+            db.close()
+        if not selected:
+            return {}
+        logger.info(f"[任务调度] 本轮启动任务: {selected}")
+
+        results = await asyncio.gather(
+            *(self._launch(task_id) for task_id, _, _ in selected),
+            return_exceptions=True
+        )
+        errors = {}
+        for (task_id, _, _), result in zip(selected, results):
+            if isinstance(result, Exception):
+                errors[task_id] = str(result)
+        if errors:
+            # 启动失败的任务已释放容量，再调度一轮让后面的任务补上
+            retry_errors = await self.schedule()
+            errors.update(retry_errors)
+        return errors
+
+    def wake(self):
+        """
+        在后台触发一轮调度后立即返回（创建任务的请求不等待远程启动）
+        调度进行中再次触发时合并为结束后再执行一轮
+        """
+        self._wake_pending = True
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run_wakeups())
+
+    async def _run_wakeups(self):
+        while self._wake_pending:
+            self._wake_pending = False
+            try:
+                errors = await self.schedule()
+                if errors:
+                    logger.warning(f"[任务调度] 部分任务启动失败: {errors}")
+            except Exception as e:
+                logger.error(f"[任务调度] 调度失败: {str(e)}", exc_info=True)
+
+task_scheduler = TaskScheduler()
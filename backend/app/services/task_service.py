@@ -1,20 +1,71 @@
 import uuid
+import json
+import base64
+import asyncio
+import codecs
 import logging
+import shlex
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from app.db_models import TaskDB
+from typing import List, Optional, Tuple, Dict, AsyncIterator
+from app.db_models import TaskDB, ModelFileDB
 from app.models import TaskCreate, Task
-from app.services.ssh_service import SSHService
+from app.services.async_ssh_service import AsyncSSHService
+from app.services.file_service import FileService
+from app.services.log_stream_service import log_stream_hub
 from app.config import settings
+from app.utils.file_utils import trim_incomplete_utf8
 
 logger = logging.getLogger(__name__)
 
+# 训练启动命令输出中的标记行：进程PID、观察窗口内进程已退出时的退出码
+PID_MARKER = "__TRAIN_PID__="
+EXIT_MARKER = "__TRAIN_EXIT__="
+# 训练进程结束时写入退出码的文件（位于输出目录下），供后台监控判断任务结束状态
+EXIT_CODE_FILE = ".exit_code"
+# 每个任务在输出目录下有独立的 dataset_info.json，只登记本任务的数据集（引用原文件，不拷贝）
+TASK_DATASET_DIR = "dataset"
+TASK_DATASET_NAME = "task_dataset"
+
+# 硬编码的模型列表
+AVAILABLE_MODELS = {
+    "Qwen2-0.5B": {
+        "model_path": "/root/autodl-tmp/Qwen2-0.5B-Instruct",
+        "template": "qwen2"
+    }
+}
+
+def parse_launch_output(stdout: str) -> Tuple[Optional[str], Optional[int]]:
+    """解析训练启动命令的输出，返回 (pid, exit_code)；进程仍在运行时 exit_code 为 None"""
+    pid = None
+    exit_code = None
+    for line in stdout.splitlines():
+        line = line.strip()
+        if line.startswith(PID_MARKER):
+            pid = line[len(PID_MARKER):].strip() or None
+        elif line.startswith(EXIT_MARKER):
+            try:
+                exit_code = int(line[len(EXIT_MARKER):].strip())
+            except ValueError:
+                pass
+    return pid, exit_code
+
+def build_dataset_info_command(dataset_path: str, output_dir: str) -> str:
+    """
+    构建写入任务专属 dataset_info.json 的命令
+    file_name 使用数据集的绝对路径，LlamaFactory 直接读取原文件，多个任务互不影响
+    """
+    dataset_info = {TASK_DATASET_NAME: {"file_name": dataset_path}}
+    # 使用base64编码JSON，避免文件名中的特殊字符被shell解析
+    info_b64 = base64.b64encode(json.dumps(dataset_info, ensure_ascii=False).encode('utf-8')).decode('ascii')
+    dataset_dir = f"{output_dir}/{TASK_DATASET_DIR}"
+    return f"mkdir -p {dataset_dir} && echo {info_b64} | base64 -d > {dataset_dir}/dataset_info.json"
+
 class TaskService:
     def __init__(self):
-        self.ssh_service = SSHService()
+        self.file_service = FileService()
     
     def create_task(self, db: Session, user_id: str, task_data: TaskCreate, model_path: str = None) -> TaskDB:
-        """创建任务并启动执行
+        """创建任务并加入排队队列（由 TaskScheduler 按 GPU 容量调度启动）
         
         Args:
             db: 数据库会话
@@ -31,38 +82,11 @@ class TaskService:
         task_id = str(uuid.uuid4())
         output_dir = f"{settings.remote_user_data_dir}/{user_id}/models/{task_id}"
         logger.info(f"[训练任务] 使用输出目录: {output_dir}")
-
-        # 在远程服务器上准备当前数据集文件：复制为 current_dataset.json
-        current_dataset_path = f"{settings.remote_work_dir}/current_dataset.json"
-        copy_command = f"cp {task_data.dataset_path} {current_dataset_path}"
-        logger.info(f"[训练任务] 准备数据集：{task_data.dataset_path} -> {current_dataset_path}")
-        try:
-            stdout_cp, stderr_cp, rc_cp = self.ssh_service.execute_command(copy_command, background=False)
-            logger.info(f"[训练任务] 拷贝数据集返回码: {rc_cp}")
-            logger.info(f"[训练任务] 拷贝数据集 stdout: {stdout_cp[:500] if stdout_cp else '(空)'}")
-            logger.info(f"[训练任务] 拷贝数据集 stderr: {stderr_cp[:500] if stderr_cp else '(空)'}")
-            if rc_cp != 0:
-                raise Exception(f"远程拷贝数据集失败: {stderr_cp}")
-        except Exception as e:
-            logger.error(f"[训练任务] 远程拷贝数据集失败: {str(e)}", exc_info=True)
-            raise
-
-        # 确保输出目录存在（在构建命令之前）
-        mkdir_command = f"mkdir -p {output_dir}"
-        logger.info(f"[训练任务] 创建输出目录: {output_dir}")
-        try:
-            stdout_mkdir, stderr_mkdir, rc_mkdir = self.ssh_service.execute_command(mkdir_command, background=False)
-            if rc_mkdir != 0:
-                logger.warning(f"[训练任务] 创建输出目录失败: {stderr_mkdir}")
-                raise Exception(f"创建输出目录失败: {stderr_mkdir}")
-        except Exception as e:
-            logger.error(f"[训练任务] 创建输出目录失败: {str(e)}", exc_info=True)
-            raise
         
-        # 构建训练命令（此时 --dataset 将固定使用 current_dataset）
+        # 构建训练命令（数据集通过任务输出目录下的 dataset_info.json 登记）
         command = self.build_training_command(task_data, output_dir, actual_model_path)
         
-        # 创建任务记录
+        # 创建任务记录（排队中）
         db_task = TaskDB(
             user_id=user_id,
             name=task_data.name,
@@ -72,26 +96,62 @@ class TaskService:
             learning_rate=task_data.learning_rate,
             batch_size=task_data.batch_size,
             output_dir=output_dir,
-            status="pending",
+            status="queued",
+            priority=task_data.priority or 0,
+            gpu_count=task_data.gpu_count or 1,
+            gpu_memory_mb=task_data.gpu_memory_mb,
             ssh_command=command
         )
         db.add(db_task)
         db.commit()
         db.refresh(db_task)
+        logger.info(f"[训练任务] 任务已加入队列，任务ID: {db_task.task_id}, 优先级: {db_task.priority}, GPU数: {db_task.gpu_count}")
+        return db_task
+    
+    async def launch_task(self, db: Session, db_task: TaskDB) -> TaskDB:
+        """在任务所在节点上准备数据集和输出目录并启动训练（由调度器调用）"""
+        ssh_service = AsyncSSHService(db_task.node)
+        # 确保输出目录存在
+        mkdir_command = f"mkdir -p {db_task.output_dir}"
+        logger.info(f"[训练任务] 创建输出目录: {db_task.output_dir}")
+
+        # 在输出目录下登记本任务的数据集（引用原文件路径，无需拷贝）
+        dataset_command = build_dataset_info_command(db_task.dataset_path, db_task.output_dir)
+        logger.info(f"[训练任务] 登记数据集: {db_task.dataset_path} -> {db_task.output_dir}/{TASK_DATASET_DIR}/dataset_info.json")
+        
+        # 限定训练进程只使用调度器分配的GPU
+        command = db_task.ssh_command
+        if db_task.gpu_ids:
+            command = f"CUDA_VISIBLE_DEVICES={db_task.gpu_ids} {command}"
+            logger.info(f"[训练任务] 分配GPU: {db_task.gpu_ids}")
         
-        # 执行训练命令（后台执行）
+        # 创建输出目录、登记数据集、启动训练（后台执行）合并为一个远程脚本，一次往返完成
         try:
-            logger.info(f"[训练任务] 开始执行训练命令，任务ID: {db_task.task_id}")
-            stdout, stderr, return_code = self.ssh_service.execute_command(command, background=True)
+            # 数据集不在任务所在节点上时先传输过去
+            await self.file_service.stage_dataset(db, db_task.user_id, db_task.dataset_path, db_task.node)
+            logger.info(f"[训练任务] 开始执行训练命令，任务ID: {db_task.task_id}, 节点: {ssh_service.node}")
+            results = await ssh_service.run_pipeline(
+                [mkdir_command, dataset_command, command],
+                timeout=60 + settings.task_launch_watch_seconds
+            )
+            step_errors = ["创建输出目录失败", "登记数据集失败", "训练命令执行失败"]
+            for index, (stdout, stderr, return_code) in enumerate(results):
+                logger.info(f"[训练任务] 步骤 {index} 返回 - 退出码: {return_code}")
+                logger.info(f"[训练任务] 步骤 {index} 返回 - stdout: {stdout[:500] if stdout else '(空)'}")
+                logger.info(f"[训练任务] 步骤 {index} 返回 - stderr: {stderr[:500] if stderr else '(空)'}")
+                if return_code != 0:
+                    raise Exception(f"{step_errors[index]}: {stderr}")
+            if len(results) != 3:
+                raise Exception("命令流水线未完整执行")
             
-            logger.info(f"[训练任务] 命令执行返回 - 退出码: {return_code}")
-            logger.info(f"[训练任务] 命令执行返回 - stdout: {stdout[:500] if stdout else '(空)'}")
-            logger.info(f"[训练任务] 命令执行返回 - stderr: {stderr[:500] if stderr else '(空)'}")
-            
-            # 保存执行结果到数据库（可选，用于调试）
-            if stdout or stderr:
-                debug_info = f"stdout: {stdout[:200]}\nstderr: {stderr[:200]}"
-                # 可以扩展 TaskDB 添加 debug_info 字段，这里先记录到日志
+            pid, exit_code = parse_launch_output(results[2][0])
+            if not pid:
+                raise Exception(f"未获取到训练进程PID: {results[2][0][:500]}")
+            db_task.process_id = pid
+            logger.info(f"[训练任务] 训练进程PID: {pid}")
+            if exit_code is not None:
+                log_tail = await self._read_log_tail(ssh_service, db_task.output_dir)
+                raise Exception(f"训练进程启动后立即退出，退出码: {exit_code}\n{log_tail}")
             
             db_task.status = "running"
             db.commit()
@@ -112,7 +172,8 @@ class TaskService:
         llamafactory-cli train \
           --stage sft \
           --model_name_or_path /root/autodl-tmp/Qwen2-0.5B-Instruct \
-          --dataset current_dataset \
+          --dataset_dir /root/autodl-tmp/out/dataset \
+          --dataset task_dataset \
           --template qwen2 \
           --finetuning_type lora \
           --output_dir /root/autodl-tmp/out \
@@ -126,17 +187,20 @@ class TaskService:
           --do_train
         """
         work_dir = settings.remote_work_dir
-        dataset_name = "current_dataset"
+        dataset_dir = f"{output_dir}/{TASK_DATASET_DIR}"
+        dataset_name = TASK_DATASET_NAME
 
         # 构建命令字符串
         # 使用 bash -l -c 确保使用login shell并加载环境变量（如.bashrc中的PATH）
         # 将多行命令合并为单行，避免SSH解析问题
         # 注意：使用双引号包裹bash -c的参数，避免单引号冲突
         train_cmd = (
-            f"cd {work_dir} && "
-            f"nohup llamafactory-cli train "
+            f"cd {work_dir} || exit 1; "
+            # 在忽略 SIGHUP 的子shell中运行训练（效果同 nohup），结束时把退出码写入 EXIT_CODE_FILE
+            f"( trap '' HUP; llamafactory-cli train "
             f"--stage {task_data.stage or 'sft'} "
             f"--model_name_or_path {model_name} "
+            f"--dataset_dir {dataset_dir} "
             f"--dataset {dataset_name} "
             f"--template {task_data.template or 'qwen2'} "
             f"--finetuning_type lora "
@@ -149,9 +213,22 @@ class TaskService:
             f"--fp16 "
             f"--cutoff_len 1024 "
             f"--plot_loss "
-            f"--do_train > {output_dir}/train.log 2>&1 &"
+            f"--do_train; "
+            f"__rc=\\$?; echo \\$__rc > {output_dir}/{EXIT_CODE_FILE}; exit \\$__rc ) "
+            f"> {output_dir}/train.log 2>&1 < /dev/null & "
+            # 启动后立即输出进程PID，调用方收到PID即可返回，无需固定等待
+            f"__pid=\\$!; echo {PID_MARKER}\\$__pid"
         )
         
+        # 可选的启动失败观察窗口：进程退出（tail --pid 立即返回）或窗口结束时检查进程是否仍存活，
+        # 若已退出则输出其退出码，便于在提交阶段就发现启动即失败的训练
+        watch_seconds = settings.task_launch_watch_seconds
+        if watch_seconds > 0:
+            train_cmd += (
+                f"; timeout {watch_seconds} tail --pid=\\$__pid -f /dev/null; "
+                f"kill -0 \\$__pid 2>/dev/null || {{ wait \\$__pid; echo {EXIT_MARKER}\\$?; }}"
+            )
+        
         # 使用 bash -l -c 执行（-l表示login shell，会加载.bashrc等配置文件）
         # 使用双引号包裹命令，避免单引号冲突
         command = f'bash -l -c "{train_cmd}"'
@@ -159,12 +236,45 @@ class TaskService:
         logger.info(f"[训练任务] 构建训练命令:")
         logger.info(f"[训练任务] 工作目录: {work_dir}")
         logger.info(f"[训练任务] 模型: {model_name}")
-        logger.info(f"[训练任务] 数据集(逻辑名): {dataset_name}，源路径: {task_data.dataset_path}")
+        logger.info(f"[训练任务] 数据集(逻辑名): {dataset_name}，登记目录: {dataset_dir}，源路径: {task_data.dataset_path}")
         logger.info(f"[训练任务] 输出目录: {output_dir}")
         logger.info(f"[训练任务] 完整命令: {command}")
 
         return command
     
+    async def _read_log_tail(self, ssh_service: AsyncSSHService, output_dir: str, lines: int = 20) -> str:
+        """读取训练日志末尾若干行（用于启动失败时给出原因）"""
+        stdout, _, _ = await ssh_service.execute_command(f"tail -n {int(lines)} {shlex.quote(f'{output_dir}/train.log')} 2>/dev/null")
+        return stdout
+    
+    def register_task_model(self, db: Session, task: TaskDB) -> Optional[ModelFileDB]:
+        """任务完成后把输出目录登记为用户的模型（已登记过则跳过）"""
+        existing_model = db.query(ModelFileDB).filter(
+            ModelFileDB.model_path == task.output_dir,
+            ModelFileDB.user_id == task.user_id
+        ).first()
+        if existing_model:
+            return existing_model
+        
+        # 将模型名称映射回路径（用于base_model_path）
+        base_model_path = task.model_name  # 默认使用模型名称
+        if task.model_name in AVAILABLE_MODELS:
+            base_model_path = AVAILABLE_MODELS[task.model_name]["model_path"]
+        
+        db_model = ModelFileDB(
+            user_id=task.user_id,
+            name=f"{task.name}_model",
+            model_path=task.output_dir,
+            base_model_path=base_model_path,  # 使用模型路径作为基础模型路径
+            task_id=task.task_id,
+            node=task.node  # 模型保存在训练所在节点上
+        )
+        db.add(db_model)
+        db.commit()
+        db.refresh(db_model)
+        logger.info(f"[训练任务] 已登记模型，任务ID: {task.task_id}, 模型路径: {task.output_dir}")
+        return db_model
+    
     def get_task(self, db: Session, task_id: str, user_id: str) -> Optional[TaskDB]:
         """获取任务详情（验证用户权限）"""
         return db.query(TaskDB).filter(
@@ -176,7 +286,7 @@ class TaskService:
         """获取用户的任务列表"""
         return db.query(TaskDB).filter(TaskDB.user_id == user_id).order_by(TaskDB.created_at.desc()).all()
     
-    def get_task_logs(self, db: Session, task_id: str, user_id: str) -> str:
+    async def get_task_logs(self, db: Session, task_id: str, user_id: str) -> str:
         """获取任务日志"""
         logger.info(f"[训练任务] 获取任务日志，任务ID: {task_id}")
         task = self.get_task(db, task_id, user_id)
@@ -187,10 +297,128 @@ class TaskService:
         log_file = f"{task.output_dir}/train.log"
         logger.info(f"[训练任务] 日志文件路径: {log_file}")
         try:
-            logs = self.ssh_service.read_file(log_file)
+            logs = await AsyncSSHService(task.node).read_file(log_file)
             logger.info(f"[训练任务] 成功读取日志，长度: {len(logs)} 字符")
             return logs
         except Exception as e:
             logger.error(f"[训练任务] 读取日志失败: {str(e)}", exc_info=True)
             return f"日志文件不存在或无法读取: {str(e)}"
-
+    
+    async def get_task_log_chunk(
+        self,
+        db: Session,
+        task_id: str,
+        user_id: str,
+        offset: Optional[int] = None,
+        limit: Optional[int] = None,
+        tail: Optional[int] = None
+    ) -> Optional[Dict]:
+        """
+        增量读取任务日志
+        - offset 模式：返回从 offset 开始最多 limit 字节的新内容
+        - tail 模式：返回最后 tail 行
+        返回: {"logs", "offset", "next_offset", "file_size"}，任务不存在时返回 None
+        客户端下次请求时以 next_offset 作为 offset，即可只获取新增内容
+        """
+        task = self.get_task(db, task_id, user_id)
+        if not task:
+            logger.warning(f"[训练任务] 任务不存在: {task_id}")
+            return None
+        
+        log_file = f"{task.output_dir}/train.log"
+        ssh_service = AsyncSSHService(task.node)
+        max_bytes = settings.task_log_max_read_bytes
+        limit = min(limit or max_bytes, max_bytes)
+        try:
+            if tail is not None:
+                data, file_size = await ssh_service.tail_file(log_file, tail)
+                data = data[-limit:]
+                # tail 的内容截止于 file_size，下次从文件末尾继续读取
+                return {
+                    "logs": data.decode('utf-8', errors='ignore'),
+                    "offset": max(file_size - len(data), 0),
+                    "next_offset": file_size,
+                    "file_size": file_size
+                }
+            
+            data, start, file_size = await ssh_service.read_file_range(log_file, offset or 0, limit)
+            # 区间末尾可能截断了多字节字符，截断部分留到下次读取
+            data = trim_incomplete_utf8(data)
+            logger.info(f"[训练任务] 增量读取日志，任务ID: {task_id}, 起始: {start}, 长度: {len(data)} 字节")
+            return {
+                "logs": data.decode('utf-8', errors='ignore'),
+                "offset": start,
+                "next_offset": start + len(data),
+                "file_size": file_size
+            }
+        except Exception as e:
+            logger.error(f"[训练任务] 读取日志失败: {str(e)}", exc_info=True)
+            return {
+                "logs": f"日志文件不存在或无法读取: {str(e)}",
+                "offset": offset or 0,
+                "next_offset": offset or 0,
+                "file_size": 0
+            }
+    
+    async def stream_task_logs(
+        self,
+        task: TaskDB,
+        offset: Optional[int] = None,
+        tail: Optional[int] = None
+    ) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        实时推送任务日志：先补发 offset 之后（或最后 tail 行）的已有内容，再持续推送新增内容
+        同一任务的所有订阅者共享一个远程 tail -F channel
+        产出: (事件类型, 数据)，事件类型为 log / heartbeat / end / error
+        """
+        log_file = f"{task.output_dir}/train.log"
+        ssh_service = AsyncSSHService(task.node)
+        async with log_stream_hub.subscribe(task.task_id, log_file, node=task.node) as sub:
+            live_offset = await sub.wait_ready()
+            if sub.error:
+                yield "error", {"detail": f"日志文件不存在或无法读取: {sub.error}"}
+                return
+            
+            # 补发订阅前已有的内容，截止到开始接收实时数据的偏移，避免重复或遗漏
+            try:
+                if offset is not None:
+                    start = max(offset, live_offset - settings.task_log_max_read_bytes)
+                    data, start, _ = await ssh_service.read_file_range(log_file, start, max(live_offset - start, 0))
+                else:
+                    data, file_size = await ssh_service.tail_file(log_file, tail or settings.log_stream_default_tail)
+                    data = data[:max(len(data) - (file_size - live_offset), 0)]
+                    start = live_offset - len(data)
+            except Exception as e:
+                logger.warning(f"[训练任务] 补发历史日志失败: {str(e)}")
+                data, start = b"", live_offset
+            if data:
+                yield "log", {
+                    "logs": data.decode('utf-8', errors='ignore'),
+                    "offset": start,
+                    "next_offset": start + len(data)
+                }
+            
+            # 实时内容的块边界可能截断多字节字符，使用增量解码器拼接
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+            while True:
+                try:
+                    item = await asyncio.wait_for(sub.get(), timeout=settings.log_stream_heartbeat_interval)
+                except asyncio.TimeoutError:
+                    yield "heartbeat", {}
+                    continue
+                if item is None:
+                    break
+                chunk_offset, chunk = item
+                text = decoder.decode(chunk)
+                if text:
+                    yield "log", {
+                        "logs": text,
+                        "offset": chunk_offset,
+                        "next_offset": chunk_offset + len(chunk)
+                    }
+            
+            if sub.error:
+                yield "error", {"detail": f"日志流中断: {sub.error}"}
+            else:
+                # overflowed 为 True 时表示客户端消费过慢被断开，可按最后的 next_offset 重新连接
+                yield "end", {"overflowed": sub.overflowed}
@@ -0,0 +1,233 @@
+import logging
+import os
+import re
+import shlex
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal
+from app.db_models import DatasetFileDB, UploadSessionDB
+from app.models import UploadChunk, UploadInit
+from app.services.async_ssh_service import AsyncSSHService
+from app.services.file_service import FileService
+from app.services.node_registry import primary_node_name
+from app.utils.dataset_validator import DatasetValidationError
+from app.utils.file_utils import UploadTooLargeError
+
+logger = logging.getLogger(__name__)
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# 上传会话状态
+UPLOADING = "uploading"
+COMPLETING = "completing"
+
+class UploadInProgressError(ValueError):
+    """上传会话正在合并，不能再次合并或继续上传分块"""
+
+
+class ChunkedUploadService:
+    """
+    可续传的分块上传（init / put chunk N / complete）：
+    每个分块单独流式写入远程暂存目录（文件名为分块序号），客户端可以同时上传多个分块
+    （每个请求使用各自的 SFTP channel），失败的分块单独重传；已上传的分块以远程暂存目录为准，
+    中断后查询会话即可知道还缺哪些分块。全部上传后在远程合并、校验大小和 SHA-256，
+    再流式读取合并后的文件校验数据集格式，通过后登记为数据集文件
+    """
+
+    def __init__(self):
+        self.file_service = FileService()
+
+    @staticmethod
+    def total_chunks(session: UploadSessionDB) -> int:
+        return (session.size + session.chunk_size - 1) // session.chunk_size
+
+    @staticmethod
+    def chunk_length(session: UploadSessionDB, index: int) -> int:
+        """分块的字节数（最后一个分块可能较小）"""
+        return min(session.chunk_size, session.size - index * session.chunk_size)
+
+    async def create_session(self, db: Session, user_id: str, data: UploadInit) -> UploadSessionDB:
+        """创建上传会话；参数不合法时抛出 ValueError，文件超过 max_upload_size 时抛出 UploadTooLargeError"""
+        filename = os.path.basename(data.filename)
+        if not filename:
+            raise ValueError("文件名不能为空")
+        if data.size <= 0:
+            raise ValueError("文件大小必须大于 0")
+        if data.size > settings.max_upload_size:
+            raise UploadTooLargeError(f"文件大小超过限制（{settings.max_upload_size} 字节）")
+        chunk_size = data.chunk_size or settings.upload_chunk_size
+        if chunk_size <= 0 or chunk_size > settings.upload_max_chunk_size:
+            raise ValueError(f"分块大小必须在 1 到 {settings.upload_max_chunk_size} 字节之间")
+        checksum = data.checksum.lower() if data.checksum else None
+        if checksum and not SHA256_PATTERN.match(checksum):
+            raise ValueError("checksum 必须是 SHA-256 的十六进制字符串")
+
+        await self._purge_expired(db, user_id)
+        session = UploadSessionDB(
+            user_id=user_id,
+            filename=filename,
+            size=data.size,
+            chunk_size=chunk_size,
+            checksum=checksum,
+            staging_dir="",
+            node=primary_node_name()
+        )
+        db.add(session)
+        db.flush()
+        session.staging_dir = f"{settings.remote_user_data_dir}/{user_id}/uploads/{session.upload_id}"
+        db.commit()
+        db.refresh(session)
+        logger.info(
+            f"[文件服务] 创建分块上传，上传ID: {session.upload_id}, 文件名: {filename}, "
+            f"大小: {data.size} 字节, 分块数: {self.total_chunks(session)}"
+        )
+        return session
+
+    def recover(self):
+        """服务启动时把上次退出时正在合并的会话恢复为上传中，客户端可以重新合并"""
+        db = SessionLocal()
+        try:
+            count = db.query(UploadSessionDB).filter(UploadSessionDB.status == COMPLETING).update(
+                {"status": UPLOADING}, synchronize_session=False
+            )
+            db.commit()
+            if count:
+                logger.info(f"[文件服务] 恢复未完成合并的分块上传: {count} 个")
+        finally:
+            db.close()
+
+    def get_session(self, db: Session, upload_id: str, user_id: str) -> Optional[UploadSessionDB]:
+        return db.query(UploadSessionDB).filter(
+            UploadSessionDB.upload_id == upload_id,
+            UploadSessionDB.user_id == user_id
+        ).first()
+
+    async def received_chunks(self, session: UploadSessionDB) -> List[int]:
+        """已完整上传的分块序号（以远程暂存目录中大小正确的分块文件为准）"""
+        files = await AsyncSSHService(session.node).list_dir(session.staging_dir)
+        total = self.total_chunks(session)
+        return sorted(
+            int(name) for name, size in files.items()
+            if name.isdigit() and int(name) < total and size == self.chunk_length(session, int(name))
+        )
+
+    async def put_chunk(
+        self,
+        session: UploadSessionDB,
+        index: int,
+        chunks: AsyncIterator[bytes],
+        checksum: Optional[str] = None
+    ) -> UploadChunk:
+        """写入一个分块（重复上传时覆盖）；长度或 SHA-256 不符时删除该分块并抛出 ValueError"""
+        if session.status == COMPLETING:
+            raise UploadInProgressError("上传正在合并中，不能再上传分块")
+        total = self.total_chunks(session)
+        if index < 0 or index >= total:
+            raise ValueError(f"分块序号超出范围（0 - {total - 1}）")
+        expected = self.chunk_length(session, index)
+        ssh_service = AsyncSSHService(session.node)
+        chunk_path = f"{session.staging_dir}/{index}"
+        size, digest = await ssh_service.upload_stream(chunks, chunk_path, expected)
+        error = None
+        if size != expected:
+            error = f"分块 {index} 大小不正确: {size}，应为 {expected} 字节"
+        elif checksum and digest != checksum.lower():
+            error = f"分块 {index} 校验失败"
+        if error:
+            await ssh_service.execute_command(f"rm -f {shlex.quote(chunk_path)}")
+            raise ValueError(error)
+        logger.info(f"[文件服务] 分块上传完成，上传ID: {session.upload_id}, 分块: {index}/{total}")
+        return UploadChunk(index=index, size=size, checksum=digest)
+
+    async def complete(self, db: Session, session: UploadSessionDB) -> DatasetFileDB:
+        """
+        在远程按序合并分块并计算 SHA-256，校验通过后登记为数据集文件；缺少分块或校验失败时抛出 ValueError
+        数据集格式校验不通过时（DatasetValidationError）同时取消上传会话，重新上传修正后的文件
+        同一会话同时只能有一个合并，重复请求抛出 UploadInProgressError
+        """
+        # 条件更新保证只有一个请求能把会话切换到合并状态
+        claimed = db.query(UploadSessionDB).filter(
+            UploadSessionDB.upload_id == session.upload_id,
+            UploadSessionDB.status == UPLOADING
+        ).update({"status": COMPLETING}, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            raise UploadInProgressError("上传正在合并中")
+        db.refresh(session)
+        try:
+            return await self._merge(db, session)
+        except DatasetValidationError:
+            # 会话已取消
+            raise
+        except BaseException:
+            # 缺少分块、校验失败等：恢复为上传中，客户端补传后可以重新合并
+            session.status = UPLOADING
+            db.commit()
+            raise
+
+    async def _merge(self, db: Session, session: UploadSessionDB) -> DatasetFileDB:
+        total = self.total_chunks(session)
+        received = set(await self.received_chunks(session))
+        missing = [i for i in range(total) if i not in received]
+        if missing:
+            raise ValueError(f"缺少分块: {missing[:50]}")
+
+        incoming_path = self.file_service.incoming_path(session.user_id, session.filename)
+        quoted_path = shlex.quote(incoming_path)
+        ssh_service = AsyncSSHService(session.node)
+        # 合并和计算校验和在一次读取中完成；pipefail 使管道中任一命令（如读取分块的 cat）失败时整体失败
+        merge_command = (
+            f"mkdir -p {shlex.quote(os.path.dirname(incoming_path))} && cd {shlex.quote(session.staging_dir)} && "
+            f"seq 0 {total - 1} | xargs cat | tee {quoted_path} | sha256sum"
+        )
+        stdout, stderr, return_code = await ssh_service.execute_command(
+            f"bash -o pipefail -c {shlex.quote(merge_command)}",
+            timeout=600
+        )
+        if return_code != 0:
+            await ssh_service.execute_command(f"rm -f {quoted_path}")
+            raise Exception(f"合并分块失败: {stderr}")
+        digest = stdout.split()[0] if stdout.split() else ""
+        if session.checksum and digest != session.checksum:
+            await ssh_service.execute_command(f"rm -f {quoted_path}")
+            raise ValueError(f"文件校验失败: SHA-256 为 {digest}，应为 {session.checksum}")
+
+        try:
+            stats = await self.file_service.validate_remote_dataset(session.node, session.filename, incoming_path)
+        except DatasetValidationError:
+            await ssh_service.execute_command(f"rm -f {quoted_path}")
+            await self.abort(db, session)
+            raise
+
+        await ssh_service.execute_command(f"rm -rf {shlex.quote(session.staging_dir)}")
+        logger.info(f"[文件服务] 分块上传合并完成，上传ID: {session.upload_id}, SHA-256: {digest}")
+        db_file = await self.file_service.finalize_dataset_upload(
+            db, session.user_id, session.filename, incoming_path, session.size, digest, session.node, stats
+        )
+        db.delete(session)
+        db.commit()
+        return db_file
+
+    async def abort(self, db: Session, session: UploadSessionDB):
+        """取消上传，删除远程暂存目录"""
+        try:
+            await AsyncSSHService(session.node).execute_command(f"rm -rf {shlex.quote(session.staging_dir)}")
+        except Exception as e:
+            logger.warning(f"[文件服务] 删除暂存目录失败: {session.staging_dir}, 错误: {str(e)}")
+        db.delete(session)
+        db.commit()
+        logger.info(f"[文件服务] 已取消分块上传，上传ID: {session.upload_id}")
+
+    async def _purge_expired(self, db: Session, user_id: str):
+        """清理该用户超过 upload_session_ttl_hours 未完成的上传会话（正在合并的会话不清理）"""
+        cutoff = datetime.utcnow() - timedelta(hours=settings.upload_session_ttl_hours)
+        expired = db.query(UploadSessionDB).filter(
+            UploadSessionDB.user_id == user_id,
+            UploadSessionDB.created_at < cutoff,
+            UploadSessionDB.status != COMPLETING
+        ).all()
+        for session in expired:
+            logger.info(f"[文件服务] 清理过期的分块上传，上传ID: {session.upload_id}")
+            await self.abort(db, session)
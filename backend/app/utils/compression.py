@@ -0,0 +1,62 @@
+import logging
+import zlib
+from functools import lru_cache
+from typing import Optional
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class TransferCodec:
+    """传输压缩方式：本地的流式压缩/解压对象，以及远程对应的解压/压缩命令"""
+
+    def __init__(self, name: str, level: int):
+        self.name = name
+        self.level = level
+
+    def compressor(self):
+        """返回带 compress(data) / flush() 方法的流式压缩对象"""
+        if self.name == "zstd":
+            import zstandard
+            return zstandard.ZstdCompressor(level=self.level).compressobj()
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)  # wbits=31: gzip 格式
+
+    def decompressor(self):
+        """返回带 decompress(data) 方法的流式解压对象"""
+        if self.name == "zstd":
+            import zstandard
+            return zstandard.ZstdDecompressor().decompressobj()
+        return zlib.decompressobj(31)
+
+    @property
+    def remote_decompress(self) -> str:
+        return f"{self.name} -dc"
+
+    @property
+    def remote_compress(self) -> str:
+        return f"{self.name} -c -{self.level}"
+
+
+@lru_cache(maxsize=1)
+def _zstd_available() -> bool:
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        logger.warning("[传输压缩] 未安装 zstandard，改用 gzip")
+        return False
+    return True
+
+def get_transfer_codec() -> Optional[TransferCodec]:
+    """
+    按 transfer_compression 配置返回传输压缩方式，未启用时返回 None
+    zstd 需要安装 zstandard，未安装时退回 gzip
+    """
+    name = (settings.transfer_compression or "").strip().lower()
+    if not name:
+        return None
+    if name == "zstd" and not _zstd_available():
+        name = "gzip"
+    if name not in ("gzip", "zstd"):
+        logger.warning(f"[传输压缩] 不支持的压缩方式: {name}，不压缩")
+        return None
+    default_level = 3 if name == "zstd" else 6
+    return TransferCodec(name, settings.transfer_compression_level or default_level)
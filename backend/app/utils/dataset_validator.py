@@ -0,0 +1,397 @@
+import codecs
+import json
+import os
+import random
+import re
+from typing import AsyncIterator, Dict, List, Optional
+from app.config import settings
+
+# 每个字段保留的长度样本数（蓄水池抽样，用于估计分位数，内存占用固定）
+LENGTH_SAMPLE_SIZE = 4096
+# 统计信息中保留的无效记录示例数
+MAX_ERROR_SAMPLES = 10
+# 需要校验的文件扩展名（其他格式不校验）
+VALIDATED_EXTENSIONS = (".json", ".jsonl")
+
+# JSON 数组扫描：字符串外只关心括号、引号和逗号，字符串内只关心引号和转义符
+_ARRAY_TOKENS = re.compile(r'[\[\]{}",]')
+_STRING_TOKENS = re.compile(r'["\\]')
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+
+# sharegpt 格式的角色
+_SHAREGPT_USER_ROLES = ("human", "user", "observation")
+_SHAREGPT_ASSISTANT_ROLES = ("gpt", "assistant", "function_call")
+
+
+class DatasetValidationError(ValueError):
+    """数据集格式错误或无效记录过多"""
+
+
+class _LengthStats:
+    """字段长度统计：最小/最大/平均值精确计算，分位数由固定大小的蓄水池样本估计"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._sample: List[int] = []
+        self._random = random.Random(0)
+
+    def add(self, length: int):
+        self.count += 1
+        self.total += length
+        self.min = length if self.min is None else min(self.min, length)
+        self.max = length if self.max is None else max(self.max, length)
+        if len(self._sample) < LENGTH_SAMPLE_SIZE:
+            self._sample.append(length)
+        else:
+            i = self._random.randrange(self.count)
+            if i < LENGTH_SAMPLE_SIZE:
+                self._sample[i] = length
+
+    def summary(self) -> Dict:
+        sample = sorted(self._sample)
+
+        def percentile(p: float) -> int:
+            return sample[min(len(sample) - 1, int(p * len(sample)))]
+
+        return {
+            "min": self.min,
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "max": self.max,
+            "mean": round(self.total / self.count, 1)
+        }
+
+
+class DatasetValidator:
+    """
+    流式校验数据集（JSON 数组或 JSONL）：按数据块增量解析，逐条校验 alpaca / sharegpt 格式并统计记录数、
+    无效记录数和各字段长度（字符数）的分位数，内存占用只与单条记录的大小有关。
+    文件结构错误（编码错误、JSON 数组不完整、单条记录过大）在 feed 中立即抛出 DatasetValidationError，
+    上传可以尽早中止；无效记录只计数，全部读完后由 check 按 dataset_max_invalid_ratio 判断是否拒绝
+    用法: validator = DatasetValidator(filename)
+          validator.feed(chunk) ...
+          stats = validator.finish(); validator.check()
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.format: Optional[str] = None  # "alpaca" / "sharegpt"，由第一条可识别的记录决定
+        self.records = 0
+        self.invalid = 0
+        self.errors: List[Dict] = []
+        self.lengths: Dict[str, _LengthStats] = {}
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._mode: Optional[str] = None  # "array" / "lines"
+        # JSON 数组解析状态（位置均相对于 _buffer）：完整的记录直接解码，
+        # 跨数据块或不是有效 JSON 的记录逐个括号扫描找到结尾
+        self._json_decoder = json.JSONDecoder()
+        self._pos = 0
+        self._start = 0
+        self._scanning = False
+        self._depth = 0
+        self._in_string = False
+        self._after_element = False
+        self._array_closed = False
+
+    @staticmethod
+    def applies_to(filename: str) -> bool:
+        """是否需要校验该文件（启用了 dataset_validation 且是 JSON / JSONL 文件）"""
+        return settings.dataset_validation and os.path.splitext(filename)[1].lower() in VALIDATED_EXTENSIONS
+
+    def feed(self, chunk: bytes):
+        """解析一块文件内容"""
+        try:
+            text = self._decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise DatasetValidationError("数据集不是有效的 UTF-8 编码")
+        self._process(text, final=False)
+
+    def finish(self) -> Dict:
+        """文件读完后调用，返回统计信息"""
+        try:
+            text = self._decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            raise DatasetValidationError("数据集不是有效的 UTF-8 编码")
+        self._process(text, final=True)
+        if self._mode == "array" and not self._array_closed:
+            raise DatasetValidationError("JSON 数组不完整（缺少结尾的 ]）")
+        return self.stats()
+
+    def stats(self) -> Dict:
+        return {
+            "format": self.format,
+            "records": self.records,
+            "invalid": self.invalid,
+            "lengths": {name: stats.summary() for name, stats in self.lengths.items()},
+            "errors": self.errors
+        }
+
+    def check(self):
+        """没有有效记录或无效记录比例超过 dataset_max_invalid_ratio 时抛出 DatasetValidationError"""
+        if self.records - self.invalid <= 0:
+            raise DatasetValidationError(f"数据集中没有有效记录{self._error_summary()}")
+        if self.invalid > self.records * settings.dataset_max_invalid_ratio:
+            raise DatasetValidationError(
+                f"数据集校验失败: {self.invalid}/{self.records} 条记录无效{self._error_summary()}"
+            )
+
+    def _error_summary(self) -> str:
+        if not self.errors:
+            return ""
+        return "（" + "；".join(f"第 {e['index'] + 1} 条: {e['error']}" for e in self.errors[:3]) + "）"
+
+    def _process(self, text: str, final: bool):
+        if self._mode is None:
+            self._buffer += text
+            stripped = self._buffer.lstrip("\ufeff \t\r\n")
+            if not stripped:
+                return
+            # 以 [ 开头的是 JSON 数组，否则按 JSONL 逐行解析
+            if stripped[0] == "[":
+                self._mode = "array"
+                self._buffer = stripped[1:]
+            else:
+                self._mode = "lines"
+                self._buffer = stripped
+            text = ""
+        if self._mode == "array":
+            self._scan_array(text, final)
+        else:
+            self._scan_lines(text, final)
+        # 按 UTF-8 字节数限制；一个字符最多 4 字节，字符数足够小时不需要编码计算
+        limit = settings.dataset_max_record_bytes
+        if len(self._buffer) * 4 > limit and len(self._buffer.encode("utf-8")) > limit:
+            raise DatasetValidationError(f"单条记录超过 {limit} 字节")
+
+    def _scan_lines(self, text: str, final: bool):
+        self._buffer += text
+        lines = self._buffer.split("\n")
+        self._buffer = "" if final else lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line:
+                self._record(line)
+
+    def _scan_array(self, text: str, final: bool):
+        if self._array_closed:
+            if text.strip():
+                raise DatasetValidationError("JSON 数组结束后还有多余的内容")
+            return
+        buf = self._buffer + text
+        pos = self._pos
+        while True:
+            if self._scanning:
+                # 慢速路径：逐个括号扫描，找到当前记录的结尾（记录跨数据块或不是有效的 JSON 时）
+                end = self._scan_element(buf, pos, final)
+                if end is None:
+                    pos = self._pos
+                    break
+                self._record(buf[self._start:end].strip())
+                self._scanning = False
+                self._after_element = True
+                self._start = pos = end
+                continue
+
+            pos = _WHITESPACE.match(buf, self._start).end()
+            if pos >= len(buf):
+                break
+            char = buf[pos]
+            if self._after_element:
+                if char == ",":
+                    self._after_element = False
+                    self._start = pos + 1
+                    continue
+                if char != "]":
+                    raise DatasetValidationError(f"JSON 数组格式错误（第 {self.records} 条记录之后缺少逗号）")
+            if char == "]":
+                if self.records and not self._after_element:
+                    raise DatasetValidationError("JSON 数组格式错误（多余的逗号）")
+                self._array_closed = True
+                if buf[pos + 1:].strip():
+                    raise DatasetValidationError("JSON 数组结束后还有多余的内容")
+                self._buffer = ""
+                self._pos = self._start = 0
+                return
+            if char == ",":
+                raise DatasetValidationError("JSON 数组格式错误（多余的逗号）")
+            # 快速路径：直接解码一条完整的记录
+            # 解码结果之后必须紧跟逗号或 ]，否则（如 2.5x）按慢速路径作为一条无效记录处理
+            try:
+                record, end = self._json_decoder.raw_decode(buf, pos)
+                next_pos = _WHITESPACE.match(buf, end).end()
+                if next_pos < len(buf):
+                    if buf[next_pos] not in ",]":
+                        raise ValueError
+                elif not final and not isinstance(record, (dict, list, str)):
+                    # 数字等可能只收到了一部分（如数据块在 "2." 或 "1e" 处截断）
+                    raise ValueError
+            except ValueError:
+                self._scanning = True
+                self._start = pos
+                self._depth = 0
+                self._in_string = False
+                continue
+            self._add_record(record)
+            self._after_element = True
+            self._start = end
+        # 只保留当前未完成的记录
+        self._buffer = buf[self._start:]
+        self._pos = max(pos - self._start, 0)
+        self._start = 0
+
+    def _scan_element(self, buf: str, pos: int, final: bool) -> Optional[int]:
+        """
+        从 pos 继续扫描当前记录，返回记录结尾（数组中下一个逗号或 ]）的位置；
+        数据不够时返回 None，下次从 self._pos 继续扫描
+        """
+        while True:
+            if self._in_string:
+                match = _STRING_TOKENS.search(buf, pos)
+                if not match:
+                    self._pos = len(buf)
+                    return None
+                if match.group() == "\\":
+                    if match.end() >= len(buf) and not final:
+                        # 转义符后的字符还没收到
+                        self._pos = match.start()
+                        return None
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                continue
+
+            match = _ARRAY_TOKENS.search(buf, pos)
+            if not match:
+                self._pos = len(buf)
+                return None
+            token = match.group()
+            pos = match.end()
+            if token == '"':
+                self._in_string = True
+            elif token in "[{":
+                self._depth += 1
+            elif token in "]}" and self._depth > 0:
+                self._depth -= 1
+            elif token in ",]" and self._depth == 0:
+                return match.start()
+
+    def _record(self, text: str):
+        try:
+            record = json.loads(text)
+        except ValueError:
+            self._add_invalid("不是有效的 JSON")
+            return
+        self._add_record(record)
+
+    def _add_record(self, record):
+        error = self._check_record(record)
+        if error:
+            self._add_invalid(error)
+        else:
+            self.records += 1
+
+    def _add_invalid(self, error: str):
+        if len(self.errors) < MAX_ERROR_SAMPLES:
+            self.errors.append({"index": self.records, "error": error})
+        self.records += 1
+        self.invalid += 1
+
+    def _add_length(self, name: str, length: int):
+        if name not in self.lengths:
+            self.lengths[name] = _LengthStats()
+        self.lengths[name].add(length)
+
+    def _check_record(self, record) -> Optional[str]:
+        """校验一条记录，有效时记录字段长度并返回 None，无效时返回原因"""
+        if not isinstance(record, dict):
+            return "记录必须是 JSON 对象"
+        if "conversations" in record or "messages" in record:
+            record_format = "sharegpt"
+        elif "instruction" in record or "output" in record:
+            record_format = "alpaca"
+        else:
+            return "无法识别的格式（需要 alpaca 的 instruction / output 或 sharegpt 的 conversations / messages 字段）"
+        if self.format is None:
+            self.format = record_format
+        elif record_format != self.format:
+            return f"格式（{record_format}）与前面的记录（{self.format}）不一致"
+        if record_format == "alpaca":
+            return self._check_alpaca(record)
+        return self._check_sharegpt(record)
+
+    def _check_alpaca(self, record: Dict) -> Optional[str]:
+        instruction = record.get("instruction", "")
+        input_text = record.get("input", "")
+        output = record.get("output")
+        if not isinstance(instruction, str) or not isinstance(input_text, str):
+            return "instruction 和 input 必须是字符串"
+        # output 为列表时是偏好数据（chosen / rejected）
+        outputs = output if isinstance(output, list) else [output]
+        if not outputs or not all(isinstance(o, str) and o for o in outputs):
+            return "缺少 output 或 output 为空"
+        history = record.get("history", [])
+        if not isinstance(history, list) or not all(
+            isinstance(turn, list) and len(turn) == 2 and all(isinstance(t, str) for t in turn) for turn in history
+        ):
+            return "history 必须是 [问题, 回答] 组成的列表"
+        self._add_length("instruction", len(instruction))
+        self._add_length("input", len(input_text))
+        self._add_length("output", max(len(o) for o in outputs))
+        return None
+
+    def _check_sharegpt(self, record: Dict) -> Optional[str]:
+        key = "conversations" if "conversations" in record else "messages"
+        turns = record.get(key)
+        if not isinstance(turns, list) or not turns:
+            return f"{key} 必须是非空列表"
+        prompt_length = response_length = 0
+        position = 0
+        for i, turn in enumerate(turns):
+            if not isinstance(turn, dict):
+                return f"{key} 的第 {i + 1} 项必须是对象"
+            role = turn.get("from", turn.get("role"))
+            content = turn.get("value", turn.get("content"))
+            if not isinstance(content, str):
+                return f"{key} 的第 {i + 1} 项缺少内容"
+            if role == "system" and i == 0:
+                continue
+            # 用户和助手的消息必须交替出现，以用户开始
+            expected = _SHAREGPT_USER_ROLES if position % 2 == 0 else _SHAREGPT_ASSISTANT_ROLES
+            if role not in expected:
+                return f"{key} 的第 {i + 1} 项角色不正确: {role}"
+            if position % 2 == 0:
+                prompt_length += len(content)
+            else:
+                response_length += len(content)
+            position += 1
+        if position == 0 or position % 2 != 0:
+            return f"{key} 必须以助手的回答结束"
+        self._add_length("turns", position)
+        self._add_length("prompt", prompt_length)
+        self._add_length("response", response_length)
+        return None
+
+
+async def validate_stream(validator: DatasetValidator, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """边转发数据块边校验（用于流式上传，文件结构错误时中止上传）"""
+    async for chunk in chunks:
+        validator.feed(chunk)
+        yield chunk
+
+def validate_local_file(filename: str, file_path: str) -> Optional[Dict]:
+    """校验本地数据集文件，返回统计信息（不需要校验的文件返回 None）；校验不通过时抛出 DatasetValidationError"""
+    if not DatasetValidator.applies_to(filename):
+        return None
+    validator = DatasetValidator(filename)
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            validator.feed(block)
+    stats = validator.finish()
+    validator.check()
+    return stats
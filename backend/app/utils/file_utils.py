@@ -1,5 +1,8 @@
 import os
-from typing import Optional
+import hashlib
+from collections import deque
+from typing import AsyncIterator, Optional
+from multipart.multipart import MultipartParser, parse_options_header
 
 def get_file_size(file_path: str) -> int:
     """获取文件大小（字节）"""
@@ -9,3 +12,123 @@ def ensure_dir(dir_path: str):
     """确保目录存在"""
     os.makedirs(dir_path, exist_ok=True)
 
+def trim_incomplete_utf8(data: bytes) -> bytes:
+    """去掉末尾不完整的 UTF-8 多字节字符（按字节区间读取文件时使用，被截断的字符留到下次读取）"""
+    # 从末尾向前最多检查3个字节，找到最后一个字符的起始字节
+    for i in range(1, min(4, len(data)) + 1):
+        byte = data[-i]
+        if byte & 0b11000000 != 0b10000000:
+            # 起始字节：根据高位判断该字符应有的长度
+            if byte & 0b10000000 == 0:
+                expected = 1
+            elif byte & 0b11100000 == 0b11000000:
+                expected = 2
+            elif byte & 0b11110000 == 0b11100000:
+                expected = 3
+            else:
+                expected = 4
+            return data if i >= expected else data[:-i]
+    return data
+
+
+def file_sha256(file_path: str) -> str:
+    """计算本地文件的 SHA-256（分块读取）"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class UploadTooLargeError(ValueError):
+    """上传内容超过 max_upload_size"""
+
+
+class MultipartFileReader:
+    """
+    流式解析 multipart/form-data 请求体，只取出名为 field_name 的文件字段
+    请求体按到达的数据块逐块解析，文件内容不在内存或本地磁盘中整体缓存
+    用法: reader = MultipartFileReader(content_type, request.stream())
+          filename = await reader.read_header()
+          async for chunk in reader.chunks(): ...
+    """
+
+    def __init__(self, content_type: Optional[str], body: AsyncIterator[bytes], field_name: str = "file"):
+        media_type, params = parse_options_header(content_type or "")
+        boundary = params.get(b"boundary")
+        if media_type != b"multipart/form-data" or not boundary:
+            raise ValueError("请求必须是 multipart/form-data 格式")
+        self.field_name = field_name
+        self.filename: Optional[str] = None
+        self._body = body.__aiter__()
+        self._pending: deque = deque()
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._file_done = False
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = params.get(b"name", b"").decode("utf-8", errors="replace")
+        if name == self.field_name and b"filename" in params and self.filename is None:
+            self.filename = params[b"filename"].decode("utf-8", errors="replace")
+            self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._pending.append(bytes(data[start:end]))
+
+    def _on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+
+    async def _feed(self) -> bool:
+        """解析下一块请求体，请求体已结束时返回 False"""
+        try:
+            chunk = await self._body.__anext__()
+        except StopAsyncIteration:
+            return False
+        if chunk:
+            self._parser.write(chunk)
+        return True
+
+    async def read_header(self) -> str:
+        """读取到文件字段的头部为止，返回文件名；请求中没有该文件字段时抛出 ValueError"""
+        while self.filename is None:
+            if not await self._feed():
+                raise ValueError(f"请求中缺少文件字段: {self.field_name}")
+        return self.filename
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """逐块产出文件内容，直到文件字段结束"""
+        while True:
+            while self._pending:
+                yield self._pending.popleft()
+            if self._file_done:
+                return
+            if not await self._feed():
+                raise ValueError("请求体不完整")
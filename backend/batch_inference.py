@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+离线批量推理脚本
+读取 JSON / JSONL 提示文件，模型只加载一次，按 --batch-size 分批生成，
+结果逐条追加写入 JSONL 输出文件，每批结束后更新进度文件（已完成数、tokens/秒）。
+输出文件中已有结果时从断点继续，不重复生成。
+复用同目录下 inference_worker.py 的 MultiLoraEngine（一次 generate 生成一批对话）。
+
+输入（JSON 数组或 JSONL，每条记录为以下格式之一）:
+    {"messages": [{"role": "user", "content": "..."}]}
+    {"prompt": "..."}
+    {"instruction": "...", "input": "...", "system": "..."}       （alpaca 格式数据集）
+    {"conversations": [{"from": "human", "value": "..."}]}        （sharegpt 格式数据集）
+    记录中的 id 字段原样写入结果；alpaca 的 output 字段作为 reference 写入结果，便于对比
+
+输出（JSONL，每行一条）:
+    {"index": 0, "id": ..., "output": "...", "prompt_tokens": 12, "completion_tokens": 34,
+     "finish_reason": "stop", "reference": "..."}
+    无法解析的记录输出 {"index": 0, "error": "..."}
+
+进度文件（JSON，原子替换写入）:
+    {"status": "running|completed|failed", "total": 100, "completed": 40,
+     "prompt_tokens": ..., "completion_tokens": ..., "tokens_per_second": 812.5,
+     "elapsed_seconds": 12.3, "error": "..."}
+
+使用方法:
+    python3 batch_inference.py --base-model /path/base --adapter /path/adapter --template qwen2 \
+        --input prompts.jsonl --output results.jsonl --progress progress.json \
+        --batch-size 32 --max-tokens 512 --temperature 0
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from inference_worker import MultiLoraEngine, build_gen_kwargs
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    stream=sys.stderr
+)
+
+logger = logging.getLogger("batch_inference")
+
+# sharegpt 格式的角色名
+SHAREGPT_ROLES = {"human": "user", "user": "user", "gpt": "assistant", "assistant": "assistant", "system": "system"}
+
+def load_records(path: str) -> List:
+    """读取 JSON 数组或 JSONL 文件"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def to_messages(record) -> List[Dict]:
+    """把一条输入记录转换为对话消息；最后一条消息必须是用户消息"""
+    if isinstance(record, str):
+        return [{"role": "user", "content": record}]
+    if not isinstance(record, dict):
+        raise ValueError("记录必须是对象或字符串")
+
+    if record.get("messages"):
+        messages = [{"role": m["role"], "content": m["content"]} for m in record["messages"]]
+    elif record.get("conversations"):
+        messages = [
+            {"role": SHAREGPT_ROLES.get(m.get("from"), m.get("from")), "content": m.get("value", "")}
+            for m in record["conversations"]
+        ]
+        if record.get("system"):
+            messages.insert(0, {"role": "system", "content": record["system"]})
+    elif record.get("instruction") or record.get("prompt"):
+        content = record.get("instruction") or record.get("prompt")
+        if record.get("input"):
+            content = f"{content}\n{record['input']}"
+        messages = [{"role": "user", "content": content}]
+        if record.get("system"):
+            messages.insert(0, {"role": "system", "content": record["system"]})
+    else:
+        raise ValueError("未找到 messages / conversations / instruction / prompt 字段")
+
+    # 数据集中的参考回复不作为输入
+    while messages and messages[-1]["role"] == "assistant":
+        messages.pop()
+    if not messages or messages[-1]["role"] != "user":
+        raise ValueError("缺少用户消息")
+    return messages
+
+def reference_of(record) -> Optional[str]:
+    """数据集中的参考回复（alpaca 的 output 或 sharegpt / messages 的最后一条助手消息）"""
+    if not isinstance(record, dict):
+        return None
+    if isinstance(record.get("output"), str):
+        return record["output"]
+    turns = record.get("messages") or record.get("conversations") or []
+    if turns:
+        last = turns[-1]
+        role = last.get("role") or SHAREGPT_ROLES.get(last.get("from"))
+        if role == "assistant":
+            return last.get("content", last.get("value"))
+    return None
+
+def count_lines(path: str) -> int:
+    """已写入的结果条数（断点续跑），末尾不完整的行会被截掉"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        data = f.read()
+    complete = data.rfind(b"\n") + 1
+    if complete < len(data):
+        with open(path, "r+b") as f:
+            f.truncate(complete)
+    return data[:complete].count(b"\n")
+
+def write_progress(path: str, progress: Dict):
+    """原子写入进度文件，读取方不会读到写了一半的内容"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(progress, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量推理")
+    parser.add_argument("--base-model", required=True, help="基础模型路径")
+    parser.add_argument("--adapter", default=None, help="LoRA adapter 路径（为空时使用基础模型）")
+    parser.add_argument("--template", default="qwen2", help="对话模板")
+    parser.add_argument("--input", required=True, help="提示文件（JSON / JSONL）")
+    parser.add_argument("--output", required=True, help="结果文件（JSONL）")
+    parser.add_argument("--progress", required=True, help="进度文件（JSON）")
+    parser.add_argument("--batch-size", type=int, default=16, help="每批生成的条数")
+    parser.add_argument("--max-tokens", type=int, default=512, help="每条最多生成的 token 数")
+    parser.add_argument("--temperature", type=float, default=0.0, help="采样温度（<=0 为贪心解码）")
+    args = parser.parse_args()
+
+    progress = {"status": "running", "total": 0, "completed": 0, "prompt_tokens": 0,
+                "completion_tokens": 0, "tokens_per_second": 0.0, "elapsed_seconds": 0.0}
+    write_progress(args.progress, progress)
+    try:
+        records = load_records(args.input)
+        done = count_lines(args.output)
+        progress.update(total=len(records), completed=min(done, len(records)))
+        write_progress(args.progress, progress)
+        logger.info(f"[批量推理] 共 {len(records)} 条，已完成 {done} 条")
+
+        engine = MultiLoraEngine(args.base_model, args.template, max_adapters=1)
+        gen_kwargs = build_gen_kwargs({"temperature": args.temperature, "max_tokens": args.max_tokens})
+        batch_size = max(args.batch_size, 1)
+        start = time.monotonic()
+
+        with open(args.output, "a", encoding="utf-8") as out:
+            for batch_start in range(done, len(records), batch_size):
+                batch = list(enumerate(records[batch_start:batch_start + batch_size], start=batch_start))
+                rows: Dict[int, Dict] = {}
+                items = []
+                for index, record in batch:
+                    try:
+                        items.append((index, to_messages(record)))
+                    except (ValueError, KeyError, TypeError) as e:
+                        rows[index] = {"index": index, "error": str(e)}
+
+                if items:
+                    results = engine.chat_batch(args.adapter, [(messages, gen_kwargs) for _, messages in items])
+                    for (index, _), result in zip(items, results):
+                        rows[index] = {
+                            "index": index,
+                            "output": result["content"],
+                            "prompt_tokens": result["prompt_tokens"],
+                            "completion_tokens": result["completion_tokens"],
+                            "finish_reason": result["finish_reason"],
+                        }
+                        progress["prompt_tokens"] += result["prompt_tokens"]
+                        progress["completion_tokens"] += result["completion_tokens"]
+
+                for index, record in batch:
+                    row = rows[index]
+                    if isinstance(record, dict) and "id" in record:
+                        row["id"] = record["id"]
+                    reference = reference_of(record)
+                    if reference is not None and "error" not in row:
+                        row["reference"] = reference
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                out.flush()
+
+                elapsed = time.monotonic() - start
+                progress.update(
+                    completed=batch_start + len(batch),
+                    elapsed_seconds=round(elapsed, 2),
+                    tokens_per_second=round(progress["completion_tokens"] / elapsed, 2) if elapsed > 0 else 0.0
+                )
+                write_progress(args.progress, progress)
+                logger.info(f"[批量推理] 进度 {progress['completed']}/{progress['total']}, "
+                            f"{progress['tokens_per_second']} tokens/s")
+
+        progress["status"] = "completed"
+        write_progress(args.progress, progress)
+        logger.info("[批量推理] 完成")
+    except Exception as e:
+        logger.error(f"[批量推理] 失败: {str(e)}", exc_info=True)
+        progress.update(status="failed", error=str(e))
+        write_progress(args.progress, progress)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -7,15 +7,31 @@ LlamaFactory CLI 对话包装脚本
     python3 chat_cli_wrapper.py '{"base_model_path": "...", "adapter_path": "...", "template": "qwen2", "message": "你好"}'
 
 输出: JSON格式 {"role": "assistant", "content": "..."}
+
+JSON lines 模式（--jsonl）:
+    不启动 llamafactory-cli，直接在进程内调用 LlamaFactory 的 ChatModel，
+    从 stdin 逐行读取请求、向 stdout 逐行写出响应，不需要等待提示符和用正则提取回复
+
+    python3 chat_cli_wrapper.py --jsonl [--max-models 1] < requests.jsonl
+
+    请求: {"id": "...", "base_model_path": "...", "adapter_path": "...", "template": "qwen2",
+           "messages": [{"role": "user", "content": "你好"}], "temperature": 0.7, "max_tokens": 2048}
+    响应: {"id": "...", "type": "result", "role": "assistant", "content": "..."}
+          {"id": "...", "type": "error", "error": "..."}
+
+    stdout 只用于输出响应，模型加载等过程中的其他输出都被重定向到 stderr；
+    同一进程内相同 (基础模型, adapter, 模板) 的请求复用已加载的模型，最多保留 --max-models 个（默认 1），
+    超出时卸载最久未使用的模型并释放显存；stdin 结束后退出
 """
 
+import os
 import sys
 import json
-import pexpect
 import logging
 import re
 import base64
-from typing import Dict
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
 # 配置日志（输出到stderr，避免干扰JSON输出）
 logging.basicConfig(
@@ -114,6 +130,8 @@ def extract_assistant_response(output: str) -> str:
 
 def chat_with_cli(config: Dict) -> Dict:
     """使用pexpect与llamafactory-cli chat交互"""
+    import pexpect
+
     base_model_path = config.get("base_model_path")
     adapter_path = config.get("adapter_path")
     template = config.get("template", "qwen2")
@@ -212,8 +230,112 @@ def chat_with_cli(config: Dict) -> Dict:
         raise Exception(f"执行失败: {str(e)}")
 
 
+def build_gen_kwargs(request: Dict) -> Dict:
+    """把请求中的生成参数转换为 ChatModel.chat 参数（temperature<=0 表示贪心解码）"""
+    gen_kwargs = {}
+    temperature = request.get("temperature")
+    if temperature is not None:
+        if temperature <= 0:
+            gen_kwargs["do_sample"] = False
+        else:
+            gen_kwargs["temperature"] = temperature
+    if request.get("max_tokens"):
+        gen_kwargs["max_new_tokens"] = request["max_tokens"]
+    return gen_kwargs
+
+
+def split_messages(request: Dict) -> Tuple[Optional[str], List[Dict]]:
+    """取出 system 消息，其余消息作为对话历史；兼容只有 message 字段的旧格式请求"""
+    messages = request.get("messages") or []
+    if not messages and request.get("message"):
+        messages = [{"role": "user", "content": request["message"]}]
+    system = "\n".join(m["content"] for m in messages if m.get("role") == "system") or None
+    history = [{"role": m["role"], "content": m["content"]} for m in messages if m.get("role") != "system"]
+    return system, history
+
+
+def load_chat_model(base_model_path: str, adapter_path: Optional[str], template: str):
+    """在进程内加载 LlamaFactory ChatModel（与 llamafactory-cli chat 使用相同的参数）"""
+    from llamafactory.chat import ChatModel
+
+    args = {
+        "model_name_or_path": base_model_path,
+        "template": template,
+        "infer_backend": "huggingface",
+    }
+    if adapter_path:
+        args["adapter_name_or_path"] = adapter_path
+        args["finetuning_type"] = "lora"
+    return ChatModel(args)
+
+
+def release_memory():
+    """卸载模型后释放显存缓存"""
+    import gc
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+def serve_jsonl(max_models: int = 1):
+    """JSON lines 模式：逐行处理 stdin 上的请求，每个请求在 stdout 上输出一行响应"""
+    # 保留原 stdout 专门输出响应，其余输出（包括C扩展直接写 fd 1 的内容）全部转到 stderr
+    out = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    # 按最近使用顺序保存已加载的模型
+    models: "OrderedDict[Tuple[str, str, str], object]" = OrderedDict()
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("请求必须是JSON对象")
+            request_id = request.get("id")
+            base_model_path = request.get("base_model_path")
+            adapter_path = request.get("adapter_path") or ""
+            template = request.get("template") or "qwen2"
+            system, history = split_messages(request)
+            if not base_model_path or not history:
+                raise ValueError("缺少必要参数: base_model_path, messages")
+
+            key = (base_model_path, adapter_path, template)
+            if key in models:
+                models.move_to_end(key)
+            else:
+                # 先卸载最久未使用的模型再加载，避免同时占用两份显存
+                while models and len(models) >= max(max_models, 1):
+                    old_key, old_model = models.popitem(last=False)
+                    logger.info(f"卸载模型: {old_key}")
+                    del old_model
+                    release_memory()
+                logger.info(f"加载模型: {key}")
+                models[key] = load_chat_model(base_model_path, adapter_path or None, template)
+            responses = models[key].chat(history, system=system, **build_gen_kwargs(request))
+            content = responses[0].response_text if responses else ""
+            response = {"id": request_id, "type": "result", "role": "assistant", "content": content}
+        except Exception as e:
+            logger.error(f"请求处理失败: {str(e)}")
+            response = {"id": request_id, "type": "error", "error": str(e)}
+        out.write(json.dumps(response, ensure_ascii=False) + "\n")
+
+
 def main():
     """主函数"""
+    if len(sys.argv) > 1 and sys.argv[1] == "--jsonl":
+        max_models = 1
+        if "--max-models" in sys.argv:
+            max_models = int(sys.argv[sys.argv.index("--max-models") + 1])
+        serve_jsonl(max_models)
+        return
+
     try:
         # 从命令行参数读取配置
         if len(sys.argv) < 2:
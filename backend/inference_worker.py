@@ -0,0 +1,889 @@
+#!/usr/bin/env python3
+"""
+LlamaFactory 常驻推理进程
+由后端通过一条长期保持的 SSH channel 启动，模型和 adapter 加载后常驻显存，
+后续对话只需生成时间，不再为每条消息重新加载模型。
+
+协议（JSON lines，每行一个 JSON 对象）:
+    stdin  请求: {"id": "...", "op": "chat", "base_model_path": "...", "adapter_path": "...",
+                  "template": "qwen2", "messages": [...], "temperature": 0.7, "max_tokens": 2048,
+                  "stream": false, "session_id": "<可选，会话标识>"}
+                 {"id": "...", "op": "cancel", "target": "<要取消的请求id>"}
+                 {"id": "...", "op": "end_session", "session_id": "..."}
+                 {"id": "...", "op": "ping"} / {"id": "...", "op": "stats"}
+    stdout 响应: {"id": "...", "type": "delta", "content": "..."}   （stream=true 时逐段输出）
+                 {"id": "...", "type": "result", "content": "...", "usage": {...}}
+                 {"id": "...", "type": "error", "error": "..."}
+    启动完成后先输出一行 {"type": "ready"}
+
+动态批处理（multi_lora 引擎）:
+    同一 (基础模型, adapter, 模板) 的并发非流式请求在 --batch-wait-ms 窗口内合并为一批（最多 --max-batch-size 个），
+    一次 generate 生成；每个请求的 temperature 和 max_tokens 分别生效。GPU 忙时到达的请求会自动并入下一批
+
+对话会话（multi_lora 引擎）:
+    带 session_id 的请求在生成后保留整段对话的 KV cache（最多 --max-sessions 个会话，LRU 淘汰），
+    下一轮的输入与缓存的 token 序列取公共前缀，只对新增的 token 做 prefill。
+    对话超过上下文长度（--max-context-tokens，0 表示模型的 max_position_embeddings）时，
+    从最早的轮次开始丢弃历史（system 消息和最后一条消息始终保留）
+
+使用方法:
+    python3 inference_worker.py --max-models 2 --memory-budget-mb 20000 --idle-timeout 1800
+    python3 inference_worker.py --engine multi_lora --max-adapters 16   # 多个LoRA共享一个基础模型
+    python3 inference_worker.py --engine multi_lora --max-batch-size 8 --batch-wait-ms 20
+"""
+
+import sys
+import json
+import time
+import queue
+import hashlib
+import argparse
+import contextlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 配置日志（输出到stderr，stdout只用于协议消息）
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    stream=sys.stderr
+)
+
+logger = logging.getLogger("inference_worker")
+
+_write_lock = threading.Lock()
+
+def send(message: Dict):
+    """向 stdout 写一行协议消息（多线程安全）"""
+    line = json.dumps(message, ensure_ascii=False)
+    with _write_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+def cuda_memory_mb() -> float:
+    """当前进程已分配的显存（MB），无GPU时返回0"""
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return torch.cuda.memory_allocated() / 1024 / 1024
+    except ImportError:
+        pass
+    return 0.0
+
+def release_memory():
+    """卸载模型后释放显存缓存"""
+    import gc
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+class RequestCancelled(Exception):
+    """请求已被后端取消（如客户端断开了流式连接）"""
+
+
+# 流式输出回调：收到新生成的文本时调用；请求被取消时抛出 RequestCancelled
+DeltaCallback = Optional[Callable[[str], None]]
+
+
+def build_gen_kwargs(request: Dict) -> Dict:
+    """把请求中的生成参数转换为 generate 参数（temperature<=0 表示贪心解码）"""
+    gen_kwargs = {}
+    temperature = request.get("temperature")
+    if temperature is not None:
+        if temperature <= 0:
+            gen_kwargs["do_sample"] = False
+        else:
+            gen_kwargs["do_sample"] = True
+            gen_kwargs["temperature"] = temperature
+    if request.get("max_tokens"):
+        gen_kwargs["max_new_tokens"] = request["max_tokens"]
+    return gen_kwargs
+
+def split_messages(messages: List[Dict]) -> Tuple[Optional[str], List[Dict]]:
+    """system 消息单独取出，其余消息按顺序作为对话历史"""
+    system = "\n".join(m["content"] for m in messages if m.get("role") == "system") or None
+    history = [{"role": m["role"], "content": m["content"]} for m in messages if m.get("role") != "system"]
+    return system, history
+
+
+class LlamaFactoryEngine:
+    """一个 (基础模型, adapter) 组合对应一个 LlamaFactory ChatModel，adapter 合入模型常驻"""
+
+    # ChatModel 每次只能生成一个对话，请求逐个执行
+    supports_batch = False
+
+    def __init__(self, base_model_path: str, adapter_path: Optional[str], template: str):
+        from llamafactory.chat import ChatModel
+        args = {
+            "model_name_or_path": base_model_path,
+            "template": template,
+            "infer_backend": "huggingface",
+        }
+        if adapter_path:
+            args["adapter_name_or_path"] = adapter_path
+            args["finetuning_type"] = "lora"
+        self.chat_model = ChatModel(args)
+
+    @staticmethod
+    def cache_key(base_model_path: str, adapter_path: Optional[str], template: str) -> Tuple[str, str, str]:
+        return (base_model_path, adapter_path or "", template)
+
+    def chat(self, adapter_path: Optional[str], messages: List[Dict], gen_kwargs: Dict,
+             on_delta: DeltaCallback = None, session_id: Optional[str] = None) -> Dict:
+        # ChatModel 不暴露 KV cache，会话请求每轮重新编码完整历史
+        system, history = split_messages(messages)
+        if on_delta is not None:
+            pieces = []
+            for new_text in self.chat_model.stream_chat(history, system=system, **gen_kwargs):
+                if new_text:
+                    pieces.append(new_text)
+                    on_delta(new_text)
+            content = "".join(pieces)
+            tokenizer = getattr(getattr(self.chat_model, "engine", None), "tokenizer", None)
+            return {
+                "content": content,
+                "prompt_tokens": 0,  # stream_chat 不返回输入长度
+                "completion_tokens": len(tokenizer.encode(content, add_special_tokens=False)) if tokenizer else len(pieces),
+                "finish_reason": "stop",
+            }
+        response = self.chat_model.chat(history, system=system, **gen_kwargs)[0]
+        return {
+            "content": response.response_text,
+            "prompt_tokens": response.prompt_length,
+            "completion_tokens": response.response_length,
+            "finish_reason": response.finish_reason,
+        }
+
+    def stats(self) -> Dict:
+        return {}
+
+
+class ChatSession:
+    """一个对话会话保留的 KV cache 及其对应的 token 序列"""
+
+    def __init__(self, adapter_path: str, token_ids: List[int], past_key_values):
+        self.adapter_path = adapter_path
+        self.token_ids = token_ids
+        self.past_key_values = past_key_values
+
+
+class MultiLoraEngine:
+    """
+    一个常驻基础模型服务多个 LoRA adapter：adapter 按需加载到同一个 PeftModel 上，
+    每个请求切换到对应 adapter（adapter_path 为空时关闭 adapter 使用基础模型），
+    显存随 adapter 数量增长，而不是随完整模型副本数增长。
+    使用 tokenizer 自带的对话模板（chat_template）构造输入。
+    """
+
+    supports_batch = True
+
+    def __init__(self, base_model_path: str, template: str, max_adapters: int,
+                 max_sessions: int = 16, max_context_tokens: int = 0):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        self.base_model_path = base_model_path
+        self.template = template
+        self.max_adapters = max(max_adapters, 1)
+        self.tokenizer = AutoTokenizer.from_pretrained(base_model_path, trust_remote_code=True)
+        self.model = AutoModelForCausalLM.from_pretrained(
+            base_model_path,
+            torch_dtype="auto",
+            device_map="auto" if torch.cuda.is_available() else None,
+            trust_remote_code=True
+        )
+        self.model.eval()
+        # adapter_path -> adapter 名称，按最近使用顺序排列
+        self.adapters: "OrderedDict[str, str]" = OrderedDict()
+        self.adapter_memory_mb: Dict[str, float] = {}
+        self.adapter_loads = 0
+        self.adapter_evictions = 0
+        # 会话 -> 保留的 KV cache，按最近使用顺序排列
+        self.sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self.max_sessions = max_sessions
+        model_window = getattr(getattr(self.model, "config", None), "max_position_embeddings", None) or 0
+        self.context_limit = min(v for v in (max_context_tokens, model_window, 1 << 30) if v > 0)
+        self.session_hits = 0
+        self.reused_tokens = 0
+        self.trimmed_messages = 0
+
+    @staticmethod
+    def cache_key(base_model_path: str, adapter_path: Optional[str], template: str) -> Tuple[str, str, str]:
+        # 同一基础模型的所有 adapter 共享一个缓存项
+        return (base_model_path, "", template)
+
+    @staticmethod
+    def adapter_name(adapter_path: str) -> str:
+        # adapter 名称会作为模块属性名，使用路径哈希避免特殊字符
+        return "lora_" + hashlib.sha1(adapter_path.encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def memory_mb(self) -> float:
+        """已加载 adapter 占用的显存（基础模型的占用由缓存在加载时记录）"""
+        return sum(self.adapter_memory_mb.values())
+
+    def _activate(self, adapter_path: str):
+        """加载（如未加载）并切换到 adapter，超出数量上限时卸载最久未使用的 adapter"""
+        from peft import PeftModel
+        name = self.adapter_name(adapter_path)
+        if adapter_path in self.adapters:
+            self.adapters.move_to_end(adapter_path)
+        else:
+            while len(self.adapters) >= self.max_adapters:
+                old_path, old_name = self.adapters.popitem(last=False)
+                self.model.delete_adapter(old_name)
+                self.adapter_memory_mb.pop(old_path, None)
+                self.adapter_evictions += 1
+                logger.info(f"卸载adapter(数量上限): {old_path}")
+                release_memory()
+            logger.info(f"加载adapter: {adapter_path}")
+            before_mb = cuda_memory_mb()
+            if isinstance(self.model, PeftModel):
+                self.model.load_adapter(adapter_path, adapter_name=name)
+            else:
+                self.model = PeftModel.from_pretrained(self.model, adapter_path, adapter_name=name)
+                self.model.eval()
+            self.adapters[adapter_path] = name
+            self.adapter_memory_mb[adapter_path] = cuda_memory_mb() - before_mb
+            self.adapter_loads += 1
+        self.model.set_adapter(name)
+
+    def _adapter_context(self, adapter_path: Optional[str]):
+        from peft import PeftModel
+        if adapter_path:
+            self._activate(adapter_path)
+            return contextlib.nullcontext()
+        if isinstance(self.model, PeftModel):
+            return self.model.disable_adapter()
+        return contextlib.nullcontext()
+
+    def _generate_streaming(self, generate_kwargs: Dict, on_delta: Callable[[str], None]):
+        """在后台线程中生成，当前线程逐段转发新文本；回调抛出异常（请求取消）时停止生成"""
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        stop_event = threading.Event()
+
+        class _StopOnCancel(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return stop_event.is_set()
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        result: Dict = {}
+
+        def run():
+            try:
+                with torch.no_grad():
+                    result["output"] = self.model.generate(
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([_StopOnCancel()]),
+                        **generate_kwargs
+                    )
+            except Exception as e:
+                result["error"] = e
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            for text in streamer:
+                if text:
+                    on_delta(text)
+        finally:
+            stop_event.set()
+            thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["output"]
+
+    def _encode(self, messages: List[Dict], max_new_tokens: int) -> List[int]:
+        """
+        用对话模板编码消息；输入加上生成长度超过上下文上限时，从最早的轮次开始丢弃历史，
+        system 消息和最后一条消息始终保留
+        """
+        input_ids = self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=True)
+        budget = self.context_limit - max_new_tokens
+        if len(input_ids) <= budget:
+            return input_ids
+        system = [m for m in messages if m.get("role") == "system"]
+        turns = [m for m in messages if m.get("role") != "system"]
+        dropped = 0
+        while len(input_ids) > budget and len(turns) > 1:
+            turns.pop(0)
+            dropped += 1
+            # 保证历史以 user 消息开头
+            while len(turns) > 1 and turns[0].get("role") != "user":
+                turns.pop(0)
+                dropped += 1
+            input_ids = self.tokenizer.apply_chat_template(system + turns, add_generation_prompt=True, tokenize=True)
+        if len(input_ids) > budget:
+            raise ValueError(f"消息过长: {len(input_ids)} tokens，上下文上限 {self.context_limit}，生成长度 {max_new_tokens}")
+        logger.info(f"对话超过上下文上限，丢弃最早的 {dropped} 条消息")
+        self.trimmed_messages += dropped
+        return input_ids
+
+    def _take_session_cache(self, session_id: Optional[str], adapter_path: Optional[str], input_ids: List[int]):
+        """
+        取出会话的 KV cache 并裁剪到与本轮输入的公共前缀（至少留一个新 token 给 prefill）
+        取出后会话从表中移除，生成成功后再放回；生成失败时 cache 可能已被修改，直接丢弃
+        """
+        session = self.sessions.pop(session_id, None) if session_id else None
+        if session is None or session.adapter_path != (adapter_path or ""):
+            return None
+        common = 0
+        for cached, current in zip(session.token_ids, input_ids):
+            if cached != current:
+                break
+            common += 1
+        common = min(common, len(input_ids) - 1)
+        if common <= 0:
+            return None
+        session.past_key_values.crop(common)
+        self.session_hits += 1
+        self.reused_tokens += common
+        logger.info(f"会话 {session_id} 复用 {common}/{len(input_ids)} 个token的KV cache")
+        return session.past_key_values
+
+    def _save_session(self, session_id: str, adapter_path: Optional[str], sequence: List[int], past_key_values):
+        # 只有可裁剪的 Cache 对象（DynamicCache）才能在下一轮按公共前缀复用
+        if past_key_values is None or not hasattr(past_key_values, "crop"):
+            return
+        cached_length = past_key_values.get_seq_length()
+        self.sessions[session_id] = ChatSession(adapter_path or "", sequence[:cached_length], past_key_values)
+        while len(self.sessions) > self.max_sessions:
+            old_id, _ = self.sessions.popitem(last=False)
+            logger.info(f"释放会话KV cache(数量上限): {old_id}")
+
+    def end_session(self, session_id: str) -> bool:
+        return self.sessions.pop(session_id, None) is not None
+
+    def chat(self, adapter_path: Optional[str], messages: List[Dict], gen_kwargs: Dict,
+             on_delta: DeltaCallback = None, session_id: Optional[str] = None) -> Dict:
+        import torch
+        max_new_tokens = gen_kwargs.get("max_new_tokens") or 512
+        input_ids = self._encode(messages, max_new_tokens)
+        inputs = torch.tensor([input_ids], device=self.model.device)
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        generate_kwargs = {
+            **gen_kwargs,
+            "max_new_tokens": max_new_tokens,
+            "input_ids": inputs,
+            "attention_mask": torch.ones_like(inputs),
+            "pad_token_id": pad_token_id,
+        }
+        if session_id:
+            past_key_values = self._take_session_cache(session_id, adapter_path, input_ids)
+            if past_key_values is not None:
+                generate_kwargs["past_key_values"] = past_key_values
+            generate_kwargs["return_dict_in_generate"] = True
+        with self._adapter_context(adapter_path):
+            if on_delta is not None:
+                output = self._generate_streaming(generate_kwargs, on_delta)
+            else:
+                with torch.no_grad():
+                    output = self.model.generate(**generate_kwargs)
+        if session_id:
+            sequence = output.sequences[0].tolist()
+            self._save_session(session_id, adapter_path, sequence, getattr(output, "past_key_values", None))
+            output = output.sequences
+        new_tokens = output[0][len(input_ids):].tolist()
+        return {
+            "content": self.tokenizer.decode(new_tokens, skip_special_tokens=True),
+            "prompt_tokens": len(input_ids),
+            "completion_tokens": len(new_tokens),
+            "finish_reason": "length" if len(new_tokens) >= max_new_tokens else "stop",
+        }
+
+    def _eos_token_ids(self) -> set:
+        eos = getattr(getattr(self.model, "generation_config", None), "eos_token_id", None)
+        ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+        ids.add(self.tokenizer.eos_token_id)
+        ids.discard(None)
+        return ids
+
+    def chat_batch(self, adapter_path: Optional[str], items: List[Tuple[List[Dict], Dict]]) -> List[Dict]:
+        """
+        一次 generate 生成一批对话（输入左侧补齐），items 为 [(messages, gen_kwargs), ...]
+        每行按各自的 temperature 采样（temperature<=0 的行只保留最大概率的 token，即贪心解码），
+        批内按最大的 max_new_tokens 生成，结果再按各自的 max_new_tokens 和结束符截断
+        """
+        import torch
+        from transformers import LogitsProcessor, LogitsProcessorList
+
+        prompts = [self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=True)
+                   for messages, _ in items]
+        max_tokens = [gen_kwargs.get("max_new_tokens") or 512 for _, gen_kwargs in items]
+        default_sample = bool(getattr(getattr(self.model, "generation_config", None), "do_sample", False))
+        temperatures = [
+            gen_kwargs.get("temperature", 1.0) if gen_kwargs.get("do_sample", default_sample) else 0.0
+            for _, gen_kwargs in items
+        ]
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+        width = max(len(prompt) for prompt in prompts)
+        inputs = torch.tensor([[pad_token_id] * (width - len(p)) + p for p in prompts], device=self.model.device)
+        attention_mask = torch.tensor([[0] * (width - len(p)) + [1] * len(p) for p in prompts], device=self.model.device)
+        generate_kwargs = {
+            "input_ids": inputs,
+            "attention_mask": attention_mask,
+            "pad_token_id": pad_token_id,
+            "max_new_tokens": max(max_tokens),
+        }
+
+        if any(t > 0 for t in temperatures):
+            class _RowTemperature(LogitsProcessor):
+                def __call__(self, input_ids, scores):
+                    for row, temperature in enumerate(temperatures):
+                        if temperature > 0:
+                            scores[row] = scores[row] / temperature
+                        else:
+                            best = scores[row].argmax()
+                            greedy = torch.full_like(scores[row], float("-inf"))
+                            greedy[best] = scores[row][best]
+                            scores[row] = greedy
+                    return scores
+
+            generate_kwargs.update(do_sample=True, temperature=1.0,
+                                   logits_processor=LogitsProcessorList([_RowTemperature()]))
+        else:
+            generate_kwargs["do_sample"] = False
+
+        with self._adapter_context(adapter_path):
+            with torch.no_grad():
+                output = self.model.generate(**generate_kwargs)
+
+        eos_ids = self._eos_token_ids()
+        results = []
+        for row, prompt in enumerate(prompts):
+            tokens = output[row][width:].tolist()[:max_tokens[row]]
+            # 其他行仍在生成时，已结束的行后面会补 pad，截断到第一个结束符
+            end = next((i for i, token in enumerate(tokens) if token in eos_ids), None)
+            results.append({
+                "content": self.tokenizer.decode(tokens[:end], skip_special_tokens=True),
+                "prompt_tokens": len(prompt),
+                "completion_tokens": len(tokens) if end is None else end + 1,
+                "finish_reason": "stop" if end is not None or len(tokens) < max_tokens[row] else "length",
+            })
+        return results
+
+    def stats(self) -> Dict:
+        return {
+            "adapters": list(self.adapters),
+            "adapter_loads": self.adapter_loads,
+            "adapter_evictions": self.adapter_evictions,
+            "sessions": len(self.sessions),
+            "session_hits": self.session_hits,
+            "reused_tokens": self.reused_tokens,
+            "trimmed_messages": self.trimmed_messages,
+        }
+
+
+ENGINES = {
+    "llamafactory": LlamaFactoryEngine,
+    "multi_lora": MultiLoraEngine,
+}
+
+
+class ResidentModel:
+    """一个常驻的推理引擎（llamafactory 引擎为一个 (基础模型, adapter)，multi_lora 引擎为一个基础模型）"""
+
+    def __init__(self, key: Tuple[str, str, str], engine, memory_mb: float):
+        self.key = key
+        self.engine = engine
+        self.load_memory_mb = memory_mb  # 加载时占用的显存
+        self.last_used = time.monotonic()
+        self.requests = 0
+
+    @property
+    def memory_mb(self) -> float:
+        return self.load_memory_mb + getattr(self.engine, "memory_mb", 0.0)
+
+
+class ModelCache:
+    """
+    常驻模型缓存：按最近使用顺序（LRU）淘汰
+    - max_models: 最多同时常驻的模型数
+    - memory_budget_mb: 显存预算，加载新模型前淘汰最久未使用的模型直到预算足够（0表示不限制）
+    - idle_timeout: 超过该时间未使用的模型自动卸载（0表示不卸载）
+    - engine: llamafactory（每个adapter一个完整模型）或 multi_lora（同一基础模型共享，adapter按需切换）
+    """
+
+    def __init__(self, max_models: int, memory_budget_mb: int, idle_timeout: int,
+                 engine: str = "llamafactory", max_adapters: int = 8,
+                 max_sessions: int = 16, max_context_tokens: int = 0):
+        self.max_models = max(max_models, 1)
+        self.memory_budget_mb = memory_budget_mb
+        self.idle_timeout = idle_timeout
+        self.engine = engine
+        self.engine_cls = ENGINES[engine]
+        self.max_adapters = max_adapters
+        self.max_sessions = max_sessions
+        self.max_context_tokens = max_context_tokens
+        self._models: "OrderedDict[Tuple[str, str, str], ResidentModel]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _used_memory_mb(self) -> float:
+        return sum(m.memory_mb for m in self._models.values())
+
+    def _evict_one(self, reason: str):
+        """卸载最久未使用的模型（调用方需持有锁）"""
+        key, model = self._models.popitem(last=False)
+        logger.info(f"卸载模型({reason}): {key}, 显存约 {model.memory_mb:.0f}MB")
+        del model
+        self.evictions += 1
+        release_memory()
+
+    def _make_room(self, expected_mb: float):
+        while self._models and len(self._models) >= self.max_models:
+            self._evict_one("数量上限")
+        if self.memory_budget_mb > 0:
+            while self._models and self._used_memory_mb() + expected_mb > self.memory_budget_mb:
+                self._evict_one("显存预算")
+
+    def _create_engine(self, base_model_path: str, adapter_path: Optional[str], template: str):
+        if self.engine_cls is MultiLoraEngine:
+            return MultiLoraEngine(base_model_path, template, self.max_adapters,
+                                   self.max_sessions, self.max_context_tokens)
+        return LlamaFactoryEngine(base_model_path, adapter_path, template)
+
+    def get(self, base_model_path: str, adapter_path: Optional[str], template: str) -> ResidentModel:
+        """
+        获取常驻模型，未加载时加载（加载前按策略淘汰）
+        只在推理线程中调用；锁只保护缓存结构，加载期间不持有
+        """
+        key = self.engine_cls.cache_key(base_model_path, adapter_path, template)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                model.last_used = time.monotonic()
+                self.hits += 1
+                return model
+
+            self.misses += 1
+            # 预估新模型占用与已加载的同基础模型相同（首次加载无法预估，按0处理）
+            expected_mb = max((m.load_memory_mb for k, m in self._models.items() if k[0] == base_model_path), default=0.0)
+            self._make_room(expected_mb)
+
+        logger.info(f"加载模型: {key}, 引擎: {self.engine}")
+        start = time.monotonic()
+        before_mb = cuda_memory_mb()
+        engine = self._create_engine(base_model_path, adapter_path, template)
+        model = ResidentModel(key, engine, cuda_memory_mb() - before_mb)
+        with self._lock:
+            self._models[key] = model
+        logger.info(f"模型加载完成，耗时 {time.monotonic() - start:.1f}秒，显存约 {model.memory_mb:.0f}MB")
+        return model
+
+    def evict_idle(self):
+        """卸载空闲超时的模型"""
+        if self.idle_timeout <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            for key in [k for k, m in self._models.items() if now - m.last_used > self.idle_timeout]:
+                model = self._models.pop(key)
+                logger.info(f"卸载模型(空闲超时): {key}")
+                del model
+                self.evictions += 1
+                release_memory()
+
+    def end_session(self, session_id: str) -> bool:
+        """释放会话的 KV cache"""
+        with self._lock:
+            engines = [m.engine for m in self._models.values()]
+        return any([e.end_session(session_id) for e in engines if hasattr(e, "end_session")])
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "engine": self.engine,
+                "models": [
+                    {
+                        "base_model_path": k[0],
+                        "adapter_path": k[1] or None,
+                        "template": k[2],
+                        "memory_mb": round(m.memory_mb),
+                        "requests": m.requests,
+                        "idle_seconds": round(time.monotonic() - m.last_used),
+                        **m.engine.stats(),
+                    }
+                    for k, m in self._models.items()
+                ],
+                "memory_mb": round(self._used_memory_mb()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def format_result(result: Dict, generation_seconds: float) -> Dict:
+    return {
+        "content": result["content"],
+        "usage": {
+            "prompt_tokens": result["prompt_tokens"],
+            "completion_tokens": result["completion_tokens"],
+            "total_tokens": result["prompt_tokens"] + result["completion_tokens"],
+        },
+        "finish_reason": result["finish_reason"],
+        "generation_seconds": round(generation_seconds, 3),
+    }
+
+
+def handle_chat(cache: ModelCache, request: Dict, on_delta: DeltaCallback = None) -> Dict:
+    """执行一次对话推理；on_delta 不为空时流式输出"""
+    base_model_path = request.get("base_model_path")
+    messages = request.get("messages") or []
+    if not base_model_path or not messages:
+        raise ValueError("缺少必要参数: base_model_path, messages")
+
+    adapter_path = request.get("adapter_path")
+    model = cache.get(base_model_path, adapter_path, request.get("template") or "qwen2")
+    start = time.monotonic()
+    result = model.engine.chat(adapter_path, messages, build_gen_kwargs(request), on_delta, request.get("session_id"))
+    model.requests += 1
+    model.last_used = time.monotonic()
+    return format_result(result, time.monotonic() - start)
+
+
+def handle_chat_batch(cache: ModelCache, requests: List[Dict]) -> List[Dict]:
+    """一次生成同一 (基础模型, adapter, 模板) 的一批对话请求（由 RequestBatcher 分组）"""
+    first = requests[0]
+    adapter_path = first.get("adapter_path")
+    model = cache.get(first["base_model_path"], adapter_path, first.get("template") or "qwen2")
+    start = time.monotonic()
+    results = model.engine.chat_batch(
+        adapter_path,
+        [(request["messages"], build_gen_kwargs(request)) for request in requests]
+    )
+    model.requests += len(requests)
+    model.last_used = time.monotonic()
+    elapsed = time.monotonic() - start
+    return [format_result(result, elapsed) for result in results]
+
+
+class RequestBatcher:
+    """
+    把对话请求分组成批：取出最早的请求后，在 batch_wait_ms 窗口内收集同一 (基础模型, adapter, 模板) 的
+    非流式请求（最多 max_batch_size 个），交给 process 执行；其他请求保持到达顺序留给后续批次。
+    process 在推理线程中执行完成后才组下一批，GPU 忙时到达的请求自然并入下一批。
+    流式请求和不支持批量生成的引擎每批只有一个请求。
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, process: Callable[[List[Dict]], None],
+                 supports_batch: bool, max_batch_size: int, batch_wait_ms: int):
+        self.executor = executor
+        self.process = process
+        self.max_batch_size = max(max_batch_size, 1) if supports_batch else 1
+        self.batch_wait = max(batch_wait_ms, 0) / 1000
+        self._queue: "queue.Queue[Dict]" = queue.Queue()
+        self._pending: deque = deque()
+        self.batches = 0
+        self.batched_requests = 0
+        self.max_batch_seen = 0
+
+    @staticmethod
+    def batch_key(request: Dict) -> Optional[Tuple[str, str, str]]:
+        """可以合并的请求返回分组键，不能合并的返回 None"""
+        # 会话请求各自复用自己的 KV cache，不参与合并
+        if request.get("stream") or request.get("session_id") or not request.get("base_model_path") or not request.get("messages"):
+            return None
+        return (request["base_model_path"], request.get("adapter_path") or "", request.get("template") or "qwen2")
+
+    def submit(self, request: Dict):
+        self._queue.put(request)
+
+    def start(self):
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def _next_batch(self) -> List[Dict]:
+        if not self._pending:
+            self._pending.append(self._queue.get())
+        first = self._pending.popleft()
+        key = self.batch_key(first)
+        batch = [first]
+        if key is None or self.max_batch_size <= 1:
+            return batch
+
+        for request in list(self._pending):
+            if len(batch) >= self.max_batch_size:
+                return batch
+            if self.batch_key(request) == key:
+                self._pending.remove(request)
+                batch.append(request)
+
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if self.batch_key(request) == key:
+                batch.append(request)
+            else:
+                self._pending.append(request)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            self.batches += 1
+            self.batched_requests += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.executor.submit(self.process, batch).result()
+
+    def stats(self) -> Dict:
+        return {
+            "batches": self.batches,
+            "batched_requests": self.batched_requests,
+            "max_batch_size": self.max_batch_seen,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LlamaFactory 常驻推理进程")
+    parser.add_argument("--max-models", type=int, default=2, help="最多同时常驻的模型数")
+    parser.add_argument("--memory-budget-mb", type=int, default=0, help="常驻模型显存预算（MB），0表示不限制")
+    parser.add_argument("--idle-timeout", type=int, default=1800, help="模型空闲多久后卸载（秒），0表示不卸载")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="llamafactory",
+                        help="llamafactory: 每个adapter一个完整模型；multi_lora: 同一基础模型共享，adapter按需切换")
+    parser.add_argument("--max-adapters", type=int, default=8, help="multi_lora 引擎每个基础模型最多常驻的adapter数")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="动态批处理每批最多的请求数，1表示不合并")
+    parser.add_argument("--batch-wait-ms", type=int, default=20, help="组批时等待同模型请求的最长时间（毫秒）")
+    parser.add_argument("--max-sessions", type=int, default=16, help="multi_lora 引擎保留KV cache的最大会话数")
+    parser.add_argument("--max-context-tokens", type=int, default=0, help="对话上下文token上限，0表示使用模型的上下文长度")
+    args = parser.parse_args()
+
+    cache = ModelCache(args.max_models, args.memory_budget_mb, args.idle_timeout, args.engine, args.max_adapters,
+                       args.max_sessions, args.max_context_tokens)
+    # GPU上的推理串行执行；主线程只负责读取请求，不被推理阻塞
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    # 已接收但尚未完成的请求id，以及其中已被取消的请求id（流式请求的客户端断开后，后端发送 cancel）
+    # 只记录未完成请求的取消，请求结束时一并移除，两个集合都不会无限增长
+    inflight = set()
+    cancelled = set()
+    requests_lock = threading.Lock()
+
+    def finish(request_id):
+        with requests_lock:
+            inflight.discard(request_id)
+            cancelled.discard(request_id)
+
+    def is_cancelled(request_id) -> bool:
+        # 取消标记由读取 stdin 的主线程写入，推理线程读取时同样持有锁
+        with requests_lock:
+            return request_id in cancelled
+
+    def run_batch(requests: List[Dict]):
+        if len(requests) == 1:
+            run(requests[0])
+            return
+        for request in [r for r in requests if is_cancelled(r.get("id"))]:
+            logger.info(f"请求已取消: {request.get('id')}")
+            finish(request.get("id"))
+            requests.remove(request)
+        if not requests:
+            return
+        try:
+            results = handle_chat_batch(cache, requests)
+        except Exception as e:
+            logger.error(f"批量推理失败: {str(e)}", exc_info=True)
+            for request in requests:
+                send({"id": request.get("id"), "type": "error", "error": str(e)})
+                finish(request.get("id"))
+            return
+        logger.info(f"批量推理完成: {len(requests)} 个请求")
+        for request, result in zip(requests, results):
+            # 批量生成期间被取消的请求不再返回结果
+            if is_cancelled(request.get("id")):
+                logger.info(f"请求已取消: {request.get('id')}")
+            else:
+                send({"id": request.get("id"), "type": "result", "batch_size": len(requests), **result})
+            finish(request.get("id"))
+
+    batcher = RequestBatcher(executor, run_batch, cache.engine_cls.supports_batch,
+                             args.max_batch_size, args.batch_wait_ms)
+
+    def run(request: Dict):
+        request_id = request.get("id")
+        try:
+            op = request.get("op", "chat")
+            if op == "chat":
+                on_delta = None
+                if request.get("stream"):
+                    def on_delta(text: str):
+                        if is_cancelled(request_id):
+                            raise RequestCancelled()
+                        send({"id": request_id, "type": "delta", "content": text})
+                if is_cancelled(request_id):
+                    raise RequestCancelled()
+                result = handle_chat(cache, request, on_delta)
+            elif op == "end_session":
+                result = {"released": cache.end_session(request.get("session_id"))}
+            elif op == "stats":
+                result = {**cache.stats(), **batcher.stats()}
+            elif op == "ping":
+                result = {}
+            else:
+                raise ValueError(f"未知操作: {op}")
+            send({"id": request_id, "type": "result", **result})
+        except RequestCancelled:
+            logger.info(f"请求已取消: {request_id}")
+        except Exception as e:
+            logger.error(f"请求处理失败: {str(e)}", exc_info=True)
+            send({"id": request_id, "type": "error", "error": str(e)})
+        finally:
+            finish(request_id)
+
+    def idle_checker():
+        while True:
+            time.sleep(60)
+            executor.submit(cache.evict_idle)
+
+    threading.Thread(target=idle_checker, daemon=True).start()
+    batcher.start()
+    send({"type": "ready"})
+
+    # stdin 关闭（后端断开 channel）时退出，常驻模型随进程释放
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            send({"type": "error", "error": f"JSON解析失败: {str(e)}"})
+            continue
+        if request.get("op") == "cancel":
+            with requests_lock:
+                if request.get("target") in inflight:
+                    cancelled.add(request.get("target"))
+            continue
+        if request.get("op") == "ping":
+            # 不排在推理后面，立即响应
+            run(request)
+            continue
+        with requests_lock:
+            inflight.add(request.get("id"))
+        if request.get("op", "chat") == "chat":
+            batcher.submit(request)
+        else:
+            # stats 也在推理线程中执行：引擎的 adapter / 会话表只在推理线程中修改
+            executor.submit(run, request)
+
+    executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+import os
+import sys
+
+# 单元测试不连接远程服务器，只需要满足 Settings 的必填项
+os.environ.setdefault("SSH_HOST", "127.0.0.1")
+os.environ.setdefault("SSH_USERNAME", "test")
+os.environ.setdefault("REMOTE_WORK_DIR", "/remote/work")
+os.environ.setdefault("REMOTE_USER_DATA_DIR", "/remote/users")
+os.environ.setdefault("CHAT_SCRIPT_PATH", "chat_cli_wrapper.py")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+
+# 让测试可以导入 app 包和 backend 下的远程脚本（inference_worker.py 等）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import asyncssh
+
+from app.services.async_ssh_service import AsyncSSHConnectionPool
+
+
+class FakeConnection:
+    """模拟 asyncssh 连接：alive=False 时探活命令失败"""
+
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.runs = 0
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    async def run(self, command, check=False):
+        self.runs += 1
+        if not self.alive:
+            raise asyncssh.ConnectionLost("connection lost")
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(conns, **kwargs):
+    pool = AsyncSSHConnectionPool("host", 22, "user", health_check_idle=60, **kwargs)
+    queue = list(conns)
+
+    async def fake_connect():
+        return queue.pop(0)
+
+    pool._connect = fake_connect
+    return pool
+
+
+def test_recently_used_connection_is_reused_without_probe():
+    conn = FakeConnection()
+    pool = make_pool([conn])
+
+    async def scenario():
+        pc = await pool.acquire()
+        await pool.release(pc)
+        return await pool.acquire()
+
+    pc = asyncio.run(scenario())
+    assert pc.conn is conn
+    assert conn.runs == 0
+
+
+def test_idle_connection_is_probed_before_reuse():
+    conn = FakeConnection()
+    pool = make_pool([conn])
+
+    async def scenario():
+        pc = await pool.acquire()
+        await pool.release(pc)
+        pc.last_used = time.monotonic() - 120
+        return await pool.acquire()
+
+    pc = asyncio.run(scenario())
+    assert pc.conn is conn
+    assert conn.runs == 1
+
+
+def test_dead_idle_connection_is_replaced():
+    dead, fresh = FakeConnection(), FakeConnection()
+    pool = make_pool([dead, fresh])
+
+    async def scenario():
+        pc = await pool.acquire()
+        await pool.release(pc)
+        dead.alive = False
+        pc.last_used = time.monotonic() - 120
+        return await pool.acquire()
+
+    pc = asyncio.run(scenario())
+    assert pc.conn is fresh
+    assert dead.closed
+    assert [c.conn for c in pool._conns] == [fresh]
@@ -0,0 +1,91 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+from app.config import settings
+from app.services import batch_inference_service
+from app.services.batch_inference_service import BatchInferenceService
+
+
+@pytest.fixture
+def results_file(monkeypatch):
+    """用内存中的字节代替远程结果文件"""
+    content = {"data": b""}
+
+    class FakeSSHService:
+        def __init__(self, node=None):
+            pass
+
+        async def read_file_range(self, file_path, offset, limit):
+            data = content["data"]
+            return data[offset:offset + limit], offset, len(data)
+
+    monkeypatch.setattr(batch_inference_service, "AsyncSSHService", FakeSSHService)
+    monkeypatch.setattr(settings, "task_log_max_read_bytes", 16)
+    return content
+
+
+def read(offset=0, limit=None):
+    job = SimpleNamespace(node=None, output_dir="/out")
+    return asyncio.run(BatchInferenceService().read_results(job, offset, limit))
+
+
+def line(index, text):
+    return (json.dumps({"index": index, "content": text}) + "\n").encode()
+
+
+def test_read_results_returns_complete_lines_only(results_file):
+    results_file["data"] = line(0, "a") + line(1, "b")[:5]
+    page = read(limit=1000)
+    assert [r["index"] for r in page["results"]] == [0]
+    assert page["next_offset"] == len(line(0, "a"))
+
+
+def test_read_results_reads_past_limit_for_long_line(results_file):
+    results_file["data"] = line(0, "x" * 100) + line(1, "y")
+    page = read(limit=8)
+    assert [r["index"] for r in page["results"]] == [0]
+    assert page["next_offset"] == len(line(0, "x" * 100))
+    page = read(page["next_offset"])
+    assert [r["index"] for r in page["results"]] == [1]
+
+
+def test_read_results_waits_for_unfinished_long_line(results_file):
+    results_file["data"] = line(0, "x" * 100)[:-10]
+    page = read()
+    assert page["results"] == []
+    assert page["next_offset"] == 0
+
+
+def test_read_results_skips_and_reports_malformed_lines(results_file, monkeypatch):
+    monkeypatch.setattr(settings, "task_log_max_read_bytes", 1000)
+    broken = b'{"index": 1, "content": "tru\n'
+    results_file["data"] = line(0, "a") + broken + b"[1]\n" + line(3, "d")
+    page = read(limit=1000)
+    assert [r["index"] for r in page["results"]] == [0, 3]
+    assert page["invalid_lines"] == [len(line(0, "a")), len(line(0, "a")) + len(broken)]
+    assert page["next_offset"] == len(results_file["data"])
+
+
+@pytest.mark.parametrize("status, error, expected", [
+    ("running", FileNotFoundError("missing"), 409),
+    ("completed", FileNotFoundError("missing"), 404),
+    ("completed", Exception("connection lost"), 500),
+])
+def test_results_endpoint_reports_read_failures(monkeypatch, status, error, expected):
+    from fastapi import HTTPException
+    from app.routers import batch_inference as router
+
+    class FakeService:
+        def get_job(self, db, job_id, user_id):
+            return SimpleNamespace(job_id=job_id, status=status)
+
+        async def read_results(self, job, offset, limit):
+            raise error
+
+    monkeypatch.setattr(router, "BatchInferenceService", FakeService)
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(router.get_batch_inference_results(
+            "j1", offset=0, limit=None, current_user=SimpleNamespace(user_id="u1"), db=None
+        ))
+    assert exc_info.value.status_code == expected
@@ -0,0 +1,32 @@
+from chat_cli_wrapper import build_gen_kwargs, split_messages
+
+
+def test_build_gen_kwargs_maps_sampling_parameters():
+    assert build_gen_kwargs({}) == {}
+    assert build_gen_kwargs({"temperature": 0.7, "max_tokens": 128}) == {"temperature": 0.7, "max_new_tokens": 128}
+
+
+def test_build_gen_kwargs_uses_greedy_decoding_for_zero_temperature():
+    assert build_gen_kwargs({"temperature": 0}) == {"do_sample": False}
+    assert build_gen_kwargs({"temperature": -1, "max_tokens": 0}) == {"do_sample": False}
+
+
+def test_split_messages_extracts_system_prompts():
+    system, history = split_messages({"messages": [
+        {"role": "system", "content": "你是助手"},
+        {"role": "user", "content": "你好", "name": "ignored"},
+        {"role": "assistant", "content": "你好！"},
+        {"role": "system", "content": "简短回答"},
+        {"role": "user", "content": "再见"},
+    ]})
+    assert system == "你是助手\n简短回答"
+    assert history == [
+        {"role": "user", "content": "你好"},
+        {"role": "assistant", "content": "你好！"},
+        {"role": "user", "content": "再见"},
+    ]
+
+
+def test_split_messages_accepts_legacy_single_message():
+    assert split_messages({"message": "你好"}) == (None, [{"role": "user", "content": "你好"}])
+    assert split_messages({}) == (None, [])
@@ -0,0 +1,49 @@
+import socket
+import pytest
+from app.config import settings
+from app.services.chat_job_service import validate_webhook_url
+
+
+@pytest.fixture
+def resolve_to(monkeypatch):
+    """让主机名解析到指定地址"""
+    def configure(*addresses):
+        monkeypatch.setattr(socket, "getaddrinfo", lambda host, port, **kwargs: [
+            (socket.AF_INET6 if ":" in a else socket.AF_INET, socket.SOCK_STREAM, 6, "", (a, port)) for a in addresses
+        ])
+    return configure
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://example.com/hook",
+    "http:///hook",
+    "http://127.0.0.1/hook",
+    "http://10.1.2.3:8080/hook",
+    "http://169.254.169.254/latest/meta-data",
+    "http://[::1]/hook",
+    "http://[::ffff:192.168.0.1]/hook",
+    "http://0.0.0.0/hook",
+])
+def test_rejects_non_http_and_internal_addresses(url):
+    with pytest.raises(ValueError):
+        validate_webhook_url(url, resolve=False)
+
+
+def test_accepts_public_address_without_resolving():
+    validate_webhook_url("https://93.184.216.34/hook", resolve=False)
+    validate_webhook_url("https://hooks.example.com/hook", resolve=False)
+
+
+def test_rejects_hostname_resolving_to_internal_address(resolve_to):
+    resolve_to("93.184.216.34", "192.168.1.10")
+    with pytest.raises(ValueError, match="内网"):
+        validate_webhook_url("https://hooks.example.com/hook")
+    resolve_to("93.184.216.34")
+    validate_webhook_url("https://hooks.example.com/hook")
+
+
+def test_allowed_hosts_override_address_checks(monkeypatch):
+    monkeypatch.setattr(settings, "chat_job_webhook_allowed_hosts", ["Internal.Service"])
+    validate_webhook_url("http://internal.service:9000/hook")
+    with pytest.raises(ValueError, match="允许列表"):
+        validate_webhook_url("https://93.184.216.34/hook")
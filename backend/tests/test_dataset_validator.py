@@ -0,0 +1,115 @@
+import json
+import pytest
+from app.config import settings
+from app.utils.dataset_validator import DatasetValidator, DatasetValidationError
+
+
+def validate(data, filename="data.json", step=None):
+    """分块喂入校验器，返回 (格式, 记录数, 无效记录数)"""
+    validator = DatasetValidator(filename)
+    raw = data.encode("utf-8") if isinstance(data, str) else data
+    step = step or len(raw) or 1
+    for i in range(0, len(raw), step):
+        validator.feed(raw[i:i + step])
+    stats = validator.finish()
+    return stats["format"], stats["records"], stats["invalid"]
+
+
+def split_everywhere(data: str, filename="data.json"):
+    """在每个字节位置切成两块，结果都应与整体校验相同"""
+    raw = data.encode("utf-8")
+    expected = validate(raw, filename)
+    for cut in range(1, len(raw)):
+        validator = DatasetValidator(filename)
+        validator.feed(raw[:cut])
+        validator.feed(raw[cut:])
+        stats = validator.finish()
+        assert (stats["format"], stats["records"], stats["invalid"]) == expected, f"切分位置 {cut}"
+    return expected
+
+
+ALPACA = [
+    {"instruction": f"问题 \"引号\" [括号] {{花括号}}, 逗号\\ {i}", "input": "", "output": f"回答{i}"}
+    for i in range(5)
+]
+
+
+@pytest.mark.parametrize("step", [1, 3, 7, None])
+def test_alpaca_array(step):
+    assert validate(json.dumps(ALPACA, ensure_ascii=False, indent=2), step=step) == ("alpaca", 5, 0)
+
+
+def test_jsonl_with_bom():
+    data = "﻿" + "\n".join(json.dumps(r, ensure_ascii=False) for r in ALPACA) + "\n"
+    assert validate(data, "data.jsonl", step=5) == ("alpaca", 5, 0)
+
+
+def test_sharegpt_records():
+    records = [
+        {"conversations": [{"from": "system", "value": "s"}, {"from": "human", "value": "hi"}, {"from": "gpt", "value": "yo"}]},
+        {"messages": [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}]},
+        {"conversations": [{"from": "human", "value": "a"}]},
+    ]
+    assert validate(json.dumps(records), step=2) == ("sharegpt", 3, 1)
+
+
+def test_invalid_records_are_counted():
+    records = ALPACA[:2] + [{"instruction": "x"}, "text", {"foo": 1}, {"conversations": []}]
+    assert validate(json.dumps(records)) == ("alpaca", 6, 4)
+
+
+@pytest.mark.parametrize("data", [
+    '[2.5, -0.25, 1e5, 3E-2, 10, true, null, "s", {"instruction": "a", "output": "b"}]',
+    '[ 12345.678e+9 ,\n 0 , {"instruction": "a", "output": "b"} ]',
+    '[{"instruction": "a", "output": "b"}, 2.5x, {"instruction": "c", "output": "d"}]',
+    '[{"instruction": "a\\"\\\\", "output": "b"} ,\n {"instruction": "c", "output": "d"} ]\n',
+])
+def test_chunk_boundaries_do_not_change_results(data):
+    split_everywhere(data)
+
+
+def test_partial_numbers_at_chunk_boundary():
+    assert split_everywhere('[2.5, 1e5, {"instruction": "a", "output": "b"}]') == ("alpaca", 3, 2)
+
+
+def test_malformed_element_is_an_invalid_record():
+    assert validate('[{"instruction": "a", "output": "b"}, 2.5x, {"instruction": x}]') == ("alpaca", 3, 2)
+
+
+@pytest.mark.parametrize("data, message", [
+    ('[{"instruction": "a", "output": "b"},]', "多余的逗号"),
+    ('[{"instruction": "a", "output": "b"}', "不完整"),
+    ('[{"instruction": "a", "output": "b"}] x', "多余的内容"),
+    (b'[{"instruction": "\xff", "output": "b"}]', "UTF-8"),
+])
+def test_structural_errors(data, message):
+    with pytest.raises(DatasetValidationError, match=message):
+        validate(data)
+
+
+def test_record_size_limit_counts_utf8_bytes(monkeypatch):
+    monkeypatch.setattr(settings, "dataset_max_record_bytes", 100)
+    # 40 个汉字只有 40 个字符，但有 120 字节
+    data = json.dumps([{"instruction": "汉" * 40, "output": "b"}], ensure_ascii=False)
+    with pytest.raises(DatasetValidationError, match="100 字节"):
+        validate(data, step=16)
+    assert validate(json.dumps([{"instruction": "a" * 40, "output": "b"}]), step=16) == ("alpaca", 1, 0)
+
+
+def test_check_rejects_invalid_ratio(monkeypatch):
+    monkeypatch.setattr(settings, "dataset_max_invalid_ratio", 0.5)
+    validator = DatasetValidator("data.json")
+    validator.feed(json.dumps(ALPACA[:2] + [{"instruction": "x"}]).encode())
+    validator.finish()
+    validator.check()
+    monkeypatch.setattr(settings, "dataset_max_invalid_ratio", 0.0)
+    with pytest.raises(DatasetValidationError, match="1/3"):
+        validator.check()
+
+
+def test_length_stats():
+    validator = DatasetValidator("data.jsonl")
+    validator.feed("\n".join(json.dumps({"instruction": "q" * i, "output": "a"}) for i in range(1, 101)).encode())
+    lengths = validator.finish()["lengths"]["instruction"]
+    assert (lengths["min"], lengths["max"], lengths["mean"]) == (1, 100, 50.5)
+    assert 45 <= lengths["p50"] <= 55
@@ -0,0 +1,132 @@
+import asyncio
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.config import settings, WorkerNode
+from app.db_models import Base, DatasetFileDB, DatasetReplicaDB, TaskDB, BatchInferenceJobDB
+from app.services import batch_inference_service as batch_inference_module
+from app.services import file_service as file_service_module
+from app.services.batch_inference_service import ALIVE_MARKER
+from app.services.file_service import FileService, DatasetInUseError
+
+BLOB = "/users/u1/datasets/blobs/abc.json"
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    """记录发往各节点的远程命令"""
+    commands = []
+
+    class FakeSSHService:
+        def __init__(self, node=None):
+            self.node = node
+
+        async def execute_command(self, command, **kwargs):
+            commands.append((self.node, command))
+            return "", "", 0
+
+        async def download_file(self, remote_path, local_path):
+            commands.append((self.node, f"download {remote_path}"))
+
+        async def upload_file(self, local_path, remote_path):
+            commands.append((self.node, f"upload {remote_path}"))
+
+    monkeypatch.setattr(file_service_module, "AsyncSSHService", FakeSSHService)
+    monkeypatch.setattr(settings, "worker_shared_storage", False)
+    monkeypatch.setattr(settings, "worker_nodes", [WorkerNode(name="n1", host="h1"), WorkerNode(name="n2", host="h2")])
+    return commands
+
+
+@pytest.fixture
+def batch_progress(monkeypatch):
+    """批量推理任务进度查询的远程输出（默认进程仍在运行）"""
+    progress = {"stdout": f'{{"status": "running"}}\n{ALIVE_MARKER}\n'}
+
+    class FakeSSHService:
+        def __init__(self, node=None):
+            self.node = node
+
+        async def execute_command(self, command, **kwargs):
+            return progress["stdout"], "", 0
+
+    monkeypatch.setattr(batch_inference_module, "AsyncSSHService", FakeSSHService)
+    return progress
+
+
+def add_dataset(db, filename="a.json"):
+    record = DatasetFileDB(user_id="u1", filename=filename, file_path=BLOB, size=10, checksum="abc", node="n1")
+    db.add(record)
+    db.commit()
+    return record
+
+
+def delete(db, record):
+    return asyncio.run(FileService().delete_dataset_file(db, record.file_id, "u1"))
+
+
+def test_stage_dataset_transfers_and_records_replica_once(db, remote):
+    add_dataset(db)
+    for _ in range(2):
+        asyncio.run(FileService().stage_dataset(db, "u1", BLOB, "n2"))
+    asyncio.run(FileService().stage_dataset(db, "u1", BLOB, "n1"))
+    assert [(r.node, r.file_path) for r in db.query(DatasetReplicaDB).all()] == [("n2", BLOB)]
+    assert remote == [("n1", f"download {BLOB}"), ("n2", f"upload {BLOB}")]
+
+
+def test_delete_removes_blob_and_replicas(db, remote):
+    record = add_dataset(db)
+    asyncio.run(FileService().stage_dataset(db, "u1", BLOB, "n2"))
+    remote.clear()
+    assert delete(db, record)
+    assert db.query(DatasetFileDB).count() == 0
+    assert db.query(DatasetReplicaDB).count() == 0
+    assert sorted(remote) == [("n1", f"rm -f {BLOB}"), ("n2", f"rm -f {BLOB}")]
+
+
+def test_delete_keeps_blob_shared_with_other_records(db, remote):
+    record = add_dataset(db, "a.json")
+    add_dataset(db, "copy.json")
+    db.add(TaskDB(user_id="u1", name="t", model_name="m", dataset_path=BLOB, output_dir="/o", status="running"))
+    db.commit()
+    assert delete(db, record)
+    assert db.query(DatasetFileDB).count() == 1
+    assert remote == []
+
+
+@pytest.mark.parametrize("active", [
+    TaskDB(user_id="u1", name="t", model_name="m", dataset_path=BLOB, output_dir="/o", status="queued"),
+    BatchInferenceJobDB(user_id="u1", name="b", model_path="/m", dataset_path=BLOB, output_dir="/o", status="running"),
+])
+def test_delete_refuses_dataset_used_by_active_jobs(db, remote, batch_progress, active):
+    record = add_dataset(db)
+    db.add(active)
+    db.commit()
+    with pytest.raises(DatasetInUseError):
+        delete(db, record)
+    assert db.query(DatasetFileDB).count() == 1
+    assert remote == []
+
+    active.status = "completed"
+    db.commit()
+    assert delete(db, record)
+    assert remote == [("n1", f"rm -f {BLOB}")]
+
+
+def test_delete_refreshes_batch_jobs_that_finished_unobserved(db, remote, batch_progress):
+    record = add_dataset(db)
+    job = BatchInferenceJobDB(user_id="u1", name="b", model_path="/m", dataset_path=BLOB, output_dir="/o", status="running")
+    db.add(job)
+    db.commit()
+    batch_progress["stdout"] = '{"status": "completed", "total": 3, "completed": 3}\n'
+    assert delete(db, record)
+    assert job.status == "completed"
+    assert remote == [("n1", f"rm -f {BLOB}")]
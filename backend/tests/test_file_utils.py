@@ -0,0 +1,66 @@
+import asyncio
+import pytest
+from app.utils.file_utils import MultipartFileReader
+
+BOUNDARY = "----testboundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def build_body(parts) -> bytes:
+    """parts: [(字段名, 文件名或 None, 内容)]"""
+    body = b""
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename is not None else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n".encode()
+        if filename is not None:
+            body += b"Content-Type: application/octet-stream\r\n"
+        body += b"\r\n" + content + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+async def split(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def read_file(body: bytes, chunk_size: int, content_type: str = CONTENT_TYPE):
+    async def run():
+        reader = MultipartFileReader(content_type, split(body, chunk_size))
+        filename = await reader.read_header()
+        return filename, b"".join([chunk async for chunk in reader.chunks()])
+    return asyncio.run(run())
+
+
+CONTENT = b'[{"instruction": "\xe4\xbd\xa0\xe5\xa5\xbd", "output": "hi"}]\r\n--not-a-boundary\r\n' * 50
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+def test_reads_file_field_across_chunk_boundaries(chunk_size):
+    body = build_body([("note", None, b"ignored"), ("file", "数据.json", CONTENT), ("extra", "other.txt", b"x")])
+    assert read_file(body, chunk_size) == ("数据.json", CONTENT)
+
+
+def test_ignores_file_field_without_filename_and_other_files():
+    body = build_body([("file", None, b"plain value"), ("other", "a.json", b"A"), ("file", "b.json", b"B")])
+    assert read_file(body, 5) == ("b.json", b"B")
+
+
+def test_empty_file():
+    assert read_file(build_body([("file", "empty.json", b"")]), 3) == ("empty.json", b"")
+
+
+def test_missing_file_field():
+    with pytest.raises(ValueError, match="缺少文件字段"):
+        read_file(build_body([("other", "a.json", b"A")]), 16)
+
+
+def test_truncated_body():
+    body = build_body([("file", "a.json", CONTENT)])
+    with pytest.raises(ValueError, match="不完整"):
+        read_file(body[:len(body) // 2], 16)
+
+
+@pytest.mark.parametrize("content_type", [None, "application/json", "multipart/form-data"])
+def test_rejects_non_multipart_requests(content_type):
+    with pytest.raises(ValueError, match="multipart"):
+        MultipartFileReader(content_type, split(b"", 1))
@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from app.config import settings
+from app.services.response_cache_service import ResponseCache, is_deterministic, normalize_messages
+
+
+def config(**overrides):
+    base = {
+        "adapter_path": "/users/u1/models/m1",
+        "base_model_path": "/models/qwen",
+        "messages": [{"role": "user", "content": "你好"}],
+        "max_tokens": 256,
+        "temperature": 0,
+    }
+    base.update(overrides)
+    return base
+
+
+def test_is_deterministic():
+    assert is_deterministic(0)
+    assert is_deterministic(-0.5)
+    assert not is_deterministic(None)
+    assert not is_deterministic(0.7)
+
+
+def test_normalize_messages():
+    assert normalize_messages([{"role": " User ", "content": "  a\r\nb \n"}, {"role": None, "content": None}]) == [
+        {"role": "user", "content": "a\nb"},
+        {"role": "", "content": ""},
+    ]
+
+
+def test_build_key_ignores_formatting_and_non_generation_fields():
+    key = ResponseCache.build_key(config(), "qwen2", "v1")
+    same = ResponseCache.build_key(
+        config(messages=[{"role": "USER", "content": " 你好\r\n"}], temperature=-1, session_id="s"), "qwen2", "v1"
+    )
+    assert key == same
+
+
+@pytest.mark.parametrize("changes", [
+    {"config": {"adapter_path": "/users/u1/models/m2"}},
+    {"config": {"base_model_path": "/models/llama"}},
+    {"config": {"messages": [{"role": "user", "content": "你好吗"}]}},
+    {"config": {"messages": [{"role": "system", "content": "你好"}]}},
+    {"config": {"max_tokens": 512}},
+    {"template": "llama3"},
+    {"version": "v2"},
+])
+def test_build_key_changes_with_generation_inputs(changes):
+    key = ResponseCache.build_key(config(), "qwen2", "v1")
+    changed = ResponseCache.build_key(
+        config(**changes.get("config", {})), changes.get("template", "qwen2"), changes.get("version", "v1")
+    )
+    assert key != changed
+
+
+def test_build_key_depends_on_chat_mode(monkeypatch):
+    key = ResponseCache.build_key(config(), "qwen2", "v1")
+    monkeypatch.setattr(settings, "chat_mode", "other")
+    assert ResponseCache.build_key(config(), "qwen2", "v1") != key
+
+
+def test_cache_lru_eviction_and_model_invalidation(monkeypatch):
+    monkeypatch.setattr(settings, "chat_cache_max_entries", 2)
+    monkeypatch.setattr(settings, "chat_cache_ttl", 3600)
+    cache = ResponseCache()
+    cache.put("a", "/m1", "A")
+    cache.put("b", "/m2", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "/m1", "C")
+    assert cache.get("b") is None
+    cache.invalidate_model("/m1")
+    assert cache.get("a") is None and cache.get("c") is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"], stats["evictions"], stats["invalidations"]) == (0, 1, 3, 1, 2)
+
+
+def test_artifact_version_quotes_model_path():
+    commands = []
+
+    class FakeSSHService:
+        node = "n1"
+
+        async def execute_command(self, command, **kwargs):
+            commands.append(command)
+            return "adapter_config.json 10 1700000000\n", "", 0
+
+    asyncio.run(ResponseCache().artifact_version(FakeSSHService(), "/users/u1/models/m 1; rm -rf ~"))
+    assert commands[0].startswith("cd '/users/u1/models/m 1; rm -rf ~' && stat ")
@@ -0,0 +1,41 @@
+import subprocess
+from app.services.ssh_service import build_pipeline_script, parse_pipeline_output
+
+
+def run_pipeline_locally(steps, stop_on_error=True):
+    """用本地 bash 执行流水线脚本（与远程 bash -s 相同）"""
+    script, marker = build_pipeline_script(steps, stop_on_error)
+    result = subprocess.run(["bash", "-s"], input=script, capture_output=True, text=True, timeout=30)
+    return parse_pipeline_output(result.stdout, result.stderr, marker, len(steps))
+
+
+def test_pipeline_returns_output_per_step():
+    results = run_pipeline_locally(["echo one", "echo two; echo err >&2", "printf 'no newline'"])
+    assert results == [("one", "", 0), ("two", "err", 0), ("no newline", "", 0)]
+
+
+def test_pipeline_stops_on_error():
+    results = run_pipeline_locally(["echo ok", "echo bad >&2; (exit 3)", "echo never"])
+    assert results == [("ok", "", 0), ("", "bad", 3)]
+
+
+def test_pipeline_continues_when_not_stopping_on_error():
+    results = run_pipeline_locally(["false", "echo after"], stop_on_error=False)
+    assert results == [("", "", 1), ("after", "", 0)]
+
+
+def test_pipeline_steps_share_shell_state():
+    results = run_pipeline_locally(["cd /tmp", "pwd"])
+    assert results[1] == ("/tmp", "", 0)
+
+
+def test_pipeline_step_cannot_consume_later_steps_from_stdin():
+    results = run_pipeline_locally(["cat", "echo still-running"])
+    assert results == [("", "", 0), ("still-running", "", 0)]
+
+
+def test_parse_pipeline_output_ignores_marker_like_text_and_missing_steps():
+    marker = "__PIPELINE_x__"
+    stdout = f"noise\n{marker} BEGIN 0\nline\n\n{marker} END 0 0\n"
+    stderr = f"{marker} BEGIN 0\n\n{marker} END 0 0\n"
+    assert parse_pipeline_output(stdout, stderr, marker, 2) == [("line", "", 0)]
@@ -0,0 +1,105 @@
+import asyncio
+import subprocess
+from types import SimpleNamespace
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db_models import Base, BatchInferenceJobDB
+from app.services import batch_inference_service as batch_inference_module
+from app.services import task_monitor as task_monitor_module
+from app.services.batch_inference_service import ALIVE_MARKER
+from app.services.task_monitor import TaskMonitor, build_probe_script, parse_probe_output
+from app.services.task_service import EXIT_CODE_FILE
+
+
+def make_task(task_id, output_dir, process_id=None):
+    return SimpleNamespace(task_id=task_id, process_id=process_id, output_dir=str(output_dir))
+
+
+def probe_locally(tasks):
+    """用本地 bash 执行探测脚本，返回解析后的状态"""
+    result = subprocess.run(["bash", "-s"], input=build_probe_script(tasks), capture_output=True, text=True, timeout=30)
+    return parse_probe_output(result.stdout)
+
+
+def test_parse_probe_output():
+    stdout = "a exit 0\nb exit 137\nc running\nd dead\ne unknown\nf exit\ng exit x\n\nnoise\n"
+    assert parse_probe_output(stdout) == {
+        "a": ("exit", 0),
+        "b": ("exit", 137),
+        "c": ("running", None),
+        "d": ("dead", None),
+        "e": ("unknown", None),
+        "f": ("exit", None),
+        "g": ("exit", None),
+    }
+
+
+def test_probe_reports_each_task_state(tmp_path):
+    dirs = {name: tmp_path / name for name in ["exited", "failed", "running", "dead", "sentinel", "unknown"]}
+    for path in dirs.values():
+        path.mkdir()
+    (dirs["exited"] / EXIT_CODE_FILE).write_text("0\n")
+    (dirs["failed"] / EXIT_CODE_FILE).write_text("2\n")
+    (dirs["sentinel"] / "train.log").write_text("step 10\nTraining completed\n")
+
+    sleeper = subprocess.Popen(["sleep", "30"])
+    finished = subprocess.Popen(["true"])
+    finished.wait()
+    try:
+        states = probe_locally([
+            make_task("exited", dirs["exited"], "1"),
+            make_task("failed", dirs["failed"]),
+            make_task("running", dirs["running"], str(sleeper.pid)),
+            make_task("dead", dirs["dead"], str(finished.pid)),
+            make_task("sentinel", dirs["sentinel"], str(finished.pid)),
+            make_task("unknown", dirs["unknown"]),
+        ])
+    finally:
+        sleeper.kill()
+        sleeper.wait()
+
+    assert states == {
+        "exited": ("exit", 0),
+        "failed": ("exit", 2),
+        "running": ("running", None),
+        "dead": ("dead", None),
+        "sentinel": ("exit", 0),
+        "unknown": ("unknown", None),
+    }
+
+
+def test_probe_without_any_pid(tmp_path):
+    assert probe_locally([make_task("t1", tmp_path)]) == {"t1": ("unknown", None)}
+
+
+def test_check_batch_jobs_refreshes_running_jobs(monkeypatch):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(task_monitor_module, "SessionLocal", Session)
+    outputs = {
+        "/o/done": '{"status": "completed", "total": 2, "completed": 2}\n',
+        "/o/busy": f'{{"status": "running", "total": 2, "completed": 1}}\n{ALIVE_MARKER}\n',
+    }
+
+    class FakeSSHService:
+        def __init__(self, node=None):
+            self.node = node
+
+        async def execute_command(self, command, **kwargs):
+            return next(out for path, out in outputs.items() if path in command), "", 0
+
+    monkeypatch.setattr(batch_inference_module, "AsyncSSHService", FakeSSHService)
+    db = Session()
+    for name in ["done", "busy"]:
+        db.add(BatchInferenceJobDB(user_id="u1", name=name, model_path="/m", dataset_path="/d",
+                                   output_dir=f"/o/{name}", status="running"))
+    db.commit()
+
+    asyncio.run(TaskMonitor(60).check_batch_jobs())
+
+    db.expire_all()
+    assert {(j.name, j.status, j.completed) for j in db.query(BatchInferenceJobDB).all()} == {
+        ("done", "completed", 2),
+        ("busy", "running", 1),
+    }
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.config import settings, WorkerNode
+from app.db_models import Base, TaskDB, DatasetFileDB
+from app.services.task_scheduler import GPUPool, TaskScheduler, parse_gpu_ids
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    """配置调度节点，参数为 [(名称, GPU卡数, 单卡显存, 是否启用)]"""
+    def configure(*specs):
+        monkeypatch.setattr(settings, "worker_nodes", [
+            WorkerNode(name=name, host=name, gpu_slots=slots, gpu_memory_mb=memory, enabled=enabled)
+            for name, slots, memory, enabled in specs
+        ])
+    monkeypatch.setattr(settings, "scheduler_default_task_memory_mb", 0)
+    monkeypatch.setattr(settings, "scheduler_max_running_per_user", 0)
+    return configure
+
+
+_start = datetime(2024, 1, 1)
+
+def add_task(db, task_id, user_id, status="queued", priority=0, gpu_count=1, gpu_memory_mb=None,
+             node=None, gpu_ids=None, dataset_path="/data/a.json", minutes=0):
+    task = TaskDB(
+        task_id=task_id, user_id=user_id, name=task_id, model_name="m", dataset_path=dataset_path,
+        output_dir=f"/out/{task_id}", status=status, priority=priority, gpu_count=gpu_count,
+        gpu_memory_mb=gpu_memory_mb, node=node, gpu_ids=gpu_ids,
+        created_at=_start + timedelta(minutes=minutes)
+    )
+    db.add(task)
+    db.commit()
+    return task
+
+
+def select_ids(db):
+    return [t.task_id for t in TaskScheduler()._select(db)]
+
+
+def test_parse_gpu_ids():
+    assert parse_gpu_ids(None) == []
+    assert parse_gpu_ids("0, 2,x,") == [0, 2]
+
+
+def test_exclusive_pool_places_one_task_per_gpu():
+    pool = GPUPool(slots=2, memory_mb=0, default_task_memory_mb=0)
+    task = SimpleNamespace(gpu_count=1, gpu_memory_mb=None)
+    assert pool.place(task) == [0]
+    pool.reserve(task, [0])
+    assert pool.place(task) == [1]
+    pool.reserve(task, [1])
+    assert pool.place(task) is None
+    assert pool.free_ratio() == 0.0
+
+
+def test_memory_pool_prefers_tightest_fitting_gpu():
+    pool = GPUPool(slots=3, memory_mb=80000, default_task_memory_mb=20000)
+    pool.reserve(SimpleNamespace(gpu_memory_mb=60000), [0])
+    pool.reserve(SimpleNamespace(gpu_memory_mb=30000), [2])
+    # GPU0 剩 20000，GPU2 剩 50000：20000 的任务放到 GPU0，减少碎片
+    assert pool.place(SimpleNamespace(gpu_count=1, gpu_memory_mb=None)) == [0]
+    assert pool.place(SimpleNamespace(gpu_count=1, gpu_memory_mb=40000)) == [2]
+    assert pool.place(SimpleNamespace(gpu_count=2, gpu_memory_mb=50000)) == [1, 2]
+    assert pool.place(SimpleNamespace(gpu_count=2, gpu_memory_mb=60000)) is None
+    # 超过单卡显存的需求按整卡计算
+    assert pool.memory_need(SimpleNamespace(gpu_memory_mb=100000)) == 80000
+
+
+def test_select_orders_by_priority_then_submit_time(db, nodes):
+    nodes(("n1", 2, 0, True))
+    add_task(db, "old", "u1", minutes=0)
+    add_task(db, "new", "u2", minutes=1)
+    add_task(db, "urgent", "u3", priority=5, minutes=2)
+    assert select_ids(db) == ["urgent", "old"]
+    assert db.query(TaskDB).filter(TaskDB.task_id == "new").one().status == "queued"
+
+
+def test_select_alternates_between_users(db, nodes):
+    nodes(("n1", 3, 0, True))
+    for i in range(3):
+        add_task(db, f"a{i}", "alice", minutes=i)
+    add_task(db, "b0", "bob", minutes=10)
+    assert select_ids(db) == ["a0", "b0", "a1"]
+
+
+def test_select_counts_running_tasks_in_fair_share(db, nodes):
+    nodes(("n1", 3, 0, True))
+    add_task(db, "running", "alice", status="running", node="n1", gpu_ids="0")
+    add_task(db, "a1", "alice", minutes=0)
+    add_task(db, "b1", "bob", minutes=5)
+    assert select_ids(db) == ["b1", "a1"]
+
+
+def test_select_respects_per_user_limit(db, nodes, monkeypatch):
+    nodes(("n1", 4, 0, True))
+    monkeypatch.setattr(settings, "scheduler_max_running_per_user", 1)
+    add_task(db, "a0", "alice", minutes=0)
+    add_task(db, "a1", "alice", minutes=1)
+    add_task(db, "b0", "bob", minutes=2)
+    assert select_ids(db) == ["a0", "b0"]
+
+
+def test_select_skips_tasks_that_do_not_fit(db, nodes):
+    nodes(("n1", 2, 0, True))
+    add_task(db, "running", "alice", status="running", node="n1", gpu_ids="1")
+    add_task(db, "big", "bob", priority=1, gpu_count=2)
+    add_task(db, "small", "carol")
+    selected = TaskScheduler()._select(db)
+    assert [(t.task_id, t.node, t.gpu_ids, t.status) for t in selected] == [("small", "n1", "0", "pending")]
+
+
+def test_select_prefers_dataset_node_then_most_free_node(db, nodes):
+    nodes(("n1", 2, 0, True), ("n2", 4, 0, True), ("off", 8, 0, False))
+    db.add(DatasetFileDB(user_id="alice", filename="a.json", file_path="/data/a.json", size=10, node="n1"))
+    db.commit()
+    add_task(db, "local", "alice", dataset_path="/data/a.json", minutes=0)
+    add_task(db, "other", "bob", dataset_path="/data/b.json", minutes=1)
+    placements = {t.task_id: t.node for t in TaskScheduler()._select(db)}
+    assert placements == {"local": "n1", "other": "n2"}
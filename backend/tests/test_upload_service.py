@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.db_models import Base, UploadSessionDB
+from app.services import upload_service as upload_service_module
+from app.services.upload_service import ChunkedUploadService, COMPLETING, UPLOADING
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    commands = []
+
+    class FakeSSHService:
+        def __init__(self, node=None):
+            self.node = node
+
+        async def execute_command(self, command, **kwargs):
+            commands.append(command)
+            return "", "", 0
+
+    monkeypatch.setattr(upload_service_module, "AsyncSSHService", FakeSSHService)
+    return commands
+
+
+def add_session(db, status, age_hours):
+    session = UploadSessionDB(
+        user_id="u1", filename="a.json", size=10, chunk_size=5, checksum="abc",
+        staging_dir=f"/staging/{status}", node="n1", status=status,
+        created_at=datetime.utcnow() - timedelta(hours=age_hours)
+    )
+    db.add(session)
+    db.commit()
+    return session
+
+
+def test_purge_expired_skips_sessions_being_merged(db, remote):
+    add_session(db, UPLOADING, 100)
+    merging = add_session(db, COMPLETING, 100)
+    add_session(db, UPLOADING, 0)
+    asyncio.run(ChunkedUploadService()._purge_expired(db, "u1"))
+    remaining = {(s.status, s.staging_dir) for s in db.query(UploadSessionDB).all()}
+    assert remaining == {(COMPLETING, merging.staging_dir), (UPLOADING, "/staging/uploading")}
+    assert remote == ["rm -rf /staging/uploading"]
@@ -5,12 +5,17 @@ import { ChatMessage } from '../types/chat';
 import { Layout } from '../components/Layout';
 import './Chat.css';
 
+// crypto.randomUUID 只在 HTTPS 下可用，会话ID只需在用户内唯一
+const newSessionId = () => `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+
 export const Chat = () => {
   const [models, setModels] = useState<ModelFile[]>([]);
   const [selectedModel, setSelectedModel] = useState<string>('');
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [inputMessage, setInputMessage] = useState('');
   const [loading, setLoading] = useState(false);
+  // 服务端会话：历史由服务端保存，推理进程复用对话前缀的KV cache，每轮只发送新消息
+  const [sessionId, setSessionId] = useState(newSessionId);
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const textareaRef = useRef<HTMLTextAreaElement>(null);
 
@@ -52,12 +57,20 @@ export const Chat = () => {
       textareaRef.current.style.height = 'auto';
     }
 
+    // 逐段追加到助手消息中，收到第一段内容前显示输入提示
+    let reply = '';
     try {
-      const response = await chatApi.completion({
-        model_path: selectedModel,
-        messages: newMessages,
-      });
-      setMessages([...newMessages, response]);
+      await chatApi.streamCompletion(
+        {
+          model_path: selectedModel,
+          messages: [userMessage],
+          session_id: sessionId,
+        },
+        (content) => {
+          reply += content;
+          setMessages([...newMessages, { role: 'assistant', content: reply }]);
+        }
+      );
     } catch (error: any) {
       alert('发送消息失败: ' + (error.response?.data?.detail || error.message));
     } finally {
@@ -65,6 +78,16 @@ export const Chat = () => {
     }
   };
 
+  // 切换模型时开始新的会话
+  const changeModel = (modelPath: string) => {
+    if (messages.length > 0) {
+      chatApi.endSession(sessionId).catch(() => undefined);
+      setMessages([]);
+      setSessionId(newSessionId());
+    }
+    setSelectedModel(modelPath);
+  };
+
   const handleKeyDown = (e: React.KeyboardEvent<HTMLTextAreaElement>) => {
     if (e.key === 'Enter' && !e.shiftKey) {
       e.preventDefault();
@@ -88,7 +111,7 @@ export const Chat = () => {
           <div className="chat-controls">
             <select
               value={selectedModel}
-              onChange={(e) => setSelectedModel(e.target.value)}
+              onChange={(e) => changeModel(e.target.value)}
               className="model-select"
               disabled={loading}
             >
@@ -125,7 +148,7 @@ export const Chat = () => {
                 </div>
               ))
             )}
-            {loading && (
+            {loading && messages[messages.length - 1]?.role !== 'assistant' && (
               <div className="message message-assistant loading-message">
                 <div className="message-avatar">🤖</div>
                 <div className="message-content">
@@ -8,6 +8,7 @@ export const Datasets = () => {
   const [datasets, setDatasets] = useState<DatasetFile[]>([]);
   const [loading, setLoading] = useState(true);
   const [uploading, setUploading] = useState(false);
+  const [uploadProgress, setUploadProgress] = useState<string | null>(null);
   const [generating, setGenerating] = useState(false);
   const [showGenerateForm, setShowGenerateForm] = useState(false);
   const [topic, setTopic] = useState('');
@@ -34,13 +35,17 @@ export const Datasets = () => {
 
     setUploading(true);
     try {
-      await fileApi.uploadDataset(file);
+      await fileApi.uploadDataset(file, (done, total) => {
+        setUploadProgress(`${Math.floor((done / total) * 100)}%`);
+      });
       await loadDatasets();
       alert('上传成功');
     } catch (error: any) {
       alert('上传失败: ' + (error.response?.data?.detail || error.message));
     } finally {
       setUploading(false);
+      setUploadProgress(null);
+      e.target.value = '';
     }
   };
 
@@ -104,7 +109,7 @@ export const Datasets = () => {
               {uploading ? (
                 <>
                   <span className="loading-spinner"></span>
-                  上传中...
+                  上传中{uploadProgress ? ` ${uploadProgress}` : '...'}
                 </>
               ) : (
                 <>
@@ -193,6 +198,7 @@ export const Datasets = () => {
                   <tr>
                     <th>文件名</th>
                     <th>大小</th>
+                    <th>记录数</th>
                     <th>上传时间</th>
                     <th>操作</th>
                   </tr>
@@ -207,6 +213,20 @@ export const Datasets = () => {
                         </div>
                       </td>
                       <td className="text-muted">{formatSize(dataset.size)}</td>
+                      <td className="text-muted">
+                        {dataset.record_count != null ? (
+                          <span
+                            title={Object.entries(dataset.stats?.lengths ?? {})
+                              .map(([field, s]) => `${field}: p50 ${s.p50} / p90 ${s.p90} / max ${s.max}`)
+                              .join('\n')}
+                          >
+                            {dataset.record_count}
+                            {dataset.stats?.format ? ` (${dataset.stats.format})` : ''}
+                          </span>
+                        ) : (
+                          '-'
+                        )}
+                      </td>
                       <td className="text-muted">
                         {new Date(dataset.created_at).toLocaleString('zh-CN')}
                       </td>
@@ -30,6 +30,7 @@ export const Home = () => {
       running: { label: '运行中', className: 'badge-info' },
       failed: { label: '失败', className: 'badge-error' },
       pending: { label: '等待中', className: 'badge-warning' },
+      queued: { label: '排队中', className: 'badge-warning' },
     };
     
     const statusInfo = statusMap[status] || { label: status, className: 'badge-gray' };
@@ -5,10 +5,14 @@ import { Task } from '../types/task';
 import { Layout } from '../components/Layout';
 import './TaskDetail.css';
 
+const LOG_TAIL_LINES = 500;
+
 export const TaskDetail = () => {
   const { taskId } = useParams<{ taskId: string }>();
   const [task, setTask] = useState<Task | null>(null);
   const [logs, setLogs] = useState('');
+  // 下次增量读取日志的起始偏移（null 表示尚未加载过日志）
+  const [logOffset, setLogOffset] = useState<number | null>(null);
   const [showLogs, setShowLogs] = useState(false);
   const [loading, setLoading] = useState(true);
   const [loadingLogs, setLoadingLogs] = useState(false);
@@ -20,6 +24,19 @@ export const TaskDetail = () => {
     }
   }, [taskId]);
 
+  // 任务运行中且日志面板打开时，通过 SSE 实时追加新日志
+  const following = showLogs && logOffset !== null && task?.status === 'running';
+  useEffect(() => {
+    if (!following || !taskId || logOffset === null) return;
+    const source = taskApi.streamTaskLogs(taskId, logOffset, (data) => {
+      setLogs((prev) => prev + data.logs);
+      setLogOffset(data.next_offset);
+    });
+    return () => source.close();
+    // 只在开始/停止跟踪时重新建立连接，偏移变化不需要重连
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [following, taskId]);
+
   const loadTask = async () => {
     try {
       const data = await taskApi.getTask(taskId!);
@@ -35,8 +52,17 @@ export const TaskDetail = () => {
     if (!taskId) return;
     setLoadingLogs(true);
     try {
-      const data = await taskApi.getTaskLogs(taskId);
-      setLogs(data.logs);
+      // 首次只加载最后若干行，之后只拉取新增内容并追加
+      if (logOffset === null) {
+        const data = await taskApi.getTaskLogs(taskId, { tail: LOG_TAIL_LINES });
+        setLogs(data.logs);
+        setLogOffset(data.next_offset);
+      } else {
+        const data = await taskApi.getTaskLogs(taskId, { offset: logOffset });
+        // 日志文件被重写时服务端会从头返回
+        setLogs((prev) => (data.offset < logOffset ? data.logs : prev + data.logs));
+        setLogOffset(data.next_offset);
+      }
       setShowLogs(true);
     } catch (error) {
       console.error('加载日志失败', error);
@@ -51,6 +77,7 @@ export const TaskDetail = () => {
       running: { label: '运行中', className: 'badge-info' },
       failed: { label: '失败', className: 'badge-error' },
       pending: { label: '等待中', className: 'badge-warning' },
+      queued: { label: '排队中', className: 'badge-warning' },
     };
     
     const statusInfo = statusMap[status] || { label: status, className: 'badge-gray' };
@@ -102,7 +129,7 @@ export const TaskDetail = () => {
                   加载中...
                 </>
               ) : (
-                '📋 查看日志'
+                logOffset === null ? '📋 查看日志' : '🔄 刷新日志'
               )}
             </button>
           </div>
@@ -1,10 +1,24 @@
 import axios from 'axios';
-import { Task, TaskCreate } from '../types/task';
-import { DatasetFile, ModelFile } from '../types/file';
+import { Task, TaskCreate, TaskLogs, TaskLogsQuery } from '../types/task';
+import { DatasetFile, ModelFile, UploadSession } from '../types/file';
 import { ChatRequest, ChatResponse } from '../types/chat';
 
 const API_BASE_URL = '/api';
 
+// 超过该大小的数据集文件分块上传：分块并行上传、失败的分块单独重试、中断后再次上传同一文件时续传
+const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const CHUNK_UPLOAD_CONCURRENCY = 4;
+const CHUNK_UPLOAD_RETRIES = 3;
+// 上传前计算 SHA-256 用于秒传的最大文件大小（浏览器需要把整个文件读入内存）
+const CHECKSUM_MAX_SIZE = 256 * 1024 * 1024;
+
+// 文件内容的 SHA-256；crypto.subtle 只在 HTTPS 或 localhost 下可用，不可用或文件过大时返回 null
+const sha256Hex = async (file: File): Promise<string | null> => {
+  if (!window.crypto?.subtle || file.size > CHECKSUM_MAX_SIZE) return null;
+  const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+};
+
 // 创建 axios 实例
 const api = axios.create({
   baseURL: API_BASE_URL,
@@ -54,11 +68,25 @@ export const taskApi = {
     return response.data;
   },
 
-  async getTaskLogs(taskId: string): Promise<{ logs: string }> {
-    const response = await api.get<{ logs: string }>(`/tasks/${taskId}/logs`);
+  async getTaskLogs(taskId: string, query?: TaskLogsQuery): Promise<TaskLogs> {
+    const response = await api.get<TaskLogs>(`/tasks/${taskId}/logs`, { params: query });
     return response.data;
   },
 
+  // 实时日志流（SSE）。EventSource 无法设置请求头，token 通过查询参数传递
+  streamTaskLogs(taskId: string, offset: number, onLogs: (data: TaskLogs) => void): EventSource {
+    const params = new URLSearchParams({
+      offset: String(offset),
+      access_token: localStorage.getItem('token') || '',
+    });
+    const source = new EventSource(`${API_BASE_URL}/tasks/${taskId}/logs/stream?${params}`);
+    source.addEventListener('log', (event) => {
+      onLogs(JSON.parse((event as MessageEvent).data));
+    });
+    source.addEventListener('end', () => source.close());
+    return source;
+  },
+
   async getAvailableModels(): Promise<AvailableModel[]> {
     const response = await api.get<AvailableModel[]>('/tasks/models');
     return response.data;
@@ -66,7 +94,23 @@ export const taskApi = {
 };
 
 export const fileApi = {
-  async uploadDataset(file: File): Promise<DatasetFile> {
+  async uploadDataset(file: File, onProgress?: (done: number, total: number) => void): Promise<DatasetFile> {
+    // 秒传：已上传过内容相同的文件时直接登记，不再传输
+    const checksum = await sha256Hex(file);
+    if (checksum) {
+      try {
+        const response = await api.post<DatasetFile>('/files/datasets/by-checksum', {
+          filename: file.name,
+          checksum,
+        });
+        return response.data;
+      } catch (error: any) {
+        if (error.response?.status !== 404) throw error;
+      }
+    }
+    if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+      return fileApi.uploadDatasetChunked(file, onProgress, checksum);
+    }
     const formData = new FormData();
     formData.append('file', file);
     const response = await api.post<DatasetFile>('/files/datasets', formData, {
@@ -75,6 +119,65 @@ export const fileApi = {
     return response.data;
   },
 
+  async uploadDatasetChunked(
+    file: File,
+    onProgress?: (done: number, total: number) => void,
+    checksum?: string | null,
+  ): Promise<DatasetFile> {
+    // 同一文件上次未完成的上传会话仍存在时继续使用，只上传缺少的分块
+    const resumeKey = `upload:${file.name}:${file.size}:${file.lastModified}`;
+    let session: UploadSession | null = null;
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+      try {
+        session = (await api.get<UploadSession>(`/files/datasets/uploads/${savedId}`)).data;
+      } catch {
+        session = null;
+      }
+    }
+    if (!session) {
+      session = (await api.post<UploadSession>('/files/datasets/uploads', {
+        filename: file.name,
+        size: file.size,
+        checksum: checksum || undefined,
+      })).data;
+      localStorage.setItem(resumeKey, session.upload_id);
+    }
+
+    const { upload_id, chunk_size, total_chunks } = session;
+    const received = new Set(session.received);
+    const pending = Array.from({ length: total_chunks }, (_, i) => i).filter((i) => !received.has(i));
+    let done = received.size;
+    onProgress?.(done, total_chunks);
+
+    const putChunk = async (index: number) => {
+      const blob = file.slice(index * chunk_size, (index + 1) * chunk_size);
+      for (let attempt = 1; ; attempt++) {
+        try {
+          await api.put(`/files/datasets/uploads/${upload_id}/chunks/${index}`, blob, {
+            headers: { 'Content-Type': 'application/octet-stream' },
+          });
+          return;
+        } catch (error) {
+          if (attempt >= CHUNK_UPLOAD_RETRIES) throw error;
+          await new Promise((resolve) => setTimeout(resolve, 1000 * attempt));
+        }
+      }
+    };
+    const uploadNext = async () => {
+      for (let index = pending.shift(); index !== undefined; index = pending.shift()) {
+        await putChunk(index);
+        done += 1;
+        onProgress?.(done, total_chunks);
+      }
+    };
+    await Promise.all(Array.from({ length: Math.min(CHUNK_UPLOAD_CONCURRENCY, pending.length) }, uploadNext));
+
+    const response = await api.post<DatasetFile>(`/files/datasets/uploads/${upload_id}/complete`);
+    localStorage.removeItem(resumeKey);
+    return response.data;
+  },
+
   async getDatasets(): Promise<DatasetFile[]> {
     const response = await api.get<DatasetFile[]>('/files/datasets');
     return response.data;
@@ -108,5 +211,44 @@ export const chatApi = {
     const response = await api.post<ChatResponse>('/chat/completion', request);
     return response.data;
   },
+
+  async endSession(sessionId: string): Promise<void> {
+    await api.delete(`/chat/sessions/${sessionId}`);
+  },
+
+  // 流式对话（SSE）。需要 POST 请求体，使用 fetch 读取响应流，每收到一段内容调用 onDelta
+  async streamCompletion(request: ChatRequest, onDelta: (content: string) => void): Promise<void> {
+    const response = await fetch(`${API_BASE_URL}/chat/completion/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        Authorization: `Bearer ${localStorage.getItem('token') || ''}`,
+      },
+      body: JSON.stringify(request),
+    });
+    if (!response.ok || !response.body) {
+      const data = await response.json().catch(() => ({}));
+      throw new Error(data.detail || `请求失败: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split('\n\n');
+      buffer = events.pop() || '';
+      for (const event of events) {
+        const data = event.replace(/^data: /, '');
+        if (!data || data === '[DONE]') continue;
+        const chunk = JSON.parse(data);
+        if (chunk.error) throw new Error(chunk.error.message);
+        const content = chunk.choices?.[0]?.delta?.content;
+        if (content) onDelta(content);
+      }
+    }
+  },
 };
 
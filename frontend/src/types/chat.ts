@@ -8,10 +8,13 @@ export interface ChatRequest {
   messages: ChatMessage[];
   temperature?: number;
   max_tokens?: number;
+  // 服务端会话ID：指定后 messages 只需包含本轮的新消息
+  session_id?: string;
 }
 
 export interface ChatResponse {
   role: string;
   content: string;
+  session_id?: string;
 }
 
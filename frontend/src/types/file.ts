@@ -4,6 +4,37 @@ export interface DatasetFile {
   filename: string;
   file_path: string;
   size: number;
+  checksum?: string;
+  record_count?: number | null;
+  invalid_count?: number | null;
+  stats?: DatasetStats | null;
+  created_at: string;
+}
+
+export interface LengthStats {
+  min: number;
+  p50: number;
+  p90: number;
+  p99: number;
+  max: number;
+  mean: number;
+}
+
+export interface DatasetStats {
+  format: 'alpaca' | 'sharegpt' | null;
+  records: number;
+  invalid: number;
+  lengths: Record<string, LengthStats>;
+  errors: { index: number; error: string }[];
+}
+
+export interface UploadSession {
+  upload_id: string;
+  filename: string;
+  size: number;
+  chunk_size: number;
+  total_chunks: number;
+  received: number[];
   created_at: string;
 }
 
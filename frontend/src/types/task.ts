@@ -9,10 +9,26 @@ export interface Task {
   batch_size: number;
   output_dir: string;
   status: string;
+  priority: number;
+  gpu_count: number;
+  node?: string;        // 运行任务的节点
   created_at: string;
   updated_at: string;
 }
 
+export interface TaskLogs {
+  logs: string;
+  offset: number;       // 本次内容在日志文件中的起始字节偏移
+  next_offset: number;  // 下次增量读取时传入的 offset
+  file_size: number;
+}
+
+export interface TaskLogsQuery {
+  offset?: number;
+  limit?: number;
+  tail?: number;
+}
+
 export interface TaskCreate {
   name: string;
   model_name: string;
@@ -25,5 +41,9 @@ export interface TaskCreate {
   batch_size?: number;                // 默认 4
   gradient_accumulation_steps?: number; // 默认 4
   output_dir?: string;                // 默认由后端生成，可覆盖
+  // 调度参数
+  priority?: number;                  // 默认 0，越大越先启动
+  gpu_count?: number;                 // 默认 1
+  gpu_memory_mb?: number;             // 单卡显存需求（MB）
 }
 